@@ -0,0 +1,75 @@
+"""
+Compare the time taken to collect traceability reports from a synthetic source tree
+with a single process and with a process pool.
+
+Usage: python benchmarks/benchmark_collector.py [--files N] [--jobs N]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+from textwrap import dedent
+
+from pytraceability.collector import PyTraceabilityCollector
+from pytraceability.config import PyTraceabilityConfig
+
+_FILLER_FUNCTIONS_PER_FILE = 50
+
+
+def _write_source_tree(base_directory: Path, number_of_files: int) -> None:
+    filler = "".join(
+        dedent(f"""
+        def helper_{idx}(values):
+            return [value * {idx} for value in values if value % 2 == 0]
+        """)
+        for idx in range(_FILLER_FUNCTIONS_PER_FILE)
+    )
+    for idx in range(number_of_files):
+        package = base_directory / f"package_{idx % 20}"
+        package.mkdir(exist_ok=True)
+        (package / f"module_{idx}.py").write_text(
+            dedent(f"""\
+            from pytraceability.common import traceability
+
+            @traceability("KEY-{idx}", info="Requirement {idx}")
+            def decorated():
+                pass
+            """)
+            + filler
+        )
+
+
+def _time_collection(base_directory: Path, jobs: int) -> float:
+    # Without the cache, so every run extracts every file rather than timing cache hits
+    config = PyTraceabilityConfig(
+        base_directory=base_directory, jobs=jobs, no_cache=True
+    )
+    start = time.perf_counter()
+    PyTraceabilityCollector(config).collect()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        base_directory = Path(tmp_dir)
+        _write_source_tree(base_directory, args.files)
+        serial = _time_collection(base_directory, jobs=1)
+        parallel = _time_collection(base_directory, jobs=args.jobs)
+
+    print(f"{'files:':<16}{args.files}")
+    print(f"{'jobs=1:':<16}{serial:.2f}s")
+    print(f"{f'jobs={args.jobs}:':<16}{parallel:.2f}s")
+    print(f"{'speedup:':<16}{serial / parallel:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
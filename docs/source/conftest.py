@@ -1,3 +1,7 @@
+import os
+import shutil
+import tempfile
+from pathlib import Path
 from subprocess import check_output
 from textwrap import dedent
 
@@ -16,6 +20,26 @@ class BashCodeBlockParser(CodeBlockParser):
         assert actual == expected, repr(actual) + " != " + repr(expected)
 
 
+EXAMPLE_DIRECTORY = Path(__file__).parents[2] / "example"
+
+
+def setup(namespace):
+    # Run the examples from a copy of the example directory in a repo of its own, so
+    # that the cache they write isn't left in the checkout
+    namespace["_previous_directory"] = os.getcwd()
+    namespace["_working_directory"] = tempfile.mkdtemp()
+    shutil.copytree(
+        EXAMPLE_DIRECTORY, Path(namespace["_working_directory"]) / "example"
+    )
+    check_output(["git", "init", "--quiet", namespace["_working_directory"]])
+    os.chdir(namespace["_working_directory"])
+
+
+def teardown(namespace):
+    os.chdir(namespace["_previous_directory"])
+    shutil.rmtree(namespace["_working_directory"])
+
+
 pytest_collect_file = Sybil(
     parsers=[
         DocTestParser(),
@@ -23,4 +47,6 @@ pytest_collect_file = Sybil(
         PythonCodeBlockParser(future_imports=["print_function"]),
     ],
     pattern="*.rst",
+    setup=setup,
+    teardown=teardown,
 ).pytest()
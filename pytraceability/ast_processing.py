@@ -2,9 +2,15 @@ from __future__ import annotations
 
 import ast
 import datetime
+import functools
 import logging
+import re
+from collections import Counter
 from decimal import Decimal
+from enum import Enum
+from importlib.util import decode_source
 from pathlib import Path
+from typing import Any
 
 from typing_extensions import cast
 
@@ -14,11 +20,13 @@ from pytraceability.exceptions import (
 )
 from pytraceability.custom import pytraceability
 from pytraceability.data_definition import (
-    Traceability,
     RawCode,
+    ReportRecord,
     TraceabilityReport,
 )
 from pytraceability.config import PROJECT_NAME
+from pytraceability.constant_propagation import ModuleContext, Scope
+from pytraceability.source import SourceIndex, SourceSpan
 
 _log = logging.getLogger(__name__)
 
@@ -28,20 +36,85 @@ globals_ = {
     "Decimal": Decimal,
 }
 
+# The only fields that can hold statements, and so a decorated function or class.
+# Expressions (eg Lambda.body and IfExp.body) never need visiting.
+_STATEMENT_FIELDS = frozenset(("body", "orelse", "finalbody", "handlers", "cases"))
+
+
+class SourceScanResult(str, Enum):
+    NO_DECORATOR_NAME = "no-decorator-name"
+    DECORATOR_FOUND = "decorator-found"
+    INDIRECT_REFERENCE = "indirect-reference"
+
+
+def scan_source_for_decorator(source: bytes, decorator_name: str) -> SourceScanResult:
+    """
+    Cheaply check the raw bytes of a file for the decorator name, so that files which
+    can't contain a traceability decorator don't need to be decoded and parsed.
+
+    Source files must use an ASCII compatible encoding (PEP 263), so an ASCII
+    decorator name can be searched for in the raw bytes directly.
+    """
+    if decorator_name.isascii():
+        name = decorator_name.encode("ascii")
+        if name not in source:
+            return SourceScanResult.NO_DECORATOR_NAME
+        if re.search(rb"@[\s\\(]*" + re.escape(name) + rb"\b", source):
+            return SourceScanResult.DECORATOR_FOUND
+    # The name is referenced, but not obviously as a decorator (eg it's imported under
+    # an alias or the decorator is split over lines oddly), or it can't be searched
+    # for in the raw bytes. Either way, fall back to parsing the file.
+    return SourceScanResult.INDIRECT_REFERENCE
+
 
 class TraceabilityVisitor(ast.NodeVisitor):
-    def __init__(self, decorator_name: str, file_path: Path, source_code: str) -> None:
+    def __init__(
+        self,
+        decorator_name: str,
+        file_path: Path,
+        source_code: str,
+        keep_source_code: bool = True,
+        python_root: Path | None = None,
+    ) -> None:
         self.decorator_name = decorator_name
         self.file_path = file_path
         self.source_code = source_code
+        self.keep_source_code = keep_source_code
+        # Without a python_root, only names defined in the file itself are resolved
+        self.module_context = ModuleContext(file_path, python_root)
 
         self.stack = []
-        self.extraction_results: list[TraceabilityReport] = []
+        self.scopes: list[Scope] = []
+        self.extraction_results: list[ReportRecord] = []
+        # The node each report was extracted from, and whether any key was read from
+        # a name rather than written out, for history mode to tell which lines of a
+        # file the reports depend on and whether their code has changed
+        self.decorated_nodes: list[
+            ast.ClassDef | ast.FunctionDef | ast.AsyncFunctionDef
+        ] = []
+        self.keys_read_from_names = False
+
+    @functools.cached_property
+    def source_index(self) -> SourceIndex:
+        # Only built once a segment is needed, as most files in history mode have none
+        return SourceIndex(self.source_code)
 
-    def visit(self, node):
-        super().visit(node)
+    def visit(self, node) -> list[TraceabilityReport]:
+        return [record.to_report() for record in self.extract_records(node)]
+
+    def extract_records(self, node) -> list[ReportRecord]:
+        if isinstance(node, ast.Module):
+            self.scopes.append(Scope(node, None, self.module_context))
+        self.generic_visit(node)
+        # Any of the reports might depend on the other modules constants were read from
+        dependencies = tuple(sorted(self.module_context.dependencies))
+        for record in self.extraction_results:
+            record.dependencies = dependencies
         return self.extraction_results
 
+    def _resolve_names(self, node) -> dict[str, Any]:
+        return self.scopes[-1].resolve_names(node) if self.scopes else {}
+
     def safe_eval(self, node, globals_=None):
         try:
             return ast.literal_eval(node)
@@ -49,9 +122,9 @@ class TraceabilityVisitor(ast.NodeVisitor):
             _log.debug(f"literal_eval failed for node: {ast.dump(node)} — {e}")
             try:
                 code = compile(ast.Expression(body=node), "<ast>", "eval")
-                return eval(code, globals_ or {}, {})
+                return eval(code, {**(globals_ or {}), **self._resolve_names(node)}, {})
             except Exception as e2:
-                source = ast.get_source_segment(self.source_code, node)
+                source = self.source_index.get_segment(SourceSpan.from_node(node))
                 _log.debug(f"eval failed for node: {source} — {e2}")
                 return RawCode(code=source)
 
@@ -72,8 +145,19 @@ class TraceabilityVisitor(ast.NodeVisitor):
         else:
             return self.safe_eval(node, globals_)
 
-    def _extract_traceability_from_decorator(self, decorator: ast.Call) -> Traceability:
+    def _extract_traceability_from_decorator(
+        self, decorator: ast.Call
+    ) -> tuple[str, dict[str, Any]]:
         num_args = len(decorator.args)
+        key_nodes = decorator.args[:1] + [
+            keyword.value for keyword in decorator.keywords if keyword.arg == "key"
+        ]
+        if any(
+            isinstance(child, ast.Name)
+            for key_node in key_nodes
+            for child in ast.walk(key_node)
+        ):
+            self.keys_read_from_names = True
         if num_args > 1:
             raise InvalidTraceabilityError.from_allowed_message_types(
                 TraceabilityErrorMessages.ONLY_ONE_ARG,
@@ -87,10 +171,12 @@ class TraceabilityVisitor(ast.NodeVisitor):
             )
 
         key_from_arg = (
-            decorator.args[0].value
-            if num_args == 1 and isinstance(decorator.args[0], ast.Constant)
+            self.walk_arg_definition(decorator.args[0], globals_=globals_)
+            if num_args == 1
             else None
         )
+        if isinstance(key_from_arg, RawCode):
+            key_from_arg = None
         key_from_kwarg = kwargs.pop("key", None)
         if key_from_arg and key_from_kwarg:
             raise InvalidTraceabilityError.from_allowed_message_types(
@@ -113,7 +199,7 @@ class TraceabilityVisitor(ast.NodeVisitor):
             key,
             kwargs,
         )
-        return Traceability(key=key, metadata=kwargs)
+        return key, kwargs
 
     def check_callable_node(self, node):
         for decorator in node.decorator_list:
@@ -123,18 +209,28 @@ class TraceabilityVisitor(ast.NodeVisitor):
             ):
                 continue
             if decorator.func.id == self.decorator_name:
-                traceability = self._extract_traceability_from_decorator(decorator)
+                key, metadata = self._extract_traceability_from_decorator(decorator)
+                if self.keep_source_code:
+                    source_code = self.source_index.get_segment(
+                        SourceSpan.from_node(node)
+                    )
+                    source_span = None
+                else:
+                    source_code = None
+                    source_span = SourceSpan.from_node(node)
                 self.extraction_results.append(
-                    TraceabilityReport(
+                    ReportRecord(
+                        key=key,
+                        metadata=metadata,
                         file_path=self.file_path,
                         function_name=".".join(self.stack),
                         line_number=node.lineno,
                         end_line_number=node.end_lineno,
-                        source_code=ast.get_source_segment(self.source_code, node),
-                        key=traceability.key,
-                        metadata=traceability.metadata,
+                        source_code=source_code,
+                        source_span=source_span,
                     )
                 )
+                self.decorated_nodes.append(node)
 
     def generic_visit(self, node):
         if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
@@ -142,10 +238,25 @@ class TraceabilityVisitor(ast.NodeVisitor):
             self.stack.append(name)
             _log.debug("Processing %s: %s", node.__class__.__name__, name)
             self.check_callable_node(node)
-            super().generic_visit(node)
+            if self.scopes:
+                self.scopes.append(Scope(node, self.scopes[-1], self.module_context))
+            self._visit_children(node)
+            if self.scopes:
+                self.scopes.pop()
             self.stack.pop()
         else:
-            super().generic_visit(node)
+            self._visit_children(node)
+
+    def _visit_children(self, node):
+        # Only statement bodies are walked, rather than every child node as in
+        # NodeVisitor.generic_visit, as that's the only place definitions can be
+        for field in node._fields:
+            if field not in _STATEMENT_FIELDS:
+                continue
+            children = getattr(node, field, None)
+            if isinstance(children, list):
+                for child in children:
+                    self.generic_visit(child)
 
 
 @pytraceability(
@@ -153,16 +264,53 @@ class TraceabilityVisitor(ast.NodeVisitor):
     info=f"{PROJECT_NAME} extracts traceability info from the decorators statically",
 )
 def extract_traceability_from_file_using_ast(
-    file_path: Path, decorator_name: str
+    file_path: Path,
+    decorator_name: str,
+    scan_statistics: Counter[str] | None = None,
+    keep_source_code: bool = True,
+    python_root: Path | None = None,
 ) -> list[TraceabilityReport]:
+    return [
+        record.to_report()
+        for record in extract_records_from_file(
+            file_path,
+            decorator_name,
+            scan_statistics=scan_statistics,
+            keep_source_code=keep_source_code,
+            python_root=python_root,
+        )
+    ]
+
+
+def extract_records_from_file(
+    file_path: Path,
+    decorator_name: str,
+    scan_statistics: Counter[str] | None = None,
+    keep_source_code: bool = True,
+    python_root: Path | None = None,
+    source: bytes | None = None,
+) -> list[ReportRecord]:
+    if source is None:
+        source = file_path.read_bytes()
+    scan_result = scan_source_for_decorator(source, decorator_name)
+    if scan_statistics is not None:
+        scan_statistics[scan_result.value] += 1
+    if scan_result == SourceScanResult.NO_DECORATOR_NAME:
+        _log.debug("Skipping file without the decorator name: %s", file_path)
+        return []
+
     _log.info("Extracting traceability from file: %s", file_path)
-    with open(file_path, "r") as f:
-        source_code = f.read()
-        try:
-            tree = ast.parse(source_code, filename=file_path)
-        except SyntaxError:
-            _log.warning(f"Ignoring file due to syntax error: {file_path}")
-            return []
-        return TraceabilityVisitor(
-            decorator_name, file_path=file_path, source_code=source_code
-        ).visit(tree)
+    try:
+        # decode_source honours PEP 263 coding declarations and BOMs
+        source_code = decode_source(source)
+        tree = ast.parse(source_code, filename=file_path)
+    except (SyntaxError, UnicodeDecodeError):
+        _log.warning(f"Ignoring file due to syntax error: {file_path}")
+        return []
+    return TraceabilityVisitor(
+        decorator_name,
+        file_path=file_path,
+        source_code=source_code,
+        keep_source_code=keep_source_code,
+        python_root=python_root,
+    ).extract_records(tree)
@@ -0,0 +1,549 @@
+from __future__ import annotations
+
+import base64
+import functools
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from importlib import metadata
+from pathlib import Path
+from typing import Any, Dict, Iterable, NamedTuple, Optional
+
+from typing_extensions import Self
+
+from pytraceability.config import PROJECT_NAME
+from pytraceability.data_definition import RawCode, ReportRecord, Traceability
+from pytraceability.import_processing import LocalImportFinder
+from pytraceability.source import SourceSpan
+
+_log = logging.getLogger(__name__)
+
+_CACHE_FILE_NAME = "cache.sqlite"
+_MODULE_IMPORT_CACHE_FILE_NAME = "module_imports.sqlite"
+_HISTORY_BLOB_CACHE_FILE_NAME = "history_blobs.sqlite"
+# Bump whenever the schema changes, so that caches written by older versions are
+# rebuilt rather than misread
+_SCHEMA_VERSION = 4
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS extraction_results (
+    decorator_name TEXT NOT NULL,
+    keep_source_code INTEGER NOT NULL,
+    python_root TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    package_version TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    last_used INTEGER NOT NULL,
+    PRIMARY KEY (decorator_name, keep_source_code, python_root, file_path)
+)
+"""
+_MODULE_IMPORT_SCHEMA_VERSION = 2
+_MODULE_IMPORT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS module_import_results (
+    cache_key TEXT NOT NULL PRIMARY KEY,
+    package_version TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    last_used INTEGER NOT NULL
+)
+"""
+_HISTORY_BLOB_SCHEMA_VERSION = 3
+_HISTORY_BLOB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history_blob_results (
+    decorator_name TEXT NOT NULL,
+    keep_source_code INTEGER NOT NULL,
+    blob_sha TEXT NOT NULL,
+    package_version TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    last_used INTEGER NOT NULL,
+    PRIMARY KEY (decorator_name, keep_source_code, blob_sha)
+)
+"""
+
+
+def get_package_version() -> str:
+    try:
+        return metadata.version(PROJECT_NAME)
+    except metadata.PackageNotFoundError:  # pragma: no cover
+        return "unknown"
+
+
+def hash_content(content: bytes) -> str:
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def _hash_file(file_path: Path) -> str | None:
+    try:
+        return hash_content(file_path.read_bytes())
+    except OSError:
+        return None
+
+
+class FileState(NamedTuple):
+    size: int
+    mtime_ns: int
+    content_hash: str
+
+
+def read_file_with_state(file_path: Path) -> tuple[bytes, FileState]:
+    """
+    Read a file, with the state to cache what's extracted from those bytes under.
+    It's stat'd first, so if the file changes while it's read the cached mtime is
+    out of date and the next run checks the content hash, rather than the reports
+    being cached against the newer content.
+    """
+    stat = os.stat(file_path)
+    content = file_path.read_bytes()
+    return content, FileState(stat.st_size, stat.st_mtime_ns, hash_content(content))
+
+
+DependencyHashes = Dict[Path, Optional[str]]
+
+
+def hash_dependencies(reports: Iterable[ReportRecord]) -> DependencyHashes:
+    """
+    The content hashes of the other files that values in the reports were resolved
+    from, so the reports can be found to be out of date when one of them changes.
+    """
+    dependencies = {path for report in reports for path in report.dependencies}
+    return {path: _hash_file(path) for path in sorted(dependencies)}
+
+
+def get_changed_dependencies(dependency_hashes: DependencyHashes) -> set[Path]:
+    return {
+        path
+        for path, content_hash in dependency_hashes.items()
+        if _hash_file(path) != content_hash
+    }
+
+
+def encode_value(value: Any) -> Any:
+    """
+    A JSON compatible form of a key or metadata value. Every dict is written as a
+    tagged object, as are the types JSON doesn't have, so decode_value gives back an
+    equal value of the same type. Cached values are stored this way rather than
+    pickled, so that reading a cache file can't run any code.
+
+    Raises TypeError for a value of any other type, which then isn't cached.
+    """
+    if value is None or type(value) in (bool, int, float, str):
+        return value
+    if type(value) is list:
+        return [encode_value(item) for item in value]
+    if type(value) is dict:
+        return {"dict": [[encode_value(k), encode_value(v)] for k, v in value.items()]}
+    if type(value) in (tuple, set, frozenset):
+        return {type(value).__name__: [encode_value(item) for item in value]}
+    if type(value) is bytes:
+        return {"bytes": base64.b64encode(value).decode("ascii")}
+    if type(value) is complex:
+        return {"complex": [value.real, value.imag]}
+    if type(value) is RawCode:
+        return {"raw_code": value.code}
+    raise TypeError(f"Can't cache a value of type {type(value).__name__}")
+
+
+_COLLECTION_TYPES = {"tuple": tuple, "set": set, "frozenset": frozenset}
+
+
+def decode_value(data: Any) -> Any:
+    if isinstance(data, list):
+        return [decode_value(item) for item in data]
+    if not isinstance(data, dict):
+        return data
+    ((tag, tagged),) = data.items()
+    if tag == "dict":
+        return {decode_value(k): decode_value(v) for k, v in tagged}
+    if tag in _COLLECTION_TYPES:
+        return _COLLECTION_TYPES[tag](decode_value(item) for item in tagged)
+    if tag == "bytes":
+        return base64.b64decode(tagged)
+    if tag == "complex":
+        return complex(*tagged)
+    if tag == "raw_code":
+        return RawCode(code=tagged)
+    raise ValueError(f"Unknown cached value type {tag}")
+
+
+def encode_records(records: Iterable[ReportRecord]) -> list[dict[str, Any]]:
+    return [
+        {
+            "key": encode_value(record.key),
+            "metadata": encode_value(record.metadata),
+            "file_path": str(record.file_path),
+            "function_name": record.function_name,
+            "line_number": record.line_number,
+            "end_line_number": record.end_line_number,
+            "source_code": record.source_code,
+            "source_span": record.source_span,
+            "dependencies": [str(path) for path in record.dependencies],
+        }
+        for record in records
+    ]
+
+
+def decode_records(data: list[dict[str, Any]]) -> list[ReportRecord]:
+    return [
+        ReportRecord(
+            key=decode_value(record["key"]),
+            metadata=decode_value(record["metadata"]),
+            file_path=Path(record["file_path"]),
+            function_name=record["function_name"],
+            line_number=record["line_number"],
+            end_line_number=record["end_line_number"],
+            source_code=record["source_code"],
+            source_span=(
+                SourceSpan(*record["source_span"]) if record["source_span"] else None
+            ),
+            dependencies=tuple(Path(path) for path in record["dependencies"]),
+        )
+        for record in data
+    ]
+
+
+def encode_dependency_hashes(
+    dependency_hashes: DependencyHashes,
+) -> list[tuple[str, str | None]]:
+    return [
+        (str(path), content_hash) for path, content_hash in dependency_hashes.items()
+    ]
+
+
+def decode_dependency_hashes(data: list[list[Any]]) -> DependencyHashes:
+    return {Path(path): content_hash for path, content_hash in data}
+
+
+def _extraction_payload(reports: list[ReportRecord]) -> bytes:
+    return json.dumps(
+        [
+            encode_records(reports),
+            encode_dependency_hashes(hash_dependencies(reports)),
+        ]
+    ).encode()
+
+
+class _SQLiteCache:
+    """
+    A cache table in its own sqlite file, whose least recently used entries are
+    evicted when its payloads grow beyond max_size_bytes. Each cache has its own file,
+    so that several can be open and written to at once.
+    """
+
+    _name: str
+    _file_name: str
+    _table: str
+    _schema: str
+    _schema_version: int
+
+    def __init__(self, cache_directory: Path, max_size_bytes: int) -> None:
+        self.max_size_bytes = max_size_bytes
+        self.package_version = get_package_version()
+        self.hits = 0
+        self.misses = 0
+
+        cache_directory.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(str(cache_directory / self._file_name))
+        (schema_version,) = self._connection.execute("PRAGMA user_version").fetchone()
+        if schema_version != self._schema_version:
+            self._connection.execute(f"DROP TABLE IF EXISTS {self._table}")
+            self._connection.execute(f"PRAGMA user_version = {self._schema_version}")
+        self._connection.execute(self._schema)
+        self._connection.execute(
+            f"DELETE FROM {self._table} WHERE package_version != ?",
+            (self.package_version,),
+        )
+        # A logical clock rather than wall time, so that the LRU order is exact
+        # even when entries are used within the timer resolution.
+        (self._clock,) = self._connection.execute(
+            f"SELECT COALESCE(MAX(last_used), 0) FROM {self._table}"
+        ).fetchone()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _tick(self) -> int:
+        self._clock += 1
+        return self._clock
+
+    def _evict_least_recently_used(self) -> None:
+        (total_size,) = self._connection.execute(
+            f"SELECT COALESCE(SUM(LENGTH(payload)), 0) FROM {self._table}"
+        ).fetchone()
+        if total_size <= self.max_size_bytes:
+            return
+        evicted = 0
+        for rowid, size in self._connection.execute(
+            f"SELECT rowid, LENGTH(payload) FROM {self._table} ORDER BY last_used"
+        ).fetchall():
+            if total_size <= self.max_size_bytes:
+                break
+            self._connection.execute(
+                f"DELETE FROM {self._table} WHERE rowid = ?", (rowid,)
+            )
+            total_size -= size
+            evicted += 1
+        _log.info("Evicted %s entries from the %s cache", evicted, self._name)
+
+    def close(self) -> None:
+        _log.info(
+            "%s cache: %s hits, %s misses",
+            self._name.capitalize(),
+            self.hits,
+            self.misses,
+        )
+        self._evict_least_recently_used()
+        self._connection.commit()
+        self._connection.close()
+
+
+class ExtractionCache(_SQLiteCache):
+    """
+    On-disk cache of the reports extracted from each file, keyed by the file path and
+    the extraction options, and validated against its size, mtime and content hash,
+    and the content of any other modules that constants in it were imported from.
+    """
+
+    _name = "extraction"
+    _file_name = _CACHE_FILE_NAME
+    _table = "extraction_results"
+    _schema = _SCHEMA
+    _schema_version = _SCHEMA_VERSION
+
+    def __init__(
+        self,
+        cache_directory: Path,
+        decorator_name: str,
+        max_size_bytes: int,
+        keep_source_code: bool = True,
+        python_root: Path | None = None,
+    ) -> None:
+        self.decorator_name = decorator_name
+        self.keep_source_code = keep_source_code
+        # Constants imported from other modules are resolved relative to python_root
+        self.python_root = str(python_root.resolve()) if python_root else ""
+        super().__init__(cache_directory, max_size_bytes)
+
+    def get(self, file_path: Path) -> list[ReportRecord] | None:
+        row = self._connection.execute(
+            "SELECT size, mtime_ns, content_hash, payload FROM extraction_results "
+            "WHERE decorator_name = ? AND keep_source_code = ? AND python_root = ? "
+            "AND file_path = ?",
+            (
+                self.decorator_name,
+                self.keep_source_code,
+                self.python_root,
+                str(file_path),
+            ),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        size, mtime_ns, content_hash, payload = row
+        try:
+            stat = os.stat(file_path)
+            touched = (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns)
+            # The file has been touched, but the content may still be the same,
+            # eg after a fresh checkout or switching branches back and forth
+            if touched and hash_content(file_path.read_bytes()) != content_hash:
+                self.misses += 1
+                return None
+        except OSError:
+            # Deleted since it was listed, so it'll fail to be extracted as usual
+            self.misses += 1
+            return None
+        self._connection.execute(
+            "UPDATE extraction_results SET size = ?, mtime_ns = ?, last_used = ? "
+            "WHERE decorator_name = ? AND keep_source_code = ? AND python_root = ? "
+            "AND file_path = ?",
+            (
+                stat.st_size,
+                stat.st_mtime_ns,
+                self._tick(),
+                self.decorator_name,
+                self.keep_source_code,
+                self.python_root,
+                str(file_path),
+            ),
+        )
+        reports, dependency_hashes = json.loads(payload)
+        if get_changed_dependencies(decode_dependency_hashes(dependency_hashes)):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return decode_records(reports)
+
+    def put(
+        self, file_path: Path, reports: list[ReportRecord], file_state: FileState
+    ) -> None:
+        try:
+            payload = _extraction_payload(reports)
+        except TypeError as e:
+            _log.debug("Not caching the reports from %s: %s", file_path, e)
+            return
+        self._connection.execute(
+            "INSERT OR REPLACE INTO extraction_results "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                self.decorator_name,
+                self.keep_source_code,
+                self.python_root,
+                str(file_path),
+                file_state.size,
+                file_state.mtime_ns,
+                file_state.content_hash,
+                self.package_version,
+                payload,
+                self._tick(),
+            ),
+        )
+
+
+class ModuleImportCache(_SQLiteCache):
+    """
+    On-disk cache of the traceability found by importing a module, keyed on the
+    content of the module and of every project-local module it imports, so that a
+    module only needs importing again once it or one of its local imports changes.
+    """
+
+    _name = "module import"
+    _file_name = _MODULE_IMPORT_CACHE_FILE_NAME
+    _table = "module_import_results"
+    _schema = _MODULE_IMPORT_SCHEMA
+    _schema_version = _MODULE_IMPORT_SCHEMA_VERSION
+
+    def __init__(
+        self, cache_directory: Path, python_root: Path, max_size_bytes: int
+    ) -> None:
+        self.python_root = python_root
+        self.import_finder = LocalImportFinder(python_root)
+        super().__init__(cache_directory, max_size_bytes)
+
+    @functools.lru_cache(maxsize=None)
+    def _hash_file(self, file_path: Path) -> str:
+        return hash_content(file_path.read_bytes())
+
+    def get_cache_key(self, file_path: Path, function_names: list[str]) -> str:
+        return hash_content(
+            repr(
+                (
+                    str(self.python_root.resolve()),
+                    str(file_path.resolve()),
+                    function_names,
+                    [
+                        (str(path), self._hash_file(path))
+                        for path in self.import_finder.find_import_closure(file_path)
+                    ],
+                )
+            ).encode()
+        )
+
+    def get(self, cache_key: str) -> list[Traceability] | None:
+        row = self._connection.execute(
+            "SELECT payload FROM module_import_results WHERE cache_key = ?",
+            (cache_key,),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self._connection.execute(
+            "UPDATE module_import_results SET last_used = ? WHERE cache_key = ?",
+            (self._tick(), cache_key),
+        )
+        self.hits += 1
+        return [
+            Traceability(key=decode_value(key), metadata=decode_value(metadata))
+            for key, metadata in json.loads(row[0])
+        ]
+
+    def put(self, cache_key: str, traceabilities: list[Traceability]) -> None:
+        try:
+            payload = json.dumps(
+                [
+                    [
+                        encode_value(traceability.key),
+                        encode_value(traceability.metadata),
+                    ]
+                    for traceability in traceabilities
+                ]
+            ).encode()
+        except TypeError as e:
+            # Imported metadata can be anything at all
+            _log.debug("Not caching the module import results: %s", e)
+            return
+        self._connection.execute(
+            "INSERT OR REPLACE INTO module_import_results VALUES (?, ?, ?, ?)",
+            (cache_key, self.package_version, payload, self._tick()),
+        )
+
+
+class HistoryBlobCache(_SQLiteCache):
+    """
+    On-disk cache of the reports extracted from each version of a file seen in history
+    mode, and a hash of each one's code, keyed by its git blob SHA. A blob's contents
+    never change, so its entry never needs validating.
+
+    The reports keep the path the blob was first seen at, so only the parts of them
+    that don't depend on the path should be used.
+    """
+
+    _name = "history blob"
+    _file_name = _HISTORY_BLOB_CACHE_FILE_NAME
+    _table = "history_blob_results"
+    _schema = _HISTORY_BLOB_SCHEMA
+    _schema_version = _HISTORY_BLOB_SCHEMA_VERSION
+
+    def __init__(
+        self,
+        cache_directory: Path,
+        decorator_name: str,
+        max_size_bytes: int,
+        keep_source_code: bool = True,
+    ) -> None:
+        self.decorator_name = decorator_name
+        self.keep_source_code = keep_source_code
+        super().__init__(cache_directory, max_size_bytes)
+
+    def get(self, blob_sha: str) -> tuple[list[ReportRecord], list[str]] | None:
+        row = self._connection.execute(
+            "SELECT payload FROM history_blob_results "
+            "WHERE decorator_name = ? AND keep_source_code = ? AND blob_sha = ?",
+            (self.decorator_name, self.keep_source_code, blob_sha),
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self._connection.execute(
+            "UPDATE history_blob_results SET last_used = ? "
+            "WHERE decorator_name = ? AND keep_source_code = ? AND blob_sha = ?",
+            (self._tick(), self.decorator_name, self.keep_source_code, blob_sha),
+        )
+        self.hits += 1
+        reports, code_hashes = json.loads(row[0])
+        return decode_records(reports), code_hashes
+
+    def put(
+        self, blob_sha: str, reports: list[ReportRecord], code_hashes: list[str]
+    ) -> None:
+        try:
+            payload = json.dumps([encode_records(reports), code_hashes]).encode()
+        except TypeError as e:
+            _log.debug("Not caching the reports from blob %s: %s", blob_sha, e)
+            return
+        self._connection.execute(
+            "INSERT OR REPLACE INTO history_blob_results VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                self.decorator_name,
+                self.keep_source_code,
+                blob_sha,
+                self.package_version,
+                payload,
+                self._tick(),
+            ),
+        )
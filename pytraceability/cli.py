@@ -2,19 +2,24 @@ from __future__ import annotations
 
 import functools
 import sys
+from pathlib import Path
 
 import click
 import cloup
 from cloup.constraints import If, accept_none, IsSet
 
 from pytraceability.config import (
+    FileSource,
     PyTraceabilityConfig,
     PyTraceabilityMode,
     OutputFormats,
+    HistoryBackend,
+    HistoryMode,
     HistoryModeConfig,
 )
 from pytraceability.collector import PyTraceabilityCollector
 from pytraceability.logging import setup_logging, get_display_logger
+from pytraceability.watch import ReportWatcher
 
 
 def strip_kwargs(f):
@@ -27,7 +32,7 @@ def strip_kwargs(f):
     return wrapper
 
 
-@cloup.command()
+@cloup.group(invoke_without_command=True)
 @cloup.option_group(
     "Core options",
     cloup.option(
@@ -64,10 +69,93 @@ def strip_kwargs(f):
         type=str,
         multiple=True,
     ),
+    cloup.option(
+        "--file-source",
+        type=click.Choice([o.value for o in FileSource]),
+        help="Where to find the python files: by walking base-directory, or from "
+        "the git index (which honours .gitignore). "
+        f"Default value: {PyTraceabilityConfig.model_fields['file_source'].default}",
+    ),
+    cloup.option(
+        "--include-untracked",
+        is_flag=True,
+        default=None,
+        help="With --file-source=git, also include untracked files that aren't ignored.",
+    ),
+    cloup.option(
+        "--incremental",
+        is_flag=True,
+        default=None,
+        help="Reuse the reports from the previous run and only re-extract the files "
+        "that git reports as changed since the commit that run was built from. With "
+        "--history, only the commits made since the previous run are walked.",
+    ),
     cloup.option(
         "--history/--no-history",
         default=False,
     ),
+    cloup.option(
+        "--no-sort",
+        is_flag=True,
+        default=None,
+        help="Output the reports in the order they are found rather than by key. "
+        "With --output-format=jsonl and no history, each report is written as soon "
+        "as its file has been processed.",
+    ),
+    cloup.option(
+        "--lazy-source-code",
+        is_flag=True,
+        default=None,
+        help="Only keep the location of each decorated object in memory, and read its "
+        "source code back from the file (or from git for history) when writing "
+        "output that includes it.",
+    ),
+    cloup.option(
+        "--jobs",
+        type=click.IntRange(min=1),
+        help="Number of processes used to extract traceability from files, to "
+        "import modules in module-import mode, and to parse the files changed by "
+        "each commit in history mode. "
+        f"Default value: {PyTraceabilityConfig.model_fields['jobs'].default}",
+    ),
+)
+@cloup.option_group(
+    "Cache options",
+    cloup.option(
+        "--no-cache",
+        is_flag=True,
+        default=None,
+        help="Re-extract every file instead of reusing results from previous runs.",
+    ),
+    cloup.option(
+        "--cache-directory",
+        type=cloup.dir_path(resolve_path=True),
+        help=f"Default value: {PyTraceabilityConfig.model_fields['cache_directory'].default}",
+    ),
+    cloup.option(
+        "--cache-max-size",
+        type=click.IntRange(min=1),
+        help="Maximum size of the cache in bytes, least recently used entries are "
+        "evicted beyond this. "
+        f"Default value: {PyTraceabilityConfig.model_fields['cache_max_size'].default}",
+    ),
+)
+@cloup.option_group(
+    "Module import options",
+    cloup.option(
+        "--import-timeout",
+        type=click.FloatRange(min=0, min_open=True),
+        help="Seconds to allow for importing each module in module-import mode, "
+        "after which its statically extracted metadata is kept. Setting this (or "
+        "--jobs) imports the modules in a pool of worker processes.",
+    ),
+    cloup.option(
+        "--imports-per-worker",
+        type=click.IntRange(min=1),
+        help="Number of modules each import worker process imports before it is "
+        "replaced. "
+        f"Default value: {PyTraceabilityConfig.model_fields['imports_per_worker'].default}",
+    ),
 )
 @cloup.option_group(
     "History options",
@@ -81,6 +169,33 @@ def strip_kwargs(f):
         type=str,
         help="Template URL for commit links, e.g., 'http://github.com/projectname/{commit}'",
     ),
+    cloup.option(
+        "--history-backend",
+        "backend",
+        type=click.Choice([b.value for b in HistoryBackend]),
+        help="How the commits are read from git. pydriller is slower, but kept as a "
+        "fallback. "
+        f"Default value: {HistoryModeConfig.model_fields['backend'].default.value}",
+    ),
+    cloup.option(
+        "--history-mode",
+        type=click.Choice([m.value for m in HistoryMode]),
+        help="Which commits get a history entry for a key. all records every commit "
+        "that changes the key's file, changed only those that change its code, "
+        "ignoring formatting and comments, and blame just the newest commit that "
+        "changed any of its lines, found with git blame rather than walking the "
+        "history. "
+        f"Default value: {HistoryModeConfig.model_fields['history_mode'].default.value}",
+    ),
+    cloup.option(
+        "--history-source-diffs",
+        "source_diffs",
+        is_flag=True,
+        default=None,
+        help="Write the source code of each history entry, other than the newest, as "
+        "a diff against the entry after it. The HTML output then shows what each "
+        "commit changed.",
+    ),
     constraint=If(~IsSet("history"), then=accept_none),
 )
 @click.option(
@@ -97,6 +212,9 @@ def main(ctx):
     setup_logging(ctx.params["verbosity"])
     _log = get_display_logger(__name__)
     config = PyTraceabilityConfig.from_command_line_arguments(ctx.params)
+    ctx.obj = config
+    if ctx.invoked_subcommand is not None:
+        return
 
     _log.display(f"Extracting traceability from {config.base_directory}")
 
@@ -104,5 +222,66 @@ def main(ctx):
         click.echo(output_line)
 
 
+@main.command()
+@cloup.option(
+    "--output-file",
+    type=cloup.file_path(writable=True, resolve_path=True),
+    required=True,
+    help="File to write the report to, in the format given by --output-format.",
+)
+@cloup.option(
+    "--debounce",
+    "debounce_seconds",
+    type=click.FloatRange(min=0),
+    default=0.5,
+    show_default=True,
+    help="Seconds to wait for files to stop changing before re-extracting them.",
+)
+@cloup.option(
+    "--poll-interval",
+    "poll_interval_seconds",
+    type=click.FloatRange(min=0, min_open=True),
+    default=1.0,
+    show_default=True,
+    help="Seconds between checks for changed files.",
+)
+@click.pass_obj
+def watch(
+    config: PyTraceabilityConfig,
+    output_file: Path,
+    debounce_seconds: float,
+    poll_interval_seconds: float,
+):
+    """Keep the report in OUTPUT_FILE up to date as the source files change."""
+    watcher = ReportWatcher(
+        config, output_file, debounce_seconds, poll_interval_seconds
+    )
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+@main.command()
+@cloup.argument("keys", nargs=-1, required=True)
+@click.pass_obj
+def key_history(config: PyTraceabilityConfig, keys: tuple[str, ...]):
+    """
+    Output the reports for KEYS with their history, found by following just their
+    lines back through git rather than walking the whole history.
+    """
+    if config.history_config is None:
+        config = config.model_copy(update={"history_config": HistoryModeConfig()})
+    collector = PyTraceabilityCollector(config)
+    reports = collector.collect_key_history(set(keys))
+    missing_keys = sorted(set(keys) - {report.key for report in reports})
+    if missing_keys:
+        raise click.BadParameter(
+            f"Keys not found: {', '.join(missing_keys)}", param_hint="KEYS"
+        )
+    for output_line in collector.format_output(reports):
+        click.echo(output_line)
+
+
 if __name__ == "__main__":  # pragma: no cover
     sys.exit(main())
@@ -1,14 +1,27 @@
 from __future__ import annotations
 
+import copy
+import functools
 import logging
-from itertools import groupby
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, closing, nullcontext
+from itertools import chain
 from operator import attrgetter
 from pathlib import Path
-from typing import Generator
+from typing import Callable, Collection, Generator, Iterable, Iterator
 
-from pytraceability.ast_processing import extract_traceability_from_file_using_ast
-from pytraceability.common import file_is_excluded
+from pytraceability.ast_processing import extract_records_from_file
+from pytraceability.cache import (
+    ExtractionCache,
+    FileState,
+    ModuleImportCache,
+    read_file_with_state,
+)
+from pytraceability.common import iter_python_files
 from pytraceability.config import (
+    FileSource,
+    get_repo_root,
     PyTraceabilityMode,
     PyTraceabilityConfig,
     PROJECT_NAME,
@@ -16,23 +29,66 @@ from pytraceability.config import (
 )
 from pytraceability.custom import pytraceability
 from pytraceability.data_definition import (
+    ReportRecord,
+    Traceability,
     TraceabilityReport,
+    TraceabilityStreamSummary,
     TraceabilitySummary,
 )
 from pytraceability.exceptions import (
     InvalidTraceabilityError,
     TraceabilityErrorMessages,
 )
-from pytraceability.history import get_line_based_history
+from pytraceability.git_utils import iter_git_python_files
+from pytraceability.history import get_history, get_key_history
 from pytraceability.html import render_traceability_summary_html
+from pytraceability.import_pool import ModuleImportPool
 from pytraceability.import_processing import extract_traceabilities_using_module_import
+from pytraceability.incremental import IncrementalScan
+from pytraceability.source import GitBlobReader
 
 _log = logging.getLogger(__name__)
 
+# Files are handed to the worker processes in batches to keep the IPC overhead
+# small relative to the cost of parsing a single file.
+_FILES_PER_BATCH = 32
+# How many files' reports can be held back waiting for their imports to finish, per
+# import process, so that the imports for later files can be started in the meantime
+_FILES_IN_FLIGHT_PER_IMPORT_PROCESS = 4
+
+
+def _extract_from_file(
+    file_path: Path, decorator_name: str, keep_source_code: bool, python_root: Path
+) -> tuple[list[ReportRecord], Counter[str], FileState]:
+    scan_statistics: Counter[str] = Counter()
+    source, file_state = read_file_with_state(file_path)
+    reports = extract_records_from_file(
+        file_path,
+        decorator_name,
+        scan_statistics=scan_statistics,
+        keep_source_code=keep_source_code,
+        python_root=python_root,
+        source=source,
+    )
+    return reports, scan_statistics, file_state
+
+
+def _extract_from_file_or_error(
+    extract: Callable[[Path], tuple[list[ReportRecord], Counter[str], FileState]],
+    file_path: Path,
+) -> tuple[list[ReportRecord], Counter[str], FileState] | Exception:
+    # Returned rather than raised, as executor.map would raise it for the first file
+    # in the batch, and it's re-raised for the file itself as the serial path does
+    try:
+        return extract(file_path)
+    except Exception as e:
+        return e
+
 
 class PyTraceabilityCollector:
     def __init__(self, config: PyTraceabilityConfig) -> None:
         self.config = config
+        self.scan_statistics: Counter[str] = Counter()
 
     @pytraceability(
         "PYTRACEABILITY-1",
@@ -40,11 +96,119 @@ class PyTraceabilityCollector:
     )
     def _get_file_paths(self) -> Generator[Path, None, None]:
         _log.info("Using exclude patterns %s", self.config.exclude_patterns)
-        for file_path in self.config.base_directory.rglob("*.py"):
-            if file_is_excluded(file_path, self.config.exclude_patterns):
-                _log.debug("Skipping %s", file_path)
-                continue
-            yield file_path
+        if self.config.file_source == FileSource.GIT:
+            yield from iter_git_python_files(
+                self.config.base_directory,
+                self.config.exclude_patterns,
+                include_untracked=self.config.include_untracked,
+            )
+            return
+        yield from iter_python_files(
+            self.config.base_directory, self.config.exclude_patterns
+        )
+
+    def _extract_reports(self) -> Iterator[list[ReportRecord]]:
+        if not self.config.incremental:
+            yield from self._extract_reports_from_files(self._get_file_paths())
+            return
+
+        incremental_scan = IncrementalScan(self.config)
+        baseline = incremental_scan.load_baseline()
+        changed_file_paths = (
+            incremental_scan.get_changed_file_paths(baseline) if baseline else None
+        )
+        if baseline is None or changed_file_paths is None:
+            reports_by_file = self._extract_reports_from_files(self._get_file_paths())
+        else:
+            unchanged_reports = [
+                report
+                for report in baseline.reports
+                if report.file_path not in changed_file_paths
+            ]
+            reports_by_file = chain(
+                [unchanged_reports],
+                self._extract_reports_from_files(
+                    incremental_scan.files_to_extract(changed_file_paths)
+                ),
+            )
+
+        all_reports = []
+        for reports in reports_by_file:
+            # Copied before they're passed on, as the module import step fills in
+            # their metadata in place, and the baseline holds what was extracted
+            all_reports.extend(copy.copy(report) for report in reports)
+            yield reports
+        incremental_scan.save_baseline(all_reports)
+
+    def _extract_reports_from_files(
+        self, file_paths: Iterable[Path]
+    ) -> Iterator[list[ReportRecord]]:
+        if self.config.no_cache:
+            for reports, _ in self._extract_reports_from_uncached_files(file_paths):
+                yield reports
+            return
+
+        with ExtractionCache(
+            self.config.cache_directory,
+            self.config.decorator_name,
+            self.config.cache_max_size,
+            keep_source_code=not self.config.lazy_source_code,
+            python_root=self.config.python_root,
+        ) as cache:
+            file_paths = list(file_paths)
+            cached_reports = {
+                file_path: cache.get(file_path) for file_path in file_paths
+            }
+            extracted_reports = self._extract_reports_from_uncached_files(
+                file_path
+                for file_path in file_paths
+                if cached_reports[file_path] is None
+            )
+            with closing(extracted_reports):
+                for file_path in file_paths:
+                    reports = cached_reports[file_path]
+                    if reports is None:
+                        reports, file_state = next(extracted_reports)
+                        cache.put(file_path, reports, file_state)
+                    yield reports
+
+    def _extract_reports_from_uncached_files(
+        self, file_paths: Iterable[Path]
+    ) -> Iterator[tuple[list[ReportRecord], FileState]]:
+        extract = functools.partial(
+            _extract_from_file,
+            decorator_name=self.config.decorator_name,
+            keep_source_code=not self.config.lazy_source_code,
+            python_root=self.config.python_root,
+        )
+        if self.config.jobs == 1:
+            yield from self._record_scan_statistics(map(extract, file_paths))
+            return
+        _log.info("Extracting traceability using %s processes", self.config.jobs)
+        with ProcessPoolExecutor(max_workers=self.config.jobs) as executor:
+            # executor.map returns results in submission order, so the merged
+            # output (and the first error or duplicate key reported) matches the
+            # serial path
+            yield from self._record_scan_statistics(
+                executor.map(
+                    functools.partial(_extract_from_file_or_error, extract),
+                    file_paths,
+                    chunksize=_FILES_PER_BATCH,
+                )
+            )
+
+    def _record_scan_statistics(
+        self,
+        results: Iterable[
+            tuple[list[ReportRecord], Counter[str], FileState] | Exception
+        ],
+    ) -> Iterator[tuple[list[ReportRecord], FileState]]:
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+            reports, scan_statistics, file_state = result
+            self.scan_statistics.update(scan_statistics)
+            yield reports, file_state
 
     @pytraceability(
         "PYTRACEABILITY-3",
@@ -52,68 +216,301 @@ class PyTraceabilityCollector:
         "to try to extract it dynamically by importing the module.",
     )
     def collect(self) -> list[TraceabilityReport]:
-        traceability_reports: dict[str, TraceabilityReport] = {}
-        for file_path in self._get_file_paths():
-            for report in extract_traceability_from_file_using_ast(
-                file_path, self.config.decorator_name
-            ):
-                if report.key in traceability_reports:
+        return self.complete_reports(self._extract_reports())
+
+    def complete_reports(
+        self, reports_by_file: Iterable[list[ReportRecord]]
+    ) -> list[TraceabilityReport]:
+        """
+        Check the statically extracted reports for duplicate keys, then fill in
+        anything that needs the module importing and the git history.
+        """
+        traceability_reports = {
+            record.key: record.to_report()
+            for records_for_file in self._check_reports(reports_by_file)
+            for record in records_for_file
+        }
+        if self.config.history_config:
+            _log.info("Collecting git history for traceability reports")
+            git_histories = get_history(
+                list(traceability_reports.values()), self.config
+            )
+            for traceability_key, git_history in git_histories.items():
+                # Keys that have since been removed are found in older commits too
+                if traceability_key in traceability_reports:
+                    traceability_reports[traceability_key].history = git_history
+        return list(traceability_reports.values())
+
+    def collect_key_history(self, keys: Collection[str]) -> list[TraceabilityReport]:
+        """
+        The reports for just the given keys, with their history found on demand
+        rather than from the history of the whole repo.
+        """
+        traceability_reports = [
+            record.to_report()
+            for records_for_file in self._check_reports(self._extract_reports())
+            for record in records_for_file
+            if record.key in keys
+        ]
+        git_histories = get_key_history(traceability_reports, self.config)
+        for traceability_report in traceability_reports:
+            traceability_report.history = git_histories[traceability_report.key]
+        return traceability_reports
+
+    def _check_reports(
+        self, reports_by_file: Iterable[list[ReportRecord]]
+    ) -> Iterator[list[ReportRecord]]:
+        """
+        Check for duplicate keys and fill in anything that needs the module
+        importing, one file at a time so that the reports can be streamed.
+        """
+        checked_reports = self._check_for_duplicate_keys(reports_by_file)
+        if self.config.mode == PyTraceabilityMode.MODULE_IMPORT:
+            checked_reports = self._extract_using_module_import(checked_reports)
+        yield from checked_reports
+
+    def _check_for_duplicate_keys(
+        self, reports_by_file: Iterable[list[ReportRecord]]
+    ) -> Iterator[list[ReportRecord]]:
+        seen_keys: set[str] = set()
+        raw_source_code_count = 0
+        for reports_for_file in reports_by_file:
+            for report in reports_for_file:
+                if report.key in seen_keys:
                     raise InvalidTraceabilityError.from_allowed_message_types(
                         TraceabilityErrorMessages.KEY_MUST_BE_UNIQUE,
                         f"{report.key} is duplicated",
                     )
-                traceability_reports[report.key] = report
+                seen_keys.add(report.key)
+                raw_source_code_count += report.contains_raw_source_code
+            yield reports_for_file
 
-        incomplete_reports = [
-            t for t in traceability_reports.values() if t.contains_raw_source_code
-        ]
+        _log.info("Source scan statistics: %s", dict(self.scan_statistics))
         _log.info(
             "%s traceability decorators contain raw source code.",
-            len(incomplete_reports),
+            raw_source_code_count,
         )
-        if (
-            self.config.mode == PyTraceabilityMode.MODULE_IMPORT
-            and len(incomplete_reports) > 0
-        ):
-            if self.config.python_root is None:  # pragma: no cover
-                # Should never actually end up here, because the model_validator will
-                # default this to base_directory, but we can't set it as non-optional
-                # because it would break typing checking at model creation
-                raise ValueError(
-                    f"Python root directory must be set in {PyTraceabilityMode.MODULE_IMPORT} mode"
+
+    @staticmethod
+    def _group_incomplete_reports(
+        reports_for_file: list[ReportRecord],
+    ) -> dict[Path, list[ReportRecord]]:
+        # Group by file, so each module is only imported once even if its reports
+        # aren't next to each other (as in the reports kept from an incremental scan)
+        incomplete_reports: dict[Path, list[ReportRecord]] = {}
+        for report in reports_for_file:
+            if report.contains_raw_source_code:
+                incomplete_reports.setdefault(report.file_path, []).append(report)
+        return incomplete_reports
+
+    @staticmethod
+    def _complete_reports_from_import(
+        incomplete_reports: list[ReportRecord],
+        extracted_traceabilities: Iterable[Traceability],
+    ) -> None:
+        reports_by_key = {report.key: report for report in incomplete_reports}
+        for extracted_traceability in extracted_traceabilities:
+            if report := reports_by_key.get(extracted_traceability.key):
+                report.set_metadata(extracted_traceability.metadata)
+
+    def _extract_using_module_import(
+        self, reports_by_file: Iterable[list[ReportRecord]]
+    ) -> Iterator[list[ReportRecord]]:
+        if self.config.python_root is None:  # pragma: no cover
+            # Should never actually end up here, because the model_validator will
+            # default this to base_directory, but we can't set it as non-optional
+            # because it would break typing checking at model creation
+            raise ValueError(
+                f"Python root directory must be set in {PyTraceabilityMode.MODULE_IMPORT} mode"
+            )
+        with ExitStack() as stack:
+            cache = (
+                None
+                if self.config.no_cache
+                else stack.enter_context(
+                    ModuleImportCache(
+                        self.config.cache_directory,
+                        self.config.python_root,
+                        self.config.cache_max_size,
+                    )
+                )
+            )
+            pool = None
+            max_pending_files = 0
+            if self._use_import_pool():
+                _log.info("Importing modules using %s processes", self.config.jobs)
+                pool = stack.enter_context(
+                    ModuleImportPool(
+                        self.config.python_root,
+                        self.config.jobs,
+                        timeout=self.config.import_timeout,
+                        imports_per_worker=self.config.imports_per_worker,
+                    )
                 )
-            for file_path, traceabilities in groupby(
-                incomplete_reports, attrgetter("file_path")
-            ):
-                for (
-                    extracted_traceability
-                ) in extract_traceabilities_using_module_import(
-                    file_path, self.config.python_root, traceabilities
-                ):
-                    traceability_reports[
-                        extracted_traceability.key
-                    ].metadata = extracted_traceability.metadata
+                # Keep enough imports in flight to use every worker, while still
+                # passing each file's reports on in order
+                max_pending_files = _FILES_IN_FLIGHT_PER_IMPORT_PROCESS * pool.processes
 
-        if self.config.history_config:
-            _log.info("Collecting git history for traceability reports")
-            git_histories = get_line_based_history(
-                list(traceability_reports.values()), self.config
+            pending_files: deque[tuple[list[ReportRecord], list[Callable[[], None]]]]
+            pending_files = deque()
+            for reports_for_file in reports_by_file:
+                imports = [
+                    self._start_import(file_path, incomplete_reports, cache, pool)
+                    for file_path, incomplete_reports in self._group_incomplete_reports(
+                        reports_for_file
+                    ).items()
+                ]
+                pending_files.append((reports_for_file, imports))
+                if len(pending_files) > max_pending_files:
+                    yield self._finish_imports(*pending_files.popleft())
+            while pending_files:
+                yield self._finish_imports(*pending_files.popleft())
+
+    def _use_import_pool(self) -> bool:
+        return self.config.jobs > 1 or self.config.import_timeout is not None
+
+    def _start_import(
+        self,
+        file_path: Path,
+        incomplete_reports: list[ReportRecord],
+        cache: ModuleImportCache | None,
+        pool: ModuleImportPool | None,
+    ) -> Callable[[], None]:
+        """
+        Start finding the traceability for the reports by importing their module (or
+        from the cache), returning a function that waits for the import to finish
+        and fills in the reports.
+        """
+        function_names = [report.function_name for report in incomplete_reports]
+        cache_key = cache.get_cache_key(file_path, function_names) if cache else ""
+        cached_traceabilities = cache.get(cache_key) if cache else None
+
+        get_traceabilities: Callable[[], list[Traceability] | None]
+        if cached_traceabilities is not None:
+            get_traceabilities = functools.partial(list, cached_traceabilities)
+        elif pool is not None:
+            get_traceabilities = functools.partial(
+                pool.result, pool.submit(file_path, function_names)
             )
-            for traceability_key, git_history in git_histories.items():
-                traceability_reports[traceability_key].history = git_history
-        return list(traceability_reports.values())
+        else:
+            get_traceabilities = functools.partial(
+                self._import_module, file_path, function_names
+            )
+
+        def finish_import() -> None:
+            traceabilities = get_traceabilities()
+            if traceabilities is None:
+                # Timed out, so the statically extracted metadata is kept
+                return
+            if cache and cached_traceabilities is None:
+                cache.put(cache_key, traceabilities)
+            self._complete_reports_from_import(incomplete_reports, traceabilities)
+
+        return finish_import
+
+    def _import_module(
+        self, file_path: Path, function_names: list[str]
+    ) -> list[Traceability]:
+        return list(
+            extract_traceabilities_using_module_import(
+                file_path, self.config.python_root, function_names
+            )
+        )
+
+    @staticmethod
+    def _finish_imports(
+        reports_for_file: list[ReportRecord], imports: list[Callable[[], None]]
+    ) -> list[ReportRecord]:
+        for finish_import in imports:
+            finish_import()
+        return reports_for_file
 
     def get_printable_output(self) -> Generator[str, None, None]:
-        reports = self.collect()
-        reports.sort(key=attrgetter("key"))
+        if self.config.output_format == OutputFormats.JSONL:
+            yield from self._format_json_lines(
+                self._get_output_reports(self._iter_reports())
+            )
+            return
+        yield from self.format_output(self.collect())
+
+    def _iter_reports(self) -> Iterator[TraceabilityReport]:
+        if self.config.no_sort and not self.config.history_config:
+            # Nothing needs all the reports at once, so each file's reports can be
+            # passed on as soon as it has been processed
+            for records_for_file in self._check_reports(self._extract_reports()):
+                yield from (record.to_report() for record in records_for_file)
+            return
+        yield from self._sort_reports(self.collect())
+
+    def _sort_reports(
+        self, reports: list[TraceabilityReport]
+    ) -> list[TraceabilityReport]:
+        if self.config.no_sort:
+            return reports
+        return sorted(reports, key=attrgetter("key"))
+
+    def _load_source_code(
+        self, reports: Iterable[TraceabilityReport]
+    ) -> Iterator[TraceabilityReport]:
+        if not self.config.lazy_source_code:
+            yield from reports
+            return
+        # The HTML output only shows the commits from the history, not their source,
+        # unless it's showing how each commit changed it
+        load_history_source_code = self.config.history_config is not None and (
+            self.config.output_format != OutputFormats.HTML
+            or self.config.history_config.source_diffs
+        )
+        with (
+            GitBlobReader(get_repo_root(self.config.base_directory))
+            if load_history_source_code
+            else nullcontext()
+        ) as git_blob_reader:
+            for report in reports:
+                yield report.with_source_code(git_blob_reader)
+
+    def _get_output_reports(
+        self, reports: Iterable[TraceabilityReport]
+    ) -> Iterator[TraceabilityReport]:
+        reports = self._load_source_code(reports)
+        if self.config.history_config and self.config.history_config.source_diffs:
+            return (report.with_history_diffs() for report in reports)
+        return reports
+
+    @staticmethod
+    def _format_json_lines(
+        reports: Iterable[TraceabilityReport],
+    ) -> Generator[str, None, None]:
+        report_count = 0
+        try:
+            for report in reports:
+                yield report.model_dump_json()
+                report_count += 1
+        except Exception as e:
+            # Whatever stopped the run, so that a consumer can tell the output is
+            # incomplete rather than cut off
+            yield TraceabilityStreamSummary(
+                report_count=report_count, error=f"{type(e).__name__}: {e}"
+            ).model_dump_json()
+            raise
+        yield TraceabilityStreamSummary(report_count=report_count).model_dump_json()
+
+    def format_output(
+        self, reports: list[TraceabilityReport]
+    ) -> Generator[str, None, None]:
+        reports = self._sort_reports(reports)
 
         if self.config.output_format == OutputFormats.KEY_ONLY:
             yield from (report.key for report in reports)
         elif self.config.output_format == OutputFormats.JSON:
-            yield TraceabilitySummary(reports=reports).model_dump_json(indent=2)
+            yield TraceabilitySummary(
+                reports=list(self._get_output_reports(reports))
+            ).model_dump_json(indent=2)
+        elif self.config.output_format == OutputFormats.JSONL:
+            yield from self._format_json_lines(self._get_output_reports(reports))
         elif self.config.output_format == OutputFormats.HTML:
             yield from render_traceability_summary_html(
-                TraceabilitySummary(reports=reports),
+                TraceabilitySummary(reports=list(self._get_output_reports(reports))),
                 self.config.history_config.commit_url_template
                 if self.config.history_config
                 else None,
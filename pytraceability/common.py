@@ -1,13 +1,18 @@
 from __future__ import annotations
 
 import fnmatch
+import logging
+import os
+import re
 from pathlib import Path
-from typing import Any, Mapping
+from typing import Any, Iterator, Mapping
 
 from pytraceability.data_definition import Traceability
 
 MetaDataType = Mapping[str, Any]
 
+_log = logging.getLogger(__name__)
+
 
 class traceability:
     def __init__(self, key: str, /, **kwargs) -> None:
@@ -30,3 +35,73 @@ STANDARD_DECORATOR_NAME = traceability.__name__
 
 def file_is_excluded(path: Path, exclude_file_patterns: list[str]) -> bool:
     return any(fnmatch.fnmatch(str(path), pat) for pat in exclude_file_patterns)
+
+
+class ExcludePatternMatcher:
+    """
+    Matches paths against all the exclude patterns with a single compiled regex,
+    rather than calling fnmatch once per pattern.
+    """
+
+    def __init__(self, exclude_patterns: list[str]) -> None:
+        self._file_regex = self._compile(exclude_patterns)
+        # fnmatch's "*" also matches path separators, so if a pattern ending in "*"
+        # matches a directory path followed by a separator, it matches every path
+        # below that directory too and the whole directory can be skipped.
+        self._directory_regex = self._compile(
+            [pattern for pattern in exclude_patterns if pattern.endswith("*")]
+        )
+
+    @staticmethod
+    def _compile(patterns: list[str]) -> re.Pattern[str] | None:
+        if not patterns:
+            return None
+        return re.compile(
+            "|".join(
+                f"(?:{fnmatch.translate(os.path.normcase(pattern))})"
+                for pattern in patterns
+            )
+        )
+
+    def file_is_excluded(self, path: str) -> bool:
+        return self._file_regex is not None and bool(
+            self._file_regex.match(os.path.normcase(path))
+        )
+
+    def directory_is_excluded(self, path: str) -> bool:
+        return self._directory_regex is not None and bool(
+            self._directory_regex.match(os.path.normcase(path) + os.sep)
+        )
+
+
+def iter_python_files(
+    base_directory: Path, exclude_patterns: list[str]
+) -> Iterator[Path]:
+    """
+    Walk base_directory for .py files, without descending into directories where
+    every file would be excluded anyway.
+    """
+    matcher = ExcludePatternMatcher(exclude_patterns)
+    directories = [str(base_directory)]
+    while directories:
+        directory = directories.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            _log.warning("Unable to read directory %s: %s", directory, e)
+            continue
+
+        subdirectories = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if matcher.directory_is_excluded(entry.path):
+                    _log.debug("Skipping directory %s", entry.path)
+                else:
+                    subdirectories.append(entry.path)
+            elif entry.name.endswith(".py") and entry.is_file():
+                if matcher.file_is_excluded(entry.path):
+                    _log.debug("Skipping %s", entry.path)
+                else:
+                    yield Path(entry.path)
+        directories.extend(reversed(subdirectories))
@@ -22,9 +22,26 @@ class PyTraceabilityMode(str, Enum):
     MODULE_IMPORT = "module-import"
 
 
+class FileSource(str, Enum):
+    FILESYSTEM = "filesystem"
+    GIT = "git"
+
+
+class HistoryBackend(str, Enum):
+    GIT = "git"
+    PYDRILLER = "pydriller"
+
+
+class HistoryMode(str, Enum):
+    ALL = "all"
+    CHANGED = "changed"
+    BLAME = "blame"
+
+
 class OutputFormats(str, Enum):
     KEY_ONLY = "key-only"
     JSON = "json"
+    JSONL = "jsonl"
     HTML = "html"
 
 
@@ -59,6 +76,9 @@ def find_pyproject_file(
 class HistoryModeConfig(BaseModel):
     git_branch: str = "main"
     commit_url_template: str | None = None
+    backend: HistoryBackend = HistoryBackend.GIT
+    history_mode: HistoryMode = HistoryMode.ALL
+    source_diffs: bool = False
 
 
 class PyTraceabilityConfig(BaseModel):
@@ -69,6 +89,17 @@ class PyTraceabilityConfig(BaseModel):
     mode: PyTraceabilityMode = PyTraceabilityMode.DEFAULT
     output_format: OutputFormats = OutputFormats.KEY_ONLY
     history_config: HistoryModeConfig | None = None
+    jobs: int = 1
+    import_timeout: float | None = None
+    imports_per_worker: int = 100
+    file_source: FileSource = FileSource.FILESYSTEM
+    include_untracked: bool = False
+    incremental: bool = False
+    no_sort: bool = False
+    lazy_source_code: bool = False
+    no_cache: bool = False
+    cache_directory: Path = Path(f".{PROJECT_NAME}_cache")
+    cache_max_size: int = 256 * 1024 * 1024
 
     def __init__(self, /, **data: Any) -> None:
         python_root = data.pop("python_root", None)
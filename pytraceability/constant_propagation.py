@@ -0,0 +1,331 @@
+from __future__ import annotations
+
+import ast
+import datetime
+import functools
+import logging
+import os
+from collections import Counter
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Iterator, Union
+
+from pytraceability.import_processing import (
+    get_imported_module_parts,
+    get_package_parts,
+    resolve_local_module,
+)
+
+_log = logging.getLogger(__name__)
+
+ScopeNode = Union[ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef]
+
+# Constants are evaluated without builtins, so that only these (and the other
+# constants) can be used to build them
+_CONSTANT_GLOBALS = {
+    "__builtins__": {},
+    "datetime": datetime,
+    "Decimal": Decimal,
+}
+_IMMUTABLE_TYPES = (
+    str,
+    bytes,
+    int,
+    float,
+    complex,
+    bool,
+    type(None),
+    Decimal,
+    datetime.date,
+    datetime.time,
+    datetime.timedelta,
+)
+
+
+class _Unresolved:
+    def __repr__(self) -> str:
+        return "UNRESOLVED"
+
+
+UNRESOLVED: Any = _Unresolved()
+
+
+def _is_immutable(value: Any) -> bool:
+    # Only immutable values are propagated, as a mutable one may have been changed
+    # after it was assigned
+    if isinstance(value, (tuple, frozenset)):
+        return all(_is_immutable(item) for item in value)
+    return isinstance(value, _IMMUTABLE_TYPES)
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_module(file_path: Path, mtime_ns: int, size: int) -> ast.Module | None:
+    # Keyed on the file's stat, as a long running process (eg watch mode) can see
+    # the same module change
+    try:
+        return ast.parse(file_path.read_bytes(), filename=str(file_path))
+    except (OSError, SyntaxError, ValueError):
+        return None
+
+
+class ModuleContext:
+    """
+    The state shared by the scopes of one file: where it is, so that imports of other
+    project modules can be followed, and which other files constants were read from.
+    """
+
+    def __init__(self, file_path: Path, python_root: Path | None) -> None:
+        self.file_path = file_path
+        self.python_root = python_root.resolve() if python_root else None
+        self.dependencies: set[Path] = set()
+        self._module_scopes: dict[Path, Scope | None] = {}
+        self._package: list[str] | None = None
+
+    @property
+    def package(self) -> list[str] | None:
+        if self._package is None and self.python_root is not None:
+            try:
+                self._package = get_package_parts(self.file_path, self.python_root)
+            except ValueError:
+                # Not under python_root, so there's nothing to be relative to
+                self._package = None
+        return self._package
+
+    def module_scope(self, file_path: Path) -> Scope | None:
+        if file_path not in self._module_scopes:
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                return None
+            tree = _parse_module(file_path, stat.st_mtime_ns, stat.st_size)
+            self._module_scopes[file_path] = (
+                None
+                if tree is None
+                else Scope(tree, None, ModuleContext(file_path, self.python_root))
+            )
+        return self._module_scopes[file_path]
+
+    def import_constant(self, module_parts: list[str], name: str) -> Any:
+        if self.python_root is None:
+            return UNRESOLVED
+        module_path = resolve_local_module(self.python_root, module_parts)
+        if module_path is None or resolve_local_module(
+            self.python_root, module_parts + [name]
+        ):
+            # Not a project module, or the name is a submodule
+            return UNRESOLVED
+        scope = self.module_scope(module_path)
+        if scope is None:
+            return UNRESOLVED
+        value = scope.lookup_local(name)
+        if value is not UNRESOLVED:
+            self.dependencies.add(module_path)
+            self.dependencies.update(scope.context.dependencies)
+        return value
+
+
+class Scope:
+    """
+    The names bound in a module, class or function body. Those bound exactly once,
+    directly in the body, by an assignment (or by importing them from another project
+    module) are constants, and can be resolved statically if their value can be.
+
+    The body is only analysed when a name is first looked up in it.
+    """
+
+    def __init__(
+        self, node: ScopeNode, parent: Scope | None, context: ModuleContext
+    ) -> None:
+        self.node = node
+        self.parent = parent
+        self.context = context
+        self.is_class = isinstance(node, ast.ClassDef)
+        self._bindings: Counter[str] | None = None
+        self._global_names: set[str] = set()
+        self._nonlocal_names: set[str] = set()
+        self._has_star_import = False
+        self._definitions: dict[str, ast.expr | tuple[list[str], str]] = {}
+        self._values: dict[str, Any] = {}
+        self._resolving: set[str] = set()
+
+    @property
+    def module_scope(self) -> Scope:
+        scope = self
+        while scope.parent is not None:
+            scope = scope.parent
+        return scope
+
+    def _analyse(self) -> Counter[str]:
+        if self._bindings is not None:
+            return self._bindings
+        bindings: Counter[str] = Counter()
+        if isinstance(self.node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            arguments = self.node.args
+            for arg in [
+                *getattr(arguments, "posonlyargs", []),
+                *arguments.args,
+                *arguments.kwonlyargs,
+                arguments.vararg,
+                arguments.kwarg,
+            ]:
+                if arg is not None:
+                    bindings[arg.arg] += 1
+        for node in _iter_scope_nodes(self.node.body):
+            for name in _bound_names(node):
+                bindings[name] += 1
+            if isinstance(node, ast.Global):
+                self._global_names.update(node.names)
+            elif isinstance(node, ast.Nonlocal):
+                self._nonlocal_names.update(node.names)
+            elif isinstance(node, ast.ImportFrom) and any(
+                alias.name == "*" for alias in node.names
+            ):
+                self._has_star_import = True
+
+        for statement in self.node.body:
+            if isinstance(statement, ast.Assign) and len(statement.targets) == 1:
+                target = statement.targets[0]
+                if isinstance(target, ast.Name):
+                    self._definitions[target.id] = statement.value
+            elif (
+                isinstance(statement, ast.AnnAssign)
+                and isinstance(statement.target, ast.Name)
+                and statement.value is not None
+            ):
+                self._definitions[statement.target.id] = statement.value
+            elif (
+                isinstance(statement, ast.ImportFrom)
+                and self.context.package is not None
+            ):
+                module_parts = get_imported_module_parts(
+                    self.context.package, statement
+                )
+                if module_parts is not None:
+                    for alias in statement.names:
+                        self._definitions[alias.asname or alias.name] = (
+                            module_parts,
+                            alias.name,
+                        )
+        self._bindings = bindings
+        return bindings
+
+    def lookup(self, name: str) -> Any:
+        """
+        Resolve a name used in this scope, following Python's scoping rules.
+        """
+        scope: Scope | None = self
+        while scope is not None:
+            bindings = scope._analyse()
+            if name in scope._global_names:
+                return scope.module_scope.lookup_local(name)
+            if scope._has_star_import:
+                # Could be bound by the star import, whether it's bound here or not
+                return UNRESOLVED
+            if name in bindings and name not in scope._nonlocal_names:
+                return scope.lookup_local(name)
+            scope = scope.parent
+            # Names in a class body aren't visible from the scopes nested in it
+            while scope is not None and scope.is_class:
+                scope = scope.parent
+        return UNRESOLVED
+
+    def lookup_local(self, name: str) -> Any:
+        if name in self._values:
+            return self._values[name]
+        bindings = self._analyse()
+        if (
+            bindings[name] != 1
+            or self._has_star_import
+            or name in self._global_names
+            or name in self._nonlocal_names
+            or name not in self._definitions
+            or name in self._resolving
+        ):
+            return UNRESOLVED
+        self._resolving.add(name)
+        try:
+            definition = self._definitions[name]
+            if isinstance(definition, tuple):
+                value = self.context.import_constant(*definition)
+            else:
+                value = self.evaluate(definition)
+        finally:
+            self._resolving.discard(name)
+        if value is not UNRESOLVED and not _is_immutable(value):
+            value = UNRESOLVED
+        self._values[name] = value
+        return value
+
+    def resolve_names(self, node: ast.expr) -> dict[str, Any]:
+        """
+        The values of the names used in an expression which can be resolved.
+        """
+        resolved = {}
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Load):
+                value = self.lookup(child.id)
+                if value is not UNRESOLVED:
+                    resolved[child.id] = value
+        return resolved
+
+    def evaluate(self, node: ast.expr) -> Any:
+        try:
+            return ast.literal_eval(node)
+        except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+            pass
+        namespace = dict(_CONSTANT_GLOBALS)
+        for child in ast.walk(node):
+            if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Load):
+                value = self.lookup(child.id)
+                if value is UNRESOLVED and child.id not in namespace:
+                    return UNRESOLVED
+                if value is not UNRESOLVED:
+                    namespace[child.id] = value
+        try:
+            return eval(compile(ast.Expression(body=node), "<ast>", "eval"), namespace)
+        except Exception as e:
+            _log.debug("Unable to evaluate %s statically: %s", ast.dump(node), e)
+            return UNRESOLVED
+
+
+def _iter_scope_nodes(statements: list[ast.stmt]) -> Iterator[ast.AST]:
+    """
+    Every node in a scope, without going into the bodies of nested scopes. The parts
+    of a nested function or class evaluated in this scope (eg decorators) are included.
+    """
+    to_visit: list[ast.AST] = list(reversed(statements))
+    while to_visit:
+        node = to_visit.pop()
+        yield node
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            children: list[ast.AST] = [
+                *node.decorator_list,
+                *node.args.defaults,
+                *(d for d in node.args.kw_defaults if d is not None),
+            ]
+        elif isinstance(node, ast.ClassDef):
+            children = [*node.decorator_list, *node.bases, *node.keywords]
+        elif isinstance(node, ast.Lambda):
+            children = [*node.args.defaults]
+        else:
+            children = list(ast.iter_child_nodes(node))
+        to_visit.extend(reversed(children))
+
+
+def _bound_names(node: ast.AST) -> list[str]:
+    if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+        return [node.id]
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return [node.name]
+    if isinstance(node, (ast.Import, ast.ImportFrom)):
+        return [
+            alias.asname or alias.name.split(".")[0]
+            for alias in node.names
+            if alias.name != "*"
+        ]
+    if isinstance(node, ast.ExceptHandler) and node.name:
+        return [node.name]
+    name = getattr(node, "name", None) or getattr(node, "rest", None)
+    if isinstance(name, str) and type(node).__name__.startswith("Match"):
+        return [name]
+    return []
@@ -4,7 +4,16 @@ from datetime import datetime
 from pathlib import Path
 from typing import Mapping, Any
 
-from pydantic import BaseModel, Field, computed_field
+from pydantic import BaseModel, Field, PrivateAttr, computed_field
+from typing_extensions import Self
+
+from pytraceability.source import (
+    GitBlobReader,
+    SourceSpan,
+    apply_source_diff,
+    make_source_diff,
+    read_file_source_segment,
+)
 
 
 MetaDataType = Mapping[str, Any]
@@ -14,26 +23,24 @@ class RawCode(BaseModel):
     code: str | None
 
 
+def contains_raw_source_code(value: Any) -> bool:
+    if isinstance(value, RawCode):
+        return True
+    elif isinstance(value, (list, set, tuple)):
+        return any(contains_raw_source_code(item) for item in value)
+    elif isinstance(value, dict):
+        return any(contains_raw_source_code(v) for v in value.values())
+    return False
+
+
 class Traceability(BaseModel):
     key: str
     metadata: MetaDataType = Field(default_factory=dict)
 
-    @staticmethod
-    def _contains_raw_source_code(value: Any) -> bool:
-        if isinstance(value, RawCode):
-            return True
-        elif isinstance(value, (list, set, tuple)):
-            return any(Traceability._contains_raw_source_code(item) for item in value)
-        elif isinstance(value, dict):
-            return any(
-                Traceability._contains_raw_source_code(v) for v in value.values()
-            )
-        return False
-
     @computed_field
     @property
     def contains_raw_source_code(self) -> bool:
-        return self._contains_raw_source_code(self.metadata)
+        return contains_raw_source_code(self.metadata)
 
 
 class TraceabilityGitHistory(BaseModel):
@@ -42,6 +49,33 @@ class TraceabilityGitHistory(BaseModel):
     author_date: datetime
     message: str
     source_code: str | None
+    # Instead of the source code, a diff that turns the source code of the entry before
+    # (the next newer one) into this one's, see TraceabilityReport.with_history_diffs
+    source_diff: str | None = None
+
+    _deferred_source: tuple[str, SourceSpan] | None = PrivateAttr(default=None)
+    # A hash of the code that ignores its formatting, used to tell whether it changed
+    _code_hash: str | None = PrivateAttr(default=None)
+
+    def defer_source_code(self, file_path: str, source_span: SourceSpan) -> None:
+        """
+        Drop the source code, keeping where to read it back from the commit's version
+        of the file.
+        """
+        self.source_code = None
+        self._deferred_source = (file_path, source_span)
+
+    def with_source_code(self, git_blob_reader: GitBlobReader) -> Self:
+        if self._deferred_source is None:
+            return self
+        file_path, source_span = self._deferred_source
+        return self.model_copy(
+            update={
+                "source_code": git_blob_reader.read_source_segment(
+                    self.commit, file_path, source_span
+                )
+            }
+        )
 
 
 class TraceabilityReport(Traceability):
@@ -52,6 +86,177 @@ class TraceabilityReport(Traceability):
     source_code: str | None
     history: list[TraceabilityGitHistory] | None = None
 
+    _source_span: SourceSpan | None = PrivateAttr(default=None)
+
+    @property
+    def source_span(self) -> SourceSpan | None:
+        return self._source_span
+
+    def defer_source_code(self, source_span: SourceSpan) -> None:
+        """
+        Drop the source code, keeping where to read it back from file_path.
+        """
+        self.source_code = None
+        self._source_span = source_span
+
+    def with_source_code(self, git_blob_reader: GitBlobReader | None = None) -> Self:
+        """
+        Return a copy with any deferred source code read back in, including that of
+        the history entries if git_blob_reader is given.
+        """
+        update: dict[str, Any] = {}
+        if self._source_span is not None:
+            update["source_code"] = read_file_source_segment(
+                self.file_path, self._source_span
+            )
+        if git_blob_reader is not None and self.history:
+            update["history"] = [
+                entry.with_source_code(git_blob_reader) for entry in self.history
+            ]
+        return self.model_copy(update=update) if update else self
+
+    def with_history_diffs(self) -> Self:
+        """
+        Return a copy with the source code of each history entry, other than the
+        newest, replaced by a diff against the entry before it. Entries next to one
+        without source code are left whole.
+        """
+        if not self.history:
+            return self
+        history = self.history[:1]
+        for newer_entry, entry in zip(self.history, self.history[1:]):
+            if newer_entry.source_code is None or entry.source_code is None:
+                history.append(entry)
+            else:
+                history.append(
+                    entry.model_copy(
+                        update={
+                            "source_code": None,
+                            "source_diff": make_source_diff(
+                                newer_entry.source_code, entry.source_code
+                            ),
+                        }
+                    )
+                )
+        return self.model_copy(update={"history": history})
+
+    def with_history_snapshots(self) -> Self:
+        """
+        Return a copy with the full source code of each history entry rebuilt from
+        the diffs written by with_history_diffs.
+        """
+        if not self.history or all(entry.source_diff is None for entry in self.history):
+            return self
+        history: list[TraceabilityGitHistory] = []
+        for entry in self.history:
+            if entry.source_diff is not None:
+                if not history or history[-1].source_code is None:
+                    raise ValueError(
+                        f"History entry for commit {entry.commit} of {self.key} has "
+                        "a diff, but nothing to apply it to"
+                    )
+                entry = entry.model_copy(
+                    update={
+                        "source_code": apply_source_diff(
+                            history[-1].source_code, entry.source_diff
+                        ),
+                        "source_diff": None,
+                    }
+                )
+            history.append(entry)
+        return self.model_copy(update={"history": history})
+
+
+class ReportRecord:
+    """
+    Lightweight, unvalidated equivalent of a TraceabilityReport, used while the reports
+    are being extracted and checked. Converted to a TraceabilityReport for output.
+    """
+
+    __slots__ = (
+        "key",
+        "metadata",
+        "file_path",
+        "function_name",
+        "line_number",
+        "end_line_number",
+        "source_code",
+        "source_span",
+        "contains_raw_source_code",
+        "dependencies",
+    )
+
+    def __init__(
+        self,
+        key: str,
+        metadata: dict[str, Any],
+        file_path: Path,
+        function_name: str,
+        line_number: int,
+        end_line_number: int | None,
+        source_code: str | None,
+        source_span: SourceSpan | None = None,
+        dependencies: tuple[Path, ...] = (),
+    ) -> None:
+        self.key = key
+        self.file_path = file_path
+        self.function_name = function_name
+        self.line_number = line_number
+        self.end_line_number = end_line_number
+        self.source_code = source_code
+        self.source_span = source_span
+        # Other files that values in the metadata (or the key) were resolved from
+        self.dependencies = dependencies
+        self.set_metadata(metadata)
+
+    def __repr__(self) -> str:
+        return f"ReportRecord(key={self.key!r}, file_path={self.file_path!r})"
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ReportRecord):
+            return NotImplemented
+        return all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def set_metadata(self, metadata: dict[str, Any]) -> None:
+        self.metadata = metadata
+        self.contains_raw_source_code = contains_raw_source_code(metadata)
+
+    def to_report(self) -> TraceabilityReport:
+        # The fields were all built by the extraction code, so skip re-validating them
+        report = TraceabilityReport.model_construct(
+            key=self.key,
+            metadata=self.metadata,
+            file_path=self.file_path,
+            function_name=self.function_name,
+            line_number=self.line_number,
+            end_line_number=self.end_line_number,
+            source_code=self.source_code,
+            history=None,
+        )
+        if self.source_span is not None:
+            report.defer_source_code(self.source_span)
+        return report
+
 
 class TraceabilitySummary(BaseModel):
     reports: list[TraceabilityReport]
+
+
+def load_traceability_summary(json_data: str | bytes) -> TraceabilitySummary:
+    """
+    Load the output of --output-format=json. History written as diffs is kept that
+    way, and each report's snapshots rebuilt with with_history_snapshots when needed.
+    """
+    return TraceabilitySummary.model_validate_json(json_data)
+
+
+class TraceabilityStreamSummary(BaseModel):
+    """
+    The last line of the jsonl output, after one line per report. If the run failed
+    part way through, error says why and report_count is how many were written.
+    """
+
+    report_count: int
+    error: str | None = None
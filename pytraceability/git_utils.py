@@ -0,0 +1,401 @@
+from __future__ import annotations
+
+import logging
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from pathlib import Path, PurePosixPath
+from typing import IO, Iterator, Protocol, Sequence
+
+import git
+from typing_extensions import Self
+
+from pytraceability.common import ExcludePatternMatcher
+from pytraceability.config import get_repo_root
+from pytraceability.source import decode_blob
+
+_log = logging.getLogger(__name__)
+
+# Each commit starts with a record separator, so it can't be confused with the raw
+# diff entries that follow it. The fields (and the diff entries) are NUL separated,
+# and the patch for all of a commit's files is a single field after the raw entries.
+_COMMIT_START = "\x1e"
+_LOG_FORMAT = "%x00%x1e%H%x00%an%x00%ad%x00%B%x00"
+_READ_SIZE = 64 * 1024
+_FILE_PATCH_START = re.compile(r"^diff --git ", re.MULTILINE)
+_HUNK_HEADER = re.compile(r"@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+def iter_git_python_files(
+    base_directory: Path,
+    exclude_patterns: list[str],
+    include_untracked: bool = False,
+) -> Iterator[Path]:
+    """
+    List the .py files below base_directory from the git index in a single call, so
+    that ignored and generated files never need to be excluded by hand.
+    """
+    repo_root = get_repo_root(base_directory)
+    base_directory_in_repo = PurePosixPath(
+        base_directory.resolve().relative_to(repo_root).as_posix()
+    )
+    ls_files_args = ["-z", "--cached"]
+    if include_untracked:
+        ls_files_args += ["--others", "--exclude-standard"]
+    with git.Repo(repo_root) as repo:
+        output = repo.git.ls_files(
+            *ls_files_args, "--", str(base_directory_in_repo / "*.py")
+        )
+
+    matcher = ExcludePatternMatcher(exclude_patterns)
+    # Unmerged files are listed once per conflict stage
+    for path_in_repo in dict.fromkeys(output.split("\0")):
+        if not path_in_repo:
+            continue
+        file_path = base_directory / PurePosixPath(path_in_repo).relative_to(
+            base_directory_in_repo
+        )
+        if matcher.file_is_excluded(str(file_path)):
+            _log.debug("Skipping %s", file_path)
+        elif not os.path.isfile(file_path):
+            _log.debug("Skipping %s as it is deleted in the working tree", file_path)
+        else:
+            yield file_path
+
+
+def get_head_commit(repo: git.Repo) -> str:
+    return repo.head.commit.hexsha
+
+
+def get_changed_files(
+    repo: git.Repo,
+    since_commit: str,
+    pathspec: str,
+    include_untracked: bool,
+    include_ignored: bool = False,
+) -> set[str]:
+    """
+    Paths (relative to the repo root) that differ between since_commit and the working
+    tree. Renames are reported as the deleted old path plus the added new path.
+    Untracked files are all included if include_ignored, not just those that
+    aren't ignored.
+    """
+    output = repo.git.diff(
+        "--name-only", "--no-renames", "-z", since_commit, "--", pathspec
+    )
+    changed_files = {path for path in output.split("\0") if path}
+    if include_untracked:
+        exclude_args = [] if include_ignored else ["--exclude-standard"]
+        output = repo.git.ls_files("-z", "--others", *exclude_args, "--", pathspec)
+        changed_files.update(path for path in output.split("\0") if path)
+    return changed_files
+
+
+# The first line of each group of lines in git blame --incremental's output:
+# <commit> <line in the commit> <line in the file> <number of lines>
+_BLAME_GROUP = re.compile(r"([0-9a-f]{40}) \d+ (\d+) (\d+)$")
+# What git blame gives lines that haven't been committed
+NULL_COMMIT = "0" * 40
+
+
+def blame_line_ranges(
+    repo: git.Repo,
+    path_in_repo: str,
+    line_ranges: Sequence[tuple[int, int]],
+    revision: str | None = None,
+) -> Iterator[tuple[str, int, int]]:
+    """
+    The commit that last changed each group of lines in the (inclusive) line ranges,
+    as (commit, first line, number of lines), from a single git blame of the file. The
+    working tree's version is blamed if no revision is given, with NULL_COMMIT for any
+    lines that haven't been committed.
+    """
+    line_range_args = [f"-L{first},{last}" for first, last in line_ranges]
+    revision_args = [] if revision is None else [revision]
+    output = repo.git.blame(
+        "--incremental", *line_range_args, *revision_args, "--", path_in_repo
+    )
+    for line in output.splitlines():
+        match = _BLAME_GROUP.match(line)
+        if match is not None:
+            yield match.group(1), int(match.group(2)), int(match.group(3))
+
+
+class FileDiff:
+    """
+    The changes a commit made to a file, as a diff without context. Each hunk is
+    (old start, old line count, new start, new line count), as in its @@ header, and
+    changed_lines is the text of every line added or removed.
+    """
+
+    __slots__ = ("hunks", "changed_lines")
+
+    def __init__(
+        self, hunks: list[tuple[int, int, int, int]], changed_lines: str
+    ) -> None:
+        self.hunks = hunks
+        self.changed_lines = changed_lines
+
+    @classmethod
+    def from_patch(cls, patch: str) -> Self:
+        hunks: list[tuple[int, int, int, int]] = []
+        changed_lines = []
+        for line in patch.split("\n"):
+            if line.startswith("@@"):
+                match = _HUNK_HEADER.match(line)
+                if match is None:  # pragma: no cover
+                    continue
+                old_start, old_count, new_start, new_count = match.groups()
+                hunks.append(
+                    (
+                        int(old_start),
+                        1 if old_count is None else int(old_count),
+                        int(new_start),
+                        1 if new_count is None else int(new_count),
+                    )
+                )
+            # The ---/+++ file headers come before the first hunk
+            elif hunks and line.startswith(("+", "-")):
+                changed_lines.append(line[1:])
+        return cls(hunks, "\n".join(changed_lines))
+
+
+class CommitFile(Protocol):
+    """
+    The parts of a file changed by a commit that history mode uses. blob_sha is None
+    if the file's git blob isn't known, and old_blob_sha and diff are None if the
+    version before the commit, or how it changed, aren't known.
+    """
+
+    @property
+    def new_path(self) -> str | None: ...
+
+    @property
+    def blob_sha(self) -> str | None: ...
+
+    @property
+    def old_blob_sha(self) -> str | None: ...
+
+    @property
+    def diff(self) -> FileDiff | None: ...
+
+    @property
+    def source_code(self) -> str | None: ...
+
+
+class ChangedFile:
+    """
+    A file added or modified by a commit. Its contents are only read from git when
+    they're needed, through git's long-lived cat-file process.
+    """
+
+    __slots__ = (
+        "new_path",
+        "blob_sha",
+        "old_blob_sha",
+        "diff",
+        "_repo",
+        "_source_code",
+    )
+
+    def __init__(
+        self,
+        repo: git.Repo,
+        new_path: str,
+        blob_sha: str | None,
+        old_blob_sha: str | None = None,
+    ) -> None:
+        self.new_path = new_path
+        self._repo = repo
+        self.blob_sha = blob_sha
+        self.old_blob_sha = old_blob_sha
+        self.diff: FileDiff | None = None
+        self._source_code: str | None = None
+
+    @property
+    def source_code(self) -> str | None:
+        if self._source_code is None and self.blob_sha is not None:
+            data = self._repo.git.get_object_data(self.blob_sha)[3]
+            # Empty files have no source code, as with pydriller
+            self._source_code = decode_blob(data) if data else None
+        return self._source_code
+
+
+class HistoryCommit:
+    __slots__ = ("hash", "author_name", "author_date", "message", "modified_files")
+
+    def __init__(
+        self,
+        hash: str,
+        author_name: str,
+        author_date: datetime,
+        message: str,
+        modified_files: Sequence[CommitFile],
+    ) -> None:
+        self.hash = hash
+        self.author_name = author_name
+        self.author_date = author_date
+        self.message = message
+        self.modified_files = modified_files
+
+
+def _parse_raw_date(raw_date: str) -> datetime:
+    timestamp, offset = raw_date.split()
+    sign = -1 if offset.startswith("-") else 1
+    utc_offset = timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5]))
+    return datetime.fromtimestamp(int(timestamp), timezone(sign * utc_offset))
+
+
+def _iter_nul_separated(stream: IO[bytes]) -> Iterator[str]:
+    remainder = b""
+    while chunk := stream.read(_READ_SIZE):
+        *fields, remainder = (remainder + chunk).split(b"\0")
+        for field in fields:
+            yield field.decode("utf-8", "replace")
+    if remainder:
+        yield remainder.decode("utf-8", "replace")
+
+
+def _add_diffs(patch: str, diff_entries: list[ChangedFile | None]) -> None:
+    """
+    Give each file its part of a commit's patch. git writes a patch (if only a
+    header) for every raw diff entry, in the same order.
+    """
+    file_patches = _FILE_PATCH_START.split(patch)[1:]
+    if len(file_patches) != len(diff_entries):  # pragma: no cover
+        _log.debug("Couldn't match the patch to the files changed, ignoring it")
+        return
+    for changed_file, file_patch in zip(diff_entries, file_patches):
+        if changed_file is not None:
+            changed_file.diff = FileDiff.from_patch(file_patch)
+
+
+def iter_history_commits(repo: git.Repo, branch: str) -> Iterator[HistoryCommit]:
+    """
+    Stream the commits on a branch, newest first, with the files each one added or
+    modified and how they changed. Renames are followed and merge commits have no
+    modified files, as with pydriller, but the files are listed from a single git log
+    rather than diffing every commit separately.
+    """
+    process = repo.git.log(
+        "-z",
+        "--raw",
+        "--patch",
+        "--unified=0",
+        "--no-color",
+        "--no-ext-diff",
+        "--no-textconv",
+        "--no-abbrev",
+        "-M",
+        "--date=raw",
+        f"--format={_LOG_FORMAT}",
+        # Only the python files are diffed, but with the history unsimplified so that
+        # every commit changing one is still listed
+        "--full-history",
+        branch,
+        "--",
+        "*py",
+        as_process=True,
+    )
+    fields = _iter_nul_separated(process.proc.stdout)
+    commit = None
+    modified_files: list[CommitFile] = []
+    diff_entries: list[ChangedFile | None] = []
+    try:
+        for field in fields:
+            if field.startswith(_COMMIT_START):
+                if commit is not None:
+                    yield commit
+                author_name, raw_date, message = (
+                    next(fields),
+                    next(fields),
+                    next(fields),
+                )
+                modified_files = []
+                diff_entries = []
+                commit = HistoryCommit(
+                    field[len(_COMMIT_START) :],
+                    author_name,
+                    _parse_raw_date(raw_date),
+                    message,
+                    modified_files,
+                )
+            elif field.lstrip("\n").startswith(":"):
+                # :<old mode> <new mode> <old sha> <new sha> <status>, then the path,
+                # which for a rename or copy is the old path and then the new one
+                *_, old_sha, new_sha, status = field.lstrip("\n").split(" ")
+                path = next(fields)
+                if status[0] in "RC":
+                    path = next(fields)
+                changed_file = None
+                if status == "R100":
+                    # pydriller has no contents for a file that was only renamed, so
+                    # neither does this, to give the same history
+                    changed_file = ChangedFile(repo, path, None)
+                elif status != "D":
+                    changed_file = ChangedFile(
+                        repo, path, new_sha, None if status == "A" else old_sha
+                    )
+                if changed_file is not None:
+                    modified_files.append(changed_file)
+                diff_entries.append(changed_file)
+            elif field.startswith("diff --git "):
+                _add_diffs(field, diff_entries)
+        if commit is not None:
+            yield commit
+        process.wait()
+    finally:
+        # Stops git log if the caller didn't need all of the commits
+        if process.proc is not None and process.proc.poll() is None:
+            process.proc.kill()
+            process.proc.wait()
+
+
+# The path on the new side of a file's patch
+_NEW_PATH = re.compile(r"^\+\+\+ b/(.*)$", re.MULTILINE)
+
+
+def iter_line_range_commits(
+    repo: git.Repo, revision: str, path_in_repo: str, first: int, last: int
+) -> Iterator[tuple[HistoryCommit, str]]:
+    """
+    The commits that changed the (inclusive) line range of a file, newest first, from
+    git log -L, with the path of the file in each one. git follows the lines through
+    renames, and stops at the commits that added them.
+    """
+    output = repo.git.log(
+        f"-L{first},{last}:{path_in_repo}",
+        "--no-color",
+        "--no-ext-diff",
+        "--no-textconv",
+        "--date=raw",
+        f"--format={_LOG_FORMAT}",
+        revision,
+    )
+    path = path_in_repo
+    for commit_output in output.split(f"\0{_COMMIT_START}")[1:]:
+        commit_hash, author_name, raw_date, message, patch = commit_output.split(
+            "\0", 4
+        )
+        new_path = _NEW_PATH.search(patch)
+        if new_path is not None:
+            path = new_path.group(1)
+        commit = HistoryCommit(
+            commit_hash, author_name, _parse_raw_date(raw_date), message, []
+        )
+        yield commit, path
+
+
+def iter_files_containing(repo: git.Repo, revision: str, text: str) -> Iterator[str]:
+    """
+    The python files in a commit that contain the text, with git grep.
+    """
+    try:
+        output = repo.git.grep("-l", "-F", "-e", text, revision, "--", "*py")
+    except git.GitCommandError as e:
+        # git grep exits with 1 when nothing matches
+        if e.status == 1:
+            return
+        raise
+    for line in output.splitlines():
+        yield line[len(revision) + 1 :]
@@ -1,18 +1,35 @@
 from __future__ import annotations
 
 import ast
+import copy
+import functools
+import hashlib
 import logging
+from collections import defaultdict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import ExitStack, closing
+from itertools import chain, islice
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Iterator, List, NamedTuple, Sequence, Tuple, Union
 
-from pydriller import Repository, ModifiedFile
+import git
+from pydriller import ModifiedFile, Repository
 from typing_extensions import Self
 
 from pytraceability.ast_processing import TraceabilityVisitor
-from pytraceability.common import file_is_excluded
-from pytraceability.config import PROJECT_NAME, PyTraceabilityConfig, get_repo_root
+from pytraceability.cache import HistoryBlobCache
+from pytraceability.common import ExcludePatternMatcher
+from pytraceability.config import (
+    PROJECT_NAME,
+    HistoryBackend,
+    HistoryMode,
+    HistoryModeConfig,
+    PyTraceabilityConfig,
+    get_repo_root,
+)
 from pytraceability.custom import pytraceability
 from pytraceability.data_definition import (
+    ReportRecord,
     TraceabilityGitHistory,
     TraceabilityReport,
 )
@@ -20,36 +37,580 @@ from pytraceability.exceptions import (
     InvalidTraceabilityError,
     TraceabilityErrorMessages,
 )
+from pytraceability.git_utils import (
+    NULL_COMMIT,
+    CommitFile,
+    FileDiff,
+    HistoryCommit,
+    blame_line_ranges,
+    iter_files_containing,
+    iter_history_commits,
+    iter_line_range_commits,
+)
+from pytraceability.incremental import IncrementalHistory
+from pytraceability.source import decode_blob
 
 _log = logging.getLogger(__name__)
 
+# With --jobs, commits are handed to the worker processes in chunks, and only a few
+# chunks per process are parsed ahead of the history walk to keep memory bounded
+_COMMITS_PER_CHUNK = 64
+_CHUNKS_IN_FLIGHT_PER_PROCESS = 2
+
+
+class KeyFileIndex:
+    """
+    The file each key was last found in, walking back through the history, and the
+    keys last found in each file. A key has no file from when a commit changes its
+    file until it's found again. Only the keys in the files a commit changes need
+    updating, so a commit's bookkeeping costs no more than the files it changes.
+    """
+
+    def __init__(self) -> None:
+        self._file_for_key: dict[str, str | None] = {}
+        self._keys_in_file: dict[str, set[str]] = {}
+        self._unlocated_keys = 0
 
-class CurrentFileForKey(Dict[str, Optional[str]]):
     @classmethod
     def from_traceability_reports(
         cls,
         traceability_reports: list[TraceabilityReport],
         config: PyTraceabilityConfig,
     ) -> Self:
-        current_file_for_key = cls()
+        key_file_index = cls()
 
         for traceability_report in traceability_reports:
-            if traceability_report.key in current_file_for_key:  # pragma: no cover
+            if traceability_report.key in key_file_index:  # pragma: no cover
                 # Should never hit this as this is checked in the collector
                 raise InvalidTraceabilityError.from_allowed_message_types(
                     TraceabilityErrorMessages.KEY_MUST_BE_UNIQUE,
                     f"Key {traceability_report.key} is duplicated",
                 )
-            current_file_for_key[traceability_report.key] = str(
-                traceability_report.file_path.relative_to(config.base_directory)
+            key_file_index.set_file(
+                traceability_report.key,
+                str(traceability_report.file_path.relative_to(config.base_directory)),
+            )
+        return key_file_index
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._file_for_key
+
+    def all_keys_located(self) -> bool:
+        return self._unlocated_keys == 0
+
+    def is_current_file(self, file_path: str | None) -> bool:
+        if file_path is None:
+            return self._unlocated_keys > 0
+        return file_path in self._keys_in_file
+
+    def set_file(self, key: str, file_path: str) -> None:
+        if key in self._file_for_key:
+            previous_file_path = self._file_for_key[key]
+            if previous_file_path is None:
+                self._unlocated_keys -= 1
+            else:
+                keys_in_previous_file = self._keys_in_file[previous_file_path]
+                keys_in_previous_file.discard(key)
+                if not keys_in_previous_file:
+                    del self._keys_in_file[previous_file_path]
+        self._file_for_key[key] = file_path
+        self._keys_in_file.setdefault(file_path, set()).add(key)
+
+    def reset_keys_for_relevant_files(self, relevant_files: Sequence[CommitFile]):
+        for relevant_file in relevant_files:
+            if relevant_file.new_path is None:
+                continue
+            for key in self._keys_in_file.pop(relevant_file.new_path, ()):
+                self._file_for_key[key] = None
+                self._unlocated_keys += 1
+
+
+class _PydrillerFile:
+    """
+    A file changed by a commit, as read by pydriller. Its blob isn't known, so the
+    reports extracted from it are never cached.
+    """
+
+    __slots__ = ("_modified_file",)
+    blob_sha = None
+    old_blob_sha = None
+    diff = None
+
+    def __init__(self, modified_file: ModifiedFile) -> None:
+        self._modified_file = modified_file
+
+    @property
+    def new_path(self) -> str | None:
+        return self._modified_file.new_path
+
+    @property
+    def source_code(self) -> str | None:
+        return self._modified_file.source_code
+
+
+def _is_history_file(new_path: str, matcher: ExcludePatternMatcher) -> bool:
+    return new_path.endswith("py") and not matcher.file_is_excluded(new_path)
+
+
+# The first and last line of each stretch of a file that reports were extracted from
+DecoratedLines = List[Tuple[int, int]]
+
+
+def _is_code_line(line: str) -> bool:
+    stripped = line.strip()
+    return bool(stripped) and not stripped.startswith("#")
+
+
+def _get_decorated_lines(
+    source_code: str, visitor: TraceabilityVisitor
+) -> DecoratedLines | None:
+    """
+    The lines that the reports extracted by the visitor depend on, from the code line
+    before the decorators to the code line after the decorated code, as changing
+    either of those could change where the decorated code starts or ends. None if the
+    reports depend on other lines as well, or the lines might not be numbered as git
+    numbers them.
+    """
+    if visitor.keys_read_from_names or "\r" in source_code.replace("\r\n", ""):
+        return None
+    lines = source_code.split("\n")
+    decorated_lines = []
+    for node in visitor.decorated_nodes:
+        first = node.decorator_list[0].lineno - 1
+        while first > 0 and not _is_code_line(lines[first - 1]):
+            first -= 1
+        last = (node.end_lineno or node.lineno) + 1
+        while last <= len(lines) and not _is_code_line(lines[last - 1]):
+            last += 1
+        decorated_lines.append((first, last))
+    return decorated_lines
+
+
+DecoratedNode = Union[ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef]
+
+
+def _hash_code(node: DecoratedNode) -> str:
+    """
+    A hash of the decorated code's AST, so it ignores formatting and comments. The
+    decorators are left out, as they aren't part of its source code.
+    """
+    undecorated = copy.copy(node)
+    undecorated.decorator_list = []
+    return hashlib.sha1(ast.dump(undecorated).encode()).hexdigest()
+
+
+class ExtractedBlob(NamedTuple):
+    reports: list[ReportRecord]
+    # A hash of each report's code, to tell whether it changed between versions
+    code_hashes: list[str]
+    # The lines the reports depend on, if known, see _get_decorated_lines
+    decorated_lines: DecoratedLines | None = None
+
+
+def _extract_records_from_source(
+    source_code: str, new_path: str, decorator_name: str, keep_source_code: bool
+) -> ExtractedBlob:
+    _log.debug("Processing file %s", new_path)
+    tree = ast.parse(source_code, filename=new_path)
+    visitor = TraceabilityVisitor(
+        decorator_name,
+        file_path=Path(new_path),
+        source_code=source_code,
+        keep_source_code=keep_source_code,
+    )
+    records = visitor.extract_records(tree)
+    return ExtractedBlob(
+        records,
+        [_hash_code(node) for node in visitor.decorated_nodes],
+        _get_decorated_lines(source_code, visitor),
+    )
+
+
+def _diff_could_change_reports(
+    diff: FileDiff, decorated_lines: DecoratedLines, decorator_name: str
+) -> bool:
+    """
+    Whether the file before the change could have had different reports, because
+    the diff touches the lines they were extracted from, adds or removes a decorator,
+    opens or closes a string that could have hidden one, or changes how the file is
+    decoded.
+    """
+    if (
+        not diff.hunks
+        or decorator_name in diff.changed_lines
+        or '"""' in diff.changed_lines
+        or "'''" in diff.changed_lines
+        or "coding" in diff.changed_lines
+    ):
+        return True
+    for _, _, new_start, new_count in diff.hunks:
+        for first, last in decorated_lines:
+            if new_count == 0:
+                # Lines were only removed, from just after new_start
+                if first <= new_start < last:
+                    return True
+            elif new_start <= last and new_start + new_count > first:
+                return True
+    return False
+
+
+def _line_before_change(line_number: int, diff: FileDiff) -> int:
+    return line_number + sum(
+        old_count - new_count
+        for _, old_count, new_start, new_count in diff.hunks
+        if new_start < line_number
+    )
+
+
+def _reports_before_change(
+    reports: list[ReportRecord], diff: FileDiff
+) -> list[ReportRecord]:
+    previous_reports = []
+    for report in reports:
+        source_span = report.source_span
+        if source_span is not None:
+            source_span = source_span._replace(
+                lineno=_line_before_change(source_span.lineno, diff),
+                end_lineno=source_span.end_lineno
+                and _line_before_change(source_span.end_lineno, diff),
+            )
+        previous_reports.append(
+            ReportRecord(
+                key=report.key,
+                metadata=report.metadata,
+                file_path=report.file_path,
+                function_name=report.function_name,
+                line_number=_line_before_change(report.line_number, diff),
+                end_line_number=report.end_line_number
+                and _line_before_change(report.end_line_number, diff),
+                source_code=report.source_code,
+                source_span=source_span,
+                dependencies=report.dependencies,
+            )
+        )
+    return previous_reports
+
+
+def _derive_previous_blob(
+    extracted_blob: ExtractedBlob, diff: FileDiff, decorator_name: str
+) -> ExtractedBlob | None:
+    """
+    What would be extracted from the version of a file before diff, worked out from
+    what was extracted from the version after it, or None if the diff could have
+    changed the reports and the version before it needs parsing.
+    """
+    decorated_lines = extracted_blob.decorated_lines
+    if decorated_lines is None or _diff_could_change_reports(
+        diff, decorated_lines, decorator_name
+    ):
+        return None
+    return ExtractedBlob(
+        _reports_before_change(extracted_blob.reports, diff),
+        extracted_blob.code_hashes,
+        [
+            (_line_before_change(first, diff), _line_before_change(last, diff))
+            for first, last in decorated_lines
+        ],
+    )
+
+
+# What was extracted from a blob, None if it has no source code, or what extracting
+# it raised
+BlobResult = Union[ExtractedBlob, None, Exception]
+# The blob a commit changed a file into, and the diff that changed it
+NewerVersion = Tuple[str, FileDiff]
+# What was extracted from each blob in a chunk, and what was worked out instead
+ChunkResults = Tuple[Dict[str, BlobResult], Dict[str, ExtractedBlob]]
+
+
+def _extract_from_blobs(
+    repo_root: Path,
+    decorator_name: str,
+    keep_source_code: bool,
+    blobs: list[tuple[str, str, NewerVersion | None]],
+) -> ChunkResults:
+    """
+    Read and parse blobs in a worker process, newest first. As in BlobExtractor, a
+    blob whose newer version was parsed earlier in the list is worked out from it
+    instead when the diff between them leaves the reports alone, and those are
+    returned separately. Errors are returned rather than raised, as they only matter
+    if the history walk gets as far as needing the blob.
+    """
+    results: dict[str, BlobResult] = {}
+    derived: dict[str, ExtractedBlob] = {}
+    with git.Repo(repo_root) as repo:
+        for blob_sha, new_path, newer_version in blobs:
+            if newer_version is not None:
+                newer_blob_sha, diff = newer_version
+                newer_result = derived.get(newer_blob_sha, results.get(newer_blob_sha))
+                if isinstance(newer_result, ExtractedBlob):
+                    derived_blob = _derive_previous_blob(
+                        newer_result, diff, decorator_name
+                    )
+                    if derived_blob is not None:
+                        derived[blob_sha] = derived_blob
+                        continue
+            try:
+                data = repo.git.get_object_data(blob_sha)[3]
+                results[blob_sha] = (
+                    _extract_records_from_source(
+                        decode_blob(data), new_path, decorator_name, keep_source_code
+                    )
+                    if data
+                    else None
+                )
+            except Exception as e:
+                results[blob_sha] = e
+    return results, derived
+
+
+class BlobExtractor:
+    """
+    Extracts the reports from each version of a file seen in the history. Many
+    versions are seen again and again (eg through reverts, cherry-picks and merges),
+    so each git blob is only parsed once per run, and once ever if there's a cache.
+
+    Most commits don't touch decorated code, so when a commit's diff leaves the lines
+    the reports were extracted from alone, the reports in the version before it are
+    the same ones moved by the lines added and removed above them, and that version
+    never needs parsing at all.
+    """
+
+    def __init__(
+        self, config: PyTraceabilityConfig, cache: HistoryBlobCache | None = None
+    ) -> None:
+        self.config = config
+        self.cache = cache
+        self._extracted: dict[str, BlobResult] = {}
+
+    def is_extracted(self, blob_sha: str) -> bool:
+        if blob_sha in self._extracted:
+            return True
+        if self.cache is not None:
+            cached = self.cache.get(blob_sha)
+            if cached is not None:
+                self._extracted[blob_sha] = ExtractedBlob(*cached)
+                return True
+        return False
+
+    def add(self, blob_sha: str, result: BlobResult) -> None:
+        self._extracted[blob_sha] = result
+        if isinstance(result, ExtractedBlob) and self.cache is not None:
+            self.cache.put(blob_sha, result.reports, result.code_hashes)
+
+    def add_derived(self, blob_sha: str, extracted_blob: ExtractedBlob) -> None:
+        # Only kept for this run, as the metadata is carried over from the newer
+        # version unchanged, even if it was read from a name that has changed
+        self._extracted.setdefault(blob_sha, extracted_blob)
+
+    def derive(self, old_blob_sha: str, blob_sha: str, diff: FileDiff) -> bool:
+        """
+        Work out what's in old_blob_sha, the version before diff, from what was
+        extracted from blob_sha, if it has been and the diff leaves the reports alone.
+        Returns whether old_blob_sha is known now.
+        """
+        if old_blob_sha in self._extracted:
+            return True
+        if not self.is_extracted(blob_sha):
+            return False
+        result = self._extracted[blob_sha]
+        if not isinstance(result, ExtractedBlob):
+            return False
+        derived_blob = _derive_previous_blob(result, diff, self.config.decorator_name)
+        if derived_blob is None:
+            return False
+        self.add_derived(old_blob_sha, derived_blob)
+        return True
+
+    def extract(self, modified_file: CommitFile) -> ExtractedBlob | None:
+        """
+        What was extracted from the file, or None if it has no source code.
+        """
+        blob_sha = modified_file.blob_sha
+        if blob_sha is not None and self.is_extracted(blob_sha):
+            result = self._extracted[blob_sha]
+            if isinstance(result, Exception):
+                raise result
+        else:
+            source_code = modified_file.source_code
+            if source_code is None or modified_file.new_path is None:
+                result = None
+            else:
+                result = _extract_records_from_source(
+                    source_code,
+                    modified_file.new_path,
+                    self.config.decorator_name,
+                    not self.config.lazy_source_code,
+                )
+            if blob_sha is not None:
+                self.add(blob_sha, result)
+        if result is None:
+            return None
+
+        old_blob_sha = modified_file.old_blob_sha
+        if (
+            old_blob_sha is not None
+            and modified_file.diff is not None
+            and old_blob_sha not in self._extracted
+        ):
+            derived_blob = _derive_previous_blob(
+                result, modified_file.diff, self.config.decorator_name
             )
-        return current_file_for_key
+            if derived_blob is not None:
+                self.add_derived(old_blob_sha, derived_blob)
+        return result
+
 
-    def reset_keys_for_relevant_files(self, relevant_files: list[ModifiedFile]):
-        relevant_paths = {f.new_path for f in relevant_files}
-        for k, v in self.items():
-            if v in relevant_paths:
-                self[k] = None
+def _extract_commit_files_in_parallel(
+    commits: Iterator[HistoryCommit],
+    blob_extractor: BlobExtractor,
+    config: PyTraceabilityConfig,
+    repo_root: Path,
+    executor: ProcessPoolExecutor,
+) -> Iterator[HistoryCommit]:
+    """
+    Pass the commits through in order, having had the files they change read and
+    parsed by the worker processes, a chunk of commits at a time. Later chunks are
+    parsed while the history walk works through the earlier ones.
+
+    As in the walk, a version of a file is worked out from the version after it,
+    rather than parsed, when the diff between them leaves the reports alone. That
+    needs the version after it to be parsed earlier in the same chunk, or to have
+    been parsed by the time the chunk is submitted. The files the walk skips in a
+    commit once every key has been located are still parsed, as which files those
+    are depends on how far the walk has got.
+    """
+    matcher = ExcludePatternMatcher(config.exclude_patterns)
+    extract = functools.partial(
+        _extract_from_blobs,
+        repo_root,
+        config.decorator_name,
+        not config.lazy_source_code,
+    )
+    submitted: set[str] = set()
+    # The newer version of each blob seen as the version before a change, until the
+    # blob itself is reached
+    newer_versions: dict[str, NewerVersion] = {}
+    in_flight: deque[tuple[list[HistoryCommit], Future[ChunkResults]]] = deque()
+    # The chunks whose results have been added before they were finished
+    added: set[Future[ChunkResults]] = set()
+
+    def add_results(future: Future[ChunkResults]) -> None:
+        results, derived = future.result()
+        for blob_sha, result in results.items():
+            blob_extractor.add(blob_sha, result)
+        for blob_sha, extracted_blob in derived.items():
+            blob_extractor.add_derived(blob_sha, extracted_blob)
+
+    def finish_oldest_chunk() -> list[HistoryCommit]:
+        commit_chunk, future = in_flight.popleft()
+        if future in added:
+            added.remove(future)
+        else:
+            add_results(future)
+        return commit_chunk
+
+    try:
+        while commit_chunk := list(islice(commits, _COMMITS_PER_CHUNK)):
+            # Take in what has been parsed already, so the blobs in this chunk can be
+            # worked out from it
+            for _, future in in_flight:
+                if future.done() and future not in added:
+                    add_results(future)
+                    added.add(future)
+            blobs: dict[str, tuple[str, NewerVersion | None]] = {}
+            for commit in commit_chunk:
+                for modified_file in commit.modified_files:
+                    blob_sha = modified_file.blob_sha
+                    new_path = modified_file.new_path
+                    if (
+                        blob_sha is None
+                        or new_path is None
+                        or not _is_history_file(new_path, matcher)
+                    ):
+                        continue
+                    if (
+                        modified_file.old_blob_sha is not None
+                        and modified_file.diff is not None
+                    ):
+                        newer_versions.setdefault(
+                            modified_file.old_blob_sha, (blob_sha, modified_file.diff)
+                        )
+                    newer_version = newer_versions.pop(blob_sha, None)
+                    if blob_sha in submitted or blob_extractor.is_extracted(blob_sha):
+                        continue
+                    if newer_version is not None and blob_extractor.derive(
+                        blob_sha, *newer_version
+                    ):
+                        continue
+                    submitted.add(blob_sha)
+                    blobs[blob_sha] = (new_path, newer_version)
+            in_flight.append(
+                (
+                    commit_chunk,
+                    executor.submit(
+                        extract,
+                        [
+                            (blob_sha, new_path, newer_version)
+                            for blob_sha, (new_path, newer_version) in blobs.items()
+                        ],
+                    ),
+                )
+            )
+            if len(in_flight) >= config.jobs * _CHUNKS_IN_FLIGHT_PER_PROCESS:
+                yield from finish_oldest_chunk()
+        while in_flight:
+            yield from finish_oldest_chunk()
+    finally:
+        # Anything still waiting to be parsed is no longer needed once the walk stops
+        for _, future in in_flight:
+            future.cancel()
+
+
+def iter_commits(
+    repo_root: Path, history_config: HistoryModeConfig, revision: str | None = None
+) -> Iterator[HistoryCommit]:
+    """
+    The commits on the branch, newest first, or those in a git revision range.
+    """
+    if history_config.backend == HistoryBackend.PYDRILLER:
+        if revision is not None:  # pragma: no cover
+            raise ValueError("The pydriller backend can only walk a whole branch")
+        for commit in Repository(
+            str(repo_root),
+            order="reverse",
+            only_in_branch=history_config.git_branch,
+        ).traverse_commits():
+            yield HistoryCommit(
+                commit.hash,
+                commit.author.name,
+                commit.author_date,
+                commit.msg,
+                [_PydrillerFile(f) for f in commit.modified_files],
+            )
+    else:
+        with git.Repo(repo_root) as repo:
+            yield from iter_history_commits(repo, revision or history_config.git_branch)
+
+
+def _add_older_entry(
+    entries: list[TraceabilityGitHistory],
+    history_entry: TraceabilityGitHistory,
+    history_mode: HistoryMode,
+) -> None:
+    """
+    Add an entry from further back in the history than those in entries. In changed
+    mode, it replaces the entry after it if the code is the same, so only the commits
+    that changed the code are kept.
+    """
+    if (
+        history_mode == HistoryMode.CHANGED
+        and entries
+        and entries[-1]._code_hash == history_entry._code_hash
+    ):
+        entries[-1] = history_entry
+    else:
+        entries.append(history_entry)
 
 
 @pytraceability(
@@ -57,60 +618,346 @@ class CurrentFileForKey(Dict[str, Optional[str]]):
     info=f"{PROJECT_NAME} can extract a history of the code decorated by a given key from git",
 )
 def get_line_based_history(
-    traceability_reports: list[TraceabilityReport], config: PyTraceabilityConfig
+    traceability_reports: list[TraceabilityReport],
+    config: PyTraceabilityConfig,
+    revision: str | None = None,
 ) -> dict[str, list[TraceabilityGitHistory]]:
     if config.history_config is None:  # pragma: no cover
         raise ValueError("History mode is not enabled in the config")
-    current_file_for_key = CurrentFileForKey.from_traceability_reports(
+    key_file_index = KeyFileIndex.from_traceability_reports(
         traceability_reports, config
     )
 
     history: dict[str, list[TraceabilityGitHistory]] = {}
+    exclude_pattern_matcher = ExcludePatternMatcher(config.exclude_patterns)
     repo_root = get_repo_root(config.base_directory)
-    for commit in Repository(
-        str(repo_root),
-        order="reverse",
-        only_in_branch=config.history_config.git_branch,
-    ).traverse_commits():
-        current_file_set = set(current_file_for_key.values())
-        relevant_files_first = sorted(
-            commit.modified_files,
-            key=lambda f: f.new_path in current_file_set,
+    with ExitStack() as stack:
+        cache = (
+            None
+            if config.no_cache
+            else stack.enter_context(
+                HistoryBlobCache(
+                    config.cache_directory,
+                    config.decorator_name,
+                    config.cache_max_size,
+                    keep_source_code=not config.lazy_source_code,
+                )
+            )
         )
-
-        current_file_for_key.reset_keys_for_relevant_files(relevant_files_first)
-        for modified_file in relevant_files_first:
-            if (
-                modified_file.source_code is None
-                or modified_file.new_path is None
-                or not modified_file.new_path.endswith("py")
-                or file_is_excluded(
-                    Path(modified_file.new_path), config.exclude_patterns
+        blob_extractor = BlobExtractor(config, cache)
+        commits = iter_commits(repo_root, config.history_config, revision)
+        if config.jobs > 1 and config.history_config.backend == HistoryBackend.GIT:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=config.jobs))
+            commits = stack.enter_context(
+                closing(
+                    _extract_commit_files_in_parallel(
+                        commits, blob_extractor, config, repo_root, executor
+                    )
                 )
-            ):
-                continue
-            _log.debug("Processing file %s", modified_file.new_path)
-            tree = ast.parse(modified_file.source_code, filename=modified_file.new_path)
-            traceability_reports = TraceabilityVisitor(
-                config.decorator_name,
-                file_path=Path(modified_file.new_path),
-                source_code=modified_file.source_code,
-            ).visit(tree)
-            for traceability_report in traceability_reports:
-                if traceability_report.key not in history:
-                    history[traceability_report.key] = []
-                history[traceability_report.key].append(
-                    TraceabilityGitHistory(
+            )
+        for commit in commits:
+            relevant_files_first = sorted(
+                commit.modified_files,
+                key=lambda f: key_file_index.is_current_file(f.new_path),
+            )
+
+            key_file_index.reset_keys_for_relevant_files(relevant_files_first)
+            for modified_file in relevant_files_first:
+                if modified_file.new_path is None or not _is_history_file(
+                    modified_file.new_path, exclude_pattern_matcher
+                ):
+                    continue
+                extracted_blob = blob_extractor.extract(modified_file)
+                if extracted_blob is None:
+                    continue
+                for traceability_report, code_hash in zip(
+                    extracted_blob.reports, extracted_blob.code_hashes
+                ):
+                    if traceability_report.key not in history:
+                        history[traceability_report.key] = []
+                    history_entry = TraceabilityGitHistory(
                         commit=commit.hash,
-                        author_name=commit.author.name,
+                        author_name=commit.author_name,
                         author_date=commit.author_date,
-                        message=commit.msg.strip(),
+                        message=commit.message.strip(),
                         source_code=traceability_report.source_code,
                     )
+                    history_entry._code_hash = code_hash
+                    if traceability_report.source_span is not None:
+                        history_entry.defer_source_code(
+                            modified_file.new_path, traceability_report.source_span
+                        )
+                    _add_older_entry(
+                        history[traceability_report.key],
+                        history_entry,
+                        config.history_config.history_mode,
+                    )
+                    key_file_index.set_file(
+                        traceability_report.key, modified_file.new_path
+                    )
+
+                if key_file_index.all_keys_located():
+                    _log.info("All traceability decorators located for commit")
+                    break
+    return history
+
+
+def get_blame_history(
+    traceability_reports: list[TraceabilityReport], config: PyTraceabilityConfig
+) -> dict[str, list[TraceabilityGitHistory]]:
+    """
+    A single entry for each report, for the newest commit that changed any of its
+    lines, decorators included, found with one git blame of each file in the branch.
+    The keys are located in the branch's version of the file, as the working tree's
+    line numbers don't match it if there are uncommitted changes or another branch is
+    checked out.
+    """
+    if config.history_config is None:  # pragma: no cover
+        raise ValueError("History mode is not enabled in the config")
+    repo_root = get_repo_root(config.base_directory)
+    reports_by_file: dict[Path, list[TraceabilityReport]] = defaultdict(list)
+    for traceability_report in traceability_reports:
+        reports_by_file[traceability_report.file_path].append(traceability_report)
+
+    history: dict[str, list[TraceabilityGitHistory]] = {}
+    with git.Repo(repo_root) as repo:
+        branch = config.history_config.git_branch
+        commits: dict[str, git.Commit] = {}
+        for file_path, reports_for_file in reports_by_file.items():
+            path_in_repo = file_path.resolve().relative_to(repo_root).as_posix()
+            try:
+                data = repo.git.get_object_data(f"{branch}:{path_in_repo}")[3]
+            except ValueError:
+                _log.warning("%s isn't in %s", path_in_repo, branch)
+                continue
+            branch_line_ranges = {
+                record.key: (
+                    node.decorator_list[0].lineno,
+                    record.end_line_number or record.line_number,
+                )
+                for record, node in _locate_keys(
+                    repo, decode_blob(data), path_in_repo, config
                 )
-                current_file_for_key[traceability_report.key] = modified_file.new_path
+            }
+            reports_in_branch = [
+                report
+                for report in reports_for_file
+                if report.key in branch_line_ranges
+            ]
+            line_ranges = [branch_line_ranges[r.key] for r in reports_in_branch]
+            if not line_ranges:
+                continue
+            try:
+                blamed_lines = list(
+                    blame_line_ranges(repo, path_in_repo, line_ranges, branch)
+                )
+            except git.GitCommandError as e:
+                _log.warning("Couldn't blame %s: %s", path_in_repo, e.stderr.strip())
+                continue
+            for report, (first, last) in zip(reports_in_branch, line_ranges):
+                report_commits = [
+                    commits.get(commit)
+                    or commits.setdefault(commit, repo.commit(commit))
+                    for commit, first_line, line_count in blamed_lines
+                    if commit != NULL_COMMIT
+                    and first_line <= last
+                    and first_line + line_count > first
+                ]
+                if not report_commits:
+                    continue
+                newest_commit = max(report_commits, key=lambda c: c.committed_date)
+                history[report.key] = [
+                    TraceabilityGitHistory(
+                        commit=newest_commit.hexsha,
+                        author_name=newest_commit.author.name,
+                        author_date=newest_commit.authored_datetime,
+                        message=str(newest_commit.message).strip(),
+                        source_code=None,
+                    )
+                ]
+    return history
+
+
+def _locate_keys(
+    repo: git.Repo,
+    source_code: str,
+    path_in_repo: str,
+    config: PyTraceabilityConfig,
+) -> Iterator[tuple[ReportRecord, DecoratedNode]]:
+    tree = ast.parse(source_code, filename=path_in_repo)
+    # Keys imported from other modules are resolved from the working tree, as they
+    # are when the reports are collected
+    visitor = TraceabilityVisitor(
+        config.decorator_name,
+        file_path=Path(str(repo.working_tree_dir)) / path_in_repo,
+        source_code=source_code,
+        keep_source_code=True,
+        python_root=config.python_root,
+    )
+    return zip(visitor.extract_records(tree), visitor.decorated_nodes)
+
+
+def _locate_key(
+    repo: git.Repo,
+    source_code: str,
+    path_in_repo: str,
+    key: str,
+    config: PyTraceabilityConfig,
+) -> tuple[ReportRecord, DecoratedNode] | None:
+    for record, node in _locate_keys(repo, source_code, path_in_repo, config):
+        if record.key == key:
+            return record, node
+    return None
+
+
+def _find_key(
+    repo: git.Repo,
+    revision: str,
+    key: str,
+    path_in_repo: str,
+    config: PyTraceabilityConfig,
+) -> tuple[str, ReportRecord, DecoratedNode] | None:
+    """
+    Where the key is in a commit, looking in path_in_repo first, then in the other
+    files that git grep finds the key in, and only then in every file with the
+    decorator name, for keys that aren't written out but read from a constant.
+    """
+    matcher = ExcludePatternMatcher(config.exclude_patterns)
+    candidate_paths = chain(
+        [path_in_repo],
+        iter_files_containing(repo, revision, key),
+        iter_files_containing(repo, revision, config.decorator_name),
+    )
+    searched_paths: set[str] = set()
+    for candidate_path in candidate_paths:
+        if candidate_path in searched_paths or not _is_history_file(
+            candidate_path, matcher
+        ):
+            continue
+        searched_paths.add(candidate_path)
+        try:
+            data = repo.git.get_object_data(f"{revision}:{candidate_path}")[3]
+        except ValueError:
+            # Not in this commit
+            continue
+        if not data:
+            continue
+        located = _locate_key(repo, decode_blob(data), candidate_path, key, config)
+        if located is not None:
+            return (candidate_path, *located)
+    return None
+
+
+def _follow_key(
+    repo: git.Repo, key: str, path_in_repo: str, config: PyTraceabilityConfig
+) -> list[TraceabilityGitHistory]:
+    if config.history_config is None:  # pragma: no cover
+        raise ValueError("History mode is not enabled in the config")
+    entries: list[TraceabilityGitHistory] = []
+    revision = config.history_config.git_branch
+    location = _find_key(repo, revision, key, path_in_repo, config)
+    while location is not None:
+        path_in_repo, record, node = location
+        oldest_commit = None
+        for commit, commit_path in iter_line_range_commits(
+            repo,
+            revision,
+            path_in_repo,
+            node.decorator_list[0].lineno,
+            record.end_line_number or record.line_number,
+        ):
+            data = repo.git.get_object_data(f"{commit.hash}:{commit_path}")[3]
+            located = _locate_key(repo, decode_blob(data), commit_path, key, config)
+            if located is None:
+                # The lines are older than the key
+                return entries
+            commit_record, commit_node = located
+            history_entry = TraceabilityGitHistory(
+                commit=commit.hash,
+                author_name=commit.author_name,
+                author_date=commit.author_date,
+                message=commit.message.strip(),
+                source_code=commit_record.source_code,
+            )
+            history_entry._code_hash = _hash_code(commit_node)
+            _add_older_entry(entries, history_entry, config.history_config.history_mode)
+            oldest_commit, path_in_repo = commit.hash, commit_path
+        if oldest_commit is None:  # pragma: no cover
+            break
+        # The oldest commit added the lines, but the key might have been somewhere
+        # else before, if its code was moved
+        parents = repo.commit(oldest_commit).parents
+        if not parents:
+            break
+        revision = parents[0].hexsha
+        location = _find_key(repo, revision, key, path_in_repo, config)
+    return entries
+
+
+def get_key_history(
+    traceability_reports: list[TraceabilityReport], config: PyTraceabilityConfig
+) -> dict[str, list[TraceabilityGitHistory]]:
+    """
+    The history of just the given reports, for fetching it on demand. Rather than
+    walking every commit, each key's lines are followed back with git log -L, and when
+    they run out the key is looked for again in the commit before, so it's followed
+    when its code is moved.
+    """
+    repo_root = get_repo_root(config.base_directory)
+    with git.Repo(repo_root) as repo:
+        return {
+            report.key: _follow_key(
+                repo,
+                report.key,
+                report.file_path.resolve().relative_to(repo_root).as_posix(),
+                config,
+            )
+            for report in traceability_reports
+        }
+
 
-            if all(current_file_for_key.values()):
-                _log.info("All traceability decorators located for commit")
-                break
+def get_history(
+    traceability_reports: list[TraceabilityReport], config: PyTraceabilityConfig
+) -> dict[str, list[TraceabilityGitHistory]]:
+    """
+    The history for the reports. For an incremental run, only the commits made since
+    the last one are walked, and their entries put in front of the history from then.
+    """
+    if config.history_config is None:  # pragma: no cover
+        raise ValueError("History mode is not enabled in the config")
+    if config.history_config.history_mode == HistoryMode.BLAME:
+        # Already quick enough that there's nothing to gain from a baseline
+        return get_blame_history(traceability_reports, config)
+    if (
+        not config.incremental
+        or config.history_config.backend == HistoryBackend.PYDRILLER
+    ):
+        return get_line_based_history(traceability_reports, config)
+
+    incremental_history = IncrementalHistory(config)
+    branch_head = incremental_history.get_branch_head()
+    baseline = incremental_history.load_baseline(branch_head)
+    if baseline is None:
+        history = get_line_based_history(traceability_reports, config, branch_head)
+    else:
+        new_history = get_line_based_history(
+            traceability_reports, config, f"{baseline.commit}..{branch_head}"
+        )
+        _log.info(
+            "Found %s new history entries since commit %s",
+            sum(len(entries) for entries in new_history.values()),
+            baseline.commit,
+        )
+        history = dict(baseline.history)
+        for key, entries in new_history.items():
+            previous_entries = history.get(key, [])
+            if previous_entries:
+                _add_older_entry(
+                    entries,
+                    previous_entries[0],
+                    config.history_config.history_mode,
+                )
+                entries.extend(previous_entries[1:])
+            history[key] = entries
+    incremental_history.save_baseline(branch_head, history)
     return history
@@ -1,9 +1,15 @@
 from __future__ import annotations
-from typing import Generator
+from itertools import zip_longest
+from typing import Any, Generator
 from html import escape
 from jinja2 import Template
 
-from pytraceability.data_definition import TraceabilitySummary
+from pytraceability.data_definition import (
+    TraceabilityGitHistory,
+    TraceabilityReport,
+    TraceabilitySummary,
+)
+from pytraceability.source import make_source_diff
 
 HTML_TEMPLATE = """
 <table border="1" cellspacing="0" cellpadding="5">
@@ -45,6 +51,9 @@ HTML_TEMPLATE = """
                             {% else %}
                                 {{ commit.commit | escape }}
                             {% endif %}
+                            {% if commit.changes is not none %}
+                            <pre>{{ commit.changes | escape }}</pre>
+                            {% endif %}
                         </li>
                         {% endfor %}
                     {% else %}
@@ -59,6 +68,27 @@ HTML_TEMPLATE = """
 """
 
 
+def _get_history_changes(report: TraceabilityReport) -> list[dict[str, Any]]:
+    """
+    The commits in the report's history. If it was written as diffs, each comes with
+    what it changed, or the whole source code for the oldest one.
+    """
+    history: list[TraceabilityGitHistory] = report.history or []
+    if all(entry.source_diff is None for entry in history):
+        return [{"commit": entry.commit, "changes": None} for entry in history]
+    snapshots = report.with_history_snapshots().history or []
+    changes = []
+    for entry, older_entry in zip_longest(snapshots, snapshots[1:]):
+        if older_entry is None:
+            entry_changes = entry.source_code
+        elif entry.source_code is None or older_entry.source_code is None:
+            entry_changes = None
+        else:
+            entry_changes = make_source_diff(older_entry.source_code, entry.source_code)
+        changes.append({"commit": entry.commit, "changes": entry_changes})
+    return changes
+
+
 def render_traceability_summary_html(
     summary: TraceabilitySummary,
     commit_url_template: str | None,
@@ -73,7 +103,7 @@ def render_traceability_summary_html(
             "line_range": f"{report.line_number} to {report.end_line_number or report.line_number}",
             "contains_raw_source_code": report.contains_raw_source_code,
             "source_code": report.source_code,
-            "history": report.history,
+            "history": _get_history_changes(report),
         }
         for report in summary.reports
     ]
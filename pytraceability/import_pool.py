@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import time
+from collections import deque
+from itertools import count
+from multiprocessing.connection import Connection, wait
+from pathlib import Path
+from typing import Any, cast
+
+from pytraceability.data_definition import Traceability
+from pytraceability.import_processing import extract_traceabilities_using_module_import
+
+_log = logging.getLogger(__name__)
+
+# How long to give idle workers to exit cleanly when the pool is closed
+_SHUTDOWN_TIMEOUT_SECONDS = 5
+
+
+def _worker_main(connection: Connection, python_root: Path, max_imports: int) -> None:
+    """
+    Import modules sent from the parent until told to stop, or until max_imports
+    modules have been imported, so that whatever the imports leave behind in
+    sys.modules is thrown away with the process.
+    """
+    for _ in range(max_imports):
+        try:
+            job = connection.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        file_path, function_names = job
+        try:
+            result: tuple[bool, Any] = (
+                True,
+                list(
+                    extract_traceabilities_using_module_import(
+                        file_path, python_root, function_names
+                    )
+                ),
+            )
+        except Exception as e:
+            result = (False, e)
+        try:
+            connection.send(result)
+        except Exception:
+            # The exception (or something in the metadata) couldn't be pickled
+            connection.send(
+                (False, RuntimeError(f"Unable to send results back: {result[1]!r}"))
+            )
+    connection.close()
+
+
+class _Job:
+    def __init__(self, file_path: Path, function_names: list[str]) -> None:
+        self.file_path = file_path
+        self.function_names = function_names
+        self.done = False
+        self.result: list[Traceability] | None = None
+        self.error: Exception | None = None
+
+
+class _Worker:
+    def __init__(self, python_root: Path, max_imports: int) -> None:
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_worker_main,
+            args=(child_connection, python_root, max_imports),
+            daemon=True,
+        )
+        self.process.start()
+        child_connection.close()
+        self.imports_remaining = max_imports
+        self.job: _Job | None = None
+        self.deadline: float | None = None
+
+    def start_job(self, job: _Job, timeout: float | None) -> None:
+        self.connection.send((job.file_path, job.function_names))
+        self.imports_remaining -= 1
+        self.job = job
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+
+    def stop(self, terminate: bool = False) -> None:
+        if not terminate and self.process.is_alive():
+            try:
+                self.connection.send(None)
+            except OSError:
+                pass
+            self.process.join(_SHUTDOWN_TIMEOUT_SECONDS)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.connection.close()
+
+
+class ModuleImportPool:
+    """
+    Imports modules in a pool of worker processes, so that the imports run in
+    parallel, a slow or hanging import can be timed out, and the imported modules
+    don't accumulate in the main process. Each worker is replaced after
+    imports_per_worker imports.
+
+    Jobs are submitted up front and their results collected in any order, the
+    workers are only driven while waiting for a result.
+    """
+
+    def __init__(
+        self,
+        python_root: Path,
+        processes: int,
+        timeout: float | None = None,
+        imports_per_worker: int = 100,
+    ) -> None:
+        self.python_root = python_root
+        self.processes = processes
+        self.timeout = timeout
+        self.imports_per_worker = imports_per_worker
+        self._workers: list[_Worker] = []
+        self._queue: deque[_Job] = deque()
+        self._jobs: dict[int, _Job] = {}
+        self._job_ids = count()
+
+    def __enter__(self) -> ModuleImportPool:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def submit(self, file_path: Path, function_names: list[str]) -> int:
+        job_id = next(self._job_ids)
+        self._jobs[job_id] = job = _Job(file_path, function_names)
+        self._queue.append(job)
+        self._dispatch()
+        return job_id
+
+    def result(self, job_id: int) -> list[Traceability] | None:
+        """
+        Wait for a job to finish, re-raising anything its import raised. An import
+        that times out is logged and gives None.
+        """
+        job = self._jobs.pop(job_id)
+        while not job.done:
+            self._poll()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _dispatch(self) -> None:
+        for worker in self._workers:
+            if not self._queue:
+                return
+            if worker.job is None:
+                worker.start_job(self._queue.popleft(), self.timeout)
+        while self._queue and len(self._workers) < self.processes:
+            worker = _Worker(self.python_root, self.imports_per_worker)
+            self._workers.append(worker)
+            worker.start_job(self._queue.popleft(), self.timeout)
+
+    def _poll(self) -> None:
+        busy_workers = {
+            worker.connection: worker for worker in self._workers if worker.job
+        }
+        deadlines = [w.deadline for w in busy_workers.values() if w.deadline]
+        wait_time = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+        for connection in wait(list(busy_workers), timeout=wait_time):
+            self._receive(busy_workers[cast(Connection, connection)])
+        now = time.monotonic()
+        for worker in busy_workers.values():
+            if worker.job and worker.deadline and worker.deadline <= now:
+                _log.error(
+                    "Timed out after %ss importing %s, keeping the statically "
+                    "extracted metadata",
+                    self.timeout,
+                    worker.job.file_path,
+                )
+                self._finish(worker, None)
+                self._replace(worker, terminate=True)
+        self._dispatch()
+
+    def _receive(self, worker: _Worker) -> None:
+        try:
+            succeeded, result = worker.connection.recv()
+        except EOFError:
+            file_path = worker.job.file_path if worker.job else None
+            succeeded, result = (
+                False,
+                RuntimeError(f"Worker process exited while importing {file_path}"),
+            )
+        if succeeded:
+            self._finish(worker, result)
+        else:
+            self._finish(worker, None, result)
+        if worker.imports_remaining == 0 or not succeeded:
+            self._replace(worker)
+
+    def _finish(
+        self,
+        worker: _Worker,
+        result: list[Traceability] | None,
+        error: Exception | None = None,
+    ) -> None:
+        job = worker.job
+        assert job is not None
+        job.result = result
+        job.error = error
+        job.done = True
+        worker.job = None
+
+    def _replace(self, worker: _Worker, terminate: bool = False) -> None:
+        # Started again by _dispatch if there's still work to do
+        worker.stop(terminate)
+        self._workers.remove(worker)
+
+    def close(self) -> None:
+        for worker in self._workers:
+            # Anything still importing is no longer wanted
+            worker.stop(terminate=worker.job is not None)
+        self._workers.clear()
+        self._queue.clear()
@@ -1,9 +1,11 @@
 from __future__ import annotations
 
+import ast
+import functools
 import logging
 from importlib import util
 from pathlib import Path
-from typing import Generator, Iterator
+from typing import Generator, Iterable, Union
 
 from pytraceability.common import (
     Traceability,
@@ -11,6 +13,7 @@ from pytraceability.common import (
 from pytraceability.config import PROJECT_NAME
 from pytraceability.custom import pytraceability
 from pytraceability.data_definition import (
+    ReportRecord,
     TraceabilityReport,
 )
 from pytraceability.exceptions import (
@@ -31,6 +34,94 @@ def _get_module_name(
     return relative_path.with_suffix("").as_posix().replace("/", ".")
 
 
+def get_package_parts(file_path: Path, python_root: Path) -> list[str]:
+    """
+    The package that relative imports in file_path are relative to, which for a
+    package's __init__.py is the package itself.
+    """
+    return _get_module_name(file_path, python_root).split(".")[:-1]
+
+
+def get_imported_module_parts(
+    package: list[str], node: ast.ImportFrom
+) -> list[str] | None:
+    """
+    The module imported from by a from-import, or None if a relative import goes
+    above the top level package.
+    """
+    if node.level > len(package) + 1:
+        return None
+    module_parts = package[: len(package) - node.level + 1] if node.level else []
+    if node.module:
+        module_parts = module_parts + node.module.split(".")
+    return module_parts
+
+
+def resolve_local_module(python_root: Path, module_parts: list[str]) -> Path | None:
+    if not module_parts:
+        return None
+    module_path = python_root.joinpath(*module_parts)
+    for candidate in (
+        module_path.with_name(module_path.name + ".py"),
+        module_path / "__init__.py",
+    ):
+        if candidate.is_file():
+            return candidate
+    return None
+
+
+class LocalImportFinder:
+    """
+    Statically finds the modules under python_root that a module imports, directly or
+    through other local modules. Imports of anything outside python_root are ignored.
+    """
+
+    def __init__(self, python_root: Path) -> None:
+        self.python_root = python_root.resolve()
+
+    @functools.lru_cache(maxsize=None)
+    def _direct_imports(self, file_path: Path) -> frozenset[Path]:
+        try:
+            tree = ast.parse(file_path.read_bytes(), filename=str(file_path))
+            package = get_package_parts(file_path, self.python_root)
+        except (SyntaxError, ValueError):
+            return frozenset()
+
+        imported_modules: list[list[str]] = []
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                imported_modules.extend(alias.name.split(".") for alias in node.names)
+            elif isinstance(node, ast.ImportFrom):
+                base = get_imported_module_parts(package, node)
+                if base is None:
+                    continue
+                imported_modules.append(base)
+                # The names may be submodules rather than attributes
+                imported_modules.extend(
+                    base + [alias.name] for alias in node.names if alias.name != "*"
+                )
+
+        imports = set()
+        for module_parts in imported_modules:
+            # Importing a module imports all its parent packages too
+            for end in range(1, len(module_parts) + 1):
+                if resolved := resolve_local_module(
+                    self.python_root, module_parts[:end]
+                ):
+                    imports.add(resolved)
+        return frozenset(imports)
+
+    def find_import_closure(self, file_path: Path) -> list[Path]:
+        closure: set[Path] = set()
+        to_visit = [file_path.resolve()]
+        while to_visit:
+            path = to_visit.pop()
+            if path not in closure:
+                closure.add(path)
+                to_visit.extend(self._direct_imports(path))
+        return sorted(closure)
+
+
 def _load_python_module(
     file_path: Path,
     python_root: Path,
@@ -64,14 +155,21 @@ def _extract_traceability(module, node_name) -> Generator[Traceability, None, No
     "PYTRACEABILITY-4",
     info=f"If {PROJECT_NAME} can't extract the key either statically or dynamically, an"
     f"{InvalidTraceabilityError.__name__} is raised. This might happen for a closure where "
-    "the traceability key is stored in a variable.",
+    "the traceability key is passed in as an argument.",
 )
 def extract_traceabilities_using_module_import(
     file_path: Path,
     python_root: Path,
-    traceability_reports: Iterator[TraceabilityReport],
+    function_names: Iterable[Union[str, ReportRecord, TraceabilityReport]],
 ) -> Generator[Traceability, None, None]:
+    """
+    Import the module and read the traceability from the named functions. The
+    reports themselves can still be passed instead of their function names, as
+    this used to be called with.
+    """
     _log.info("Extracting traceability from %s using module import", file_path)
     module = _load_python_module(file_path, python_root)
-    for traceability_report in traceability_reports:
-        yield from _extract_traceability(module, traceability_report.function_name)
+    for function_name in function_names:
+        if not isinstance(function_name, str):
+            function_name = function_name.function_name
+        yield from _extract_traceability(module, function_name)
@@ -0,0 +1,298 @@
+from __future__ import annotations
+
+import json
+import logging
+from pathlib import Path, PurePosixPath
+from typing import Any
+
+import git
+from pydantic import BaseModel, ConfigDict, Field
+
+from pytraceability.cache import (
+    DependencyHashes,
+    decode_dependency_hashes,
+    decode_records,
+    decode_value,
+    encode_dependency_hashes,
+    encode_records,
+    encode_value,
+    get_changed_dependencies,
+    get_package_version,
+    hash_content,
+    hash_dependencies,
+)
+from pytraceability.common import ExcludePatternMatcher
+from pytraceability.config import FileSource, PyTraceabilityConfig, get_repo_root
+from pytraceability.data_definition import ReportRecord, TraceabilityGitHistory
+from pytraceability.git_utils import get_changed_files, get_head_commit
+from pytraceability.source import SourceSpan
+
+_log = logging.getLogger(__name__)
+
+# Bump whenever the baseline format changes, so that baselines written by older
+# versions are rebuilt rather than misread
+_BASELINE_VERSION = 4
+
+
+class ReportBaseline(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    commit: str
+    # Files that differed from the commit when the baseline was saved, these always
+    # need re-extracting as they may since have been reverted to match the commit.
+    dirty_files: list[str]
+    reports: list[ReportRecord]
+    # The other modules constants in the reports were imported from, which may be
+    # outside base_directory, so they are checked by content rather than with git
+    dependency_hashes: DependencyHashes = Field(default_factory=dict)
+
+
+class IncrementalScan:
+    """
+    Keeps the reports from the last scan together with the commit they were built
+    from, so that the next scan only needs to re-extract the files git reports as
+    changed since then.
+    """
+
+    def __init__(self, config: PyTraceabilityConfig) -> None:
+        self.config = config
+        self.repo_root = get_repo_root(config.base_directory)
+        self.base_directory_in_repo = PurePosixPath(
+            config.base_directory.resolve().relative_to(self.repo_root).as_posix()
+        )
+        self.include_untracked = (
+            config.file_source == FileSource.FILESYSTEM or config.include_untracked
+        )
+        # Walking the filesystem finds ignored files too, so their edits are changes
+        self.include_ignored = config.file_source == FileSource.FILESYSTEM
+        self.baseline_file = config.cache_directory / f"baseline-{self._fingerprint()}"
+
+    def _fingerprint(self) -> str:
+        # A baseline is only valid for the same set of files and extraction logic
+        return hash_content(
+            repr(
+                (
+                    _BASELINE_VERSION,
+                    get_package_version(),
+                    str(self.config.base_directory.resolve()),
+                    str(self.config.python_root.resolve()),
+                    self.config.decorator_name,
+                    self.config.mode.value,
+                    self.config.exclude_patterns,
+                    self.config.file_source.value,
+                    self.config.include_untracked,
+                    self.config.lazy_source_code,
+                )
+            ).encode()
+        )
+
+    def _changed_files(self, repo: git.Repo, since_commit: str) -> set[str]:
+        return get_changed_files(
+            repo,
+            since_commit,
+            str(self.base_directory_in_repo / "*.py"),
+            include_untracked=self.include_untracked,
+            include_ignored=self.include_ignored,
+        )
+
+    def _to_file_path(self, path_in_repo: str) -> Path:
+        return self.config.base_directory / PurePosixPath(path_in_repo).relative_to(
+            self.base_directory_in_repo
+        )
+
+    def load_baseline(self) -> ReportBaseline | None:
+        if not self.baseline_file.exists():
+            _log.info("No baseline found at %s", self.baseline_file)
+            return None
+        # JSON rather than a pickle, so that reading a baseline can't run any code
+        data = json.loads(self.baseline_file.read_text())
+        return ReportBaseline(
+            commit=data["commit"],
+            dirty_files=data["dirty_files"],
+            reports=decode_records(data["reports"]),
+            dependency_hashes=decode_dependency_hashes(data["dependency_hashes"]),
+        )
+
+    def get_changed_file_paths(self, baseline: ReportBaseline) -> set[Path] | None:
+        """
+        Files that need re-extracting relative to the baseline, or None if the
+        baseline commit is no longer known to git.
+        """
+        with git.Repo(self.repo_root) as repo:
+            try:
+                changed_files = self._changed_files(repo, baseline.commit)
+            except git.GitCommandError:
+                _log.warning(
+                    "Baseline commit %s not found, running a full scan", baseline.commit
+                )
+                return None
+        changed_files.update(baseline.dirty_files)
+        _log.info(
+            "%s files changed since baseline commit %s",
+            len(changed_files),
+            baseline.commit,
+        )
+        changed_file_paths = {self._to_file_path(path) for path in changed_files}
+        if changed_dependencies := get_changed_dependencies(baseline.dependency_hashes):
+            _log.info("%s dependencies have changed", len(changed_dependencies))
+            changed_file_paths.update(
+                report.file_path
+                for report in baseline.reports
+                if changed_dependencies.intersection(report.dependencies)
+            )
+        return changed_file_paths
+
+    def files_to_extract(self, changed_file_paths: set[Path]) -> list[Path]:
+        matcher = ExcludePatternMatcher(self.config.exclude_patterns)
+        return [
+            file_path
+            for file_path in sorted(changed_file_paths)
+            if file_path.is_file() and not matcher.file_is_excluded(str(file_path))
+        ]
+
+    def save_baseline(self, reports: list[ReportRecord]) -> None:
+        with git.Repo(self.repo_root) as repo:
+            if not repo.head.is_valid():
+                _log.info("Not saving a baseline as there are no commits yet")
+                return
+            commit = get_head_commit(repo)
+            dirty_files = self._changed_files(repo, commit)
+        try:
+            baseline = json.dumps(
+                {
+                    "commit": commit,
+                    "dirty_files": sorted(dirty_files),
+                    "reports": encode_records(reports),
+                    "dependency_hashes": encode_dependency_hashes(
+                        hash_dependencies(reports)
+                    ),
+                }
+            )
+        except TypeError as e:
+            _log.info("Not saving a baseline as it can't be stored: %s", e)
+            return
+        self.baseline_file.parent.mkdir(parents=True, exist_ok=True)
+        self.baseline_file.write_text(baseline)
+        _log.info("Saved baseline for commit %s to %s", commit, self.baseline_file)
+
+
+class HistoryBaseline(BaseModel):
+    # The branch's head when the history was built, everything reachable from it has
+    # already been walked
+    commit: str
+    history: dict[str, list[TraceabilityGitHistory]]
+
+
+def _encode_history_entry(entry: TraceabilityGitHistory) -> dict[str, Any]:
+    # The private attributes are needed to tell whether the code changed and to read
+    # deferred source code back, so they're kept too
+    return {
+        **entry.model_dump(mode="json", exclude_unset=True),
+        "_code_hash": entry._code_hash,
+        "_deferred_source": entry._deferred_source,
+    }
+
+
+def _decode_history_entry(data: dict[str, Any]) -> TraceabilityGitHistory:
+    code_hash = data.pop("_code_hash")
+    deferred_source = data.pop("_deferred_source")
+    entry = TraceabilityGitHistory.model_validate(data)
+    entry._code_hash = code_hash
+    if deferred_source is not None:
+        file_path, source_span = deferred_source
+        entry._deferred_source = (file_path, SourceSpan(*source_span))
+    return entry
+
+
+class IncrementalHistory:
+    """
+    Keeps the history from the last run together with the commit the branch was at,
+    so that the next run only needs to walk the commits made since then.
+    """
+
+    def __init__(self, config: PyTraceabilityConfig) -> None:
+        if config.history_config is None:  # pragma: no cover
+            raise ValueError("History mode is not enabled in the config")
+        self.config = config
+        self.history_config = config.history_config
+        self.repo_root = get_repo_root(config.base_directory)
+        self.baseline_file = (
+            config.cache_directory / f"history-baseline-{self._fingerprint()}"
+        )
+
+    def _fingerprint(self) -> str:
+        # A baseline is only valid for the same branch, history mode and extraction
+        # logic
+        return hash_content(
+            repr(
+                (
+                    _BASELINE_VERSION,
+                    get_package_version(),
+                    str(self.config.base_directory.resolve()),
+                    self.config.decorator_name,
+                    self.config.exclude_patterns,
+                    self.config.lazy_source_code,
+                    self.history_config.git_branch,
+                    self.history_config.history_mode,
+                )
+            ).encode()
+        )
+
+    def get_branch_head(self) -> str:
+        with git.Repo(self.repo_root) as repo:
+            return repo.commit(self.history_config.git_branch).hexsha
+
+    def load_baseline(self, branch_head: str) -> HistoryBaseline | None:
+        """
+        The history from the last run, or None if there isn't one that branch_head
+        follows on from, eg because the branch has since been rewritten.
+        """
+        if not self.baseline_file.exists():
+            _log.info("No history baseline found at %s", self.baseline_file)
+            return None
+        data = json.loads(self.baseline_file.read_text())
+        baseline = HistoryBaseline(
+            commit=data["commit"],
+            history={
+                decode_value(key): [_decode_history_entry(entry) for entry in entries]
+                for key, entries in data["history"]
+            },
+        )
+        with git.Repo(self.repo_root) as repo:
+            try:
+                is_ancestor = repo.is_ancestor(baseline.commit, branch_head)
+            except git.GitCommandError:
+                is_ancestor = False
+        if not is_ancestor:
+            _log.warning(
+                "History baseline commit %s is no longer on %s, walking the full "
+                "history",
+                baseline.commit,
+                self.history_config.git_branch,
+            )
+            return None
+        return baseline
+
+    def save_baseline(
+        self, branch_head: str, history: dict[str, list[TraceabilityGitHistory]]
+    ) -> None:
+        try:
+            baseline = json.dumps(
+                {
+                    "commit": branch_head,
+                    "history": [
+                        [encode_value(key), [_encode_history_entry(e) for e in entries]]
+                        for key, entries in history.items()
+                    ],
+                }
+            )
+        except TypeError as e:
+            _log.info("Not saving a history baseline as it can't be stored: %s", e)
+            return
+        self.baseline_file.parent.mkdir(parents=True, exist_ok=True)
+        self.baseline_file.write_text(baseline)
+        _log.info(
+            "Saved history baseline for commit %s to %s",
+            branch_head,
+            self.baseline_file,
+        )
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import ast
+import difflib
+import functools
+import re
+from importlib.util import decode_source
+from itertools import islice
+from pathlib import Path
+from typing import NamedTuple
+
+import git
+
+
+class SourceSpan(NamedTuple):
+    """
+    Where a node's source code is in a file, with the same meaning as the position
+    attributes of an ast node, so it can be passed to ast.get_source_segment.
+    """
+
+    lineno: int
+    col_offset: int
+    end_lineno: int | None
+    end_col_offset: int | None
+
+    @classmethod
+    def from_node(cls, node: ast.stmt | ast.expr) -> SourceSpan:
+        return cls(node.lineno, node.col_offset, node.end_lineno, node.end_col_offset)
+
+
+# The same line endings as ast.get_source_segment splits on
+_LINE_ENDING = re.compile(r"\r\n?|\n")
+
+
+class SourceIndex:
+    """
+    The offsets of the start of each line of some source code, so that segments can
+    be sliced out directly. ast.get_source_segment splits the whole source into lines
+    on every call, which is slow when a file has many segments taken from it.
+    """
+
+    def __init__(self, source_code: str) -> None:
+        self.source_code = source_code
+        self._line_starts = [0]
+        self._line_starts.extend(m.end() for m in _LINE_ENDING.finditer(source_code))
+
+    def _offset(self, lineno: int, col_offset: int) -> int:
+        # Column offsets are in UTF-8 bytes, so only need converting for non-ASCII lines
+        line_start = self._line_starts[lineno - 1]
+        if lineno < len(self._line_starts):
+            line = self.source_code[line_start : self._line_starts[lineno]]
+        else:
+            line = self.source_code[line_start:]
+        if line.isascii():
+            return line_start + col_offset
+        return line_start + len(line.encode()[:col_offset].decode())
+
+    def get_segment(self, source_span: SourceSpan) -> str | None:
+        """
+        Equivalent to ast.get_source_segment for the span.
+        """
+        if source_span.end_lineno is None or source_span.end_col_offset is None:
+            return None
+        return self.source_code[
+            self._offset(source_span.lineno, source_span.col_offset) : self._offset(
+                source_span.end_lineno, source_span.end_col_offset
+            )
+        ]
+
+
+def get_source_segment(source_code: str, source_span: SourceSpan) -> str | None:
+    return SourceIndex(source_code).get_segment(source_span)
+
+
+def read_file_source_segment(file_path: Path, source_span: SourceSpan) -> str | None:
+    # decode_source honours PEP 263 coding declarations and BOMs
+    return get_source_segment(decode_source(file_path.read_bytes()), source_span)
+
+
+# With no context lines, only the hunk headers are needed to apply a diff
+_HUNK_HEADER = re.compile(r"@@ -(\d+)(?:,(\d+))? \+\d+(?:,\d+)? @@")
+
+
+def make_source_diff(from_source: str, to_source: str) -> str:
+    """
+    A unified diff, without context lines or file headers, that turns from_source into
+    to_source when passed to apply_source_diff. Lines are split on newlines alone, so
+    the source code is rebuilt exactly.
+    """
+    diff_lines = difflib.unified_diff(
+        from_source.split("\n"), to_source.split("\n"), n=0, lineterm=""
+    )
+    # Skips the ---/+++ file headers
+    return "\n".join(islice(diff_lines, 2, None))
+
+
+def apply_source_diff(from_source: str, source_diff: str) -> str:
+    lines = from_source.split("\n")
+    result: list[str] = []
+    position = 0
+    for diff_line in source_diff.split("\n") if source_diff else []:
+        header = _HUNK_HEADER.match(diff_line)
+        if header is not None:
+            start, count = int(header.group(1)), int(header.group(2) or 1)
+            # A hunk that removes nothing starts after its start line, not on it
+            hunk_start = start if count == 0 else start - 1
+            result.extend(lines[position:hunk_start])
+            position = hunk_start + count
+        elif diff_line.startswith("+"):
+            result.append(diff_line[1:])
+    result.extend(lines[position:])
+    return "\n".join(result)
+
+
+def decode_blob(data: bytes) -> str:
+    # Matches how pydriller decodes the files in a commit
+    return data.decode("utf-8", "ignore")
+
+
+class GitBlobReader:
+    """
+    Reads files as they were at a given commit. The last few files read are kept, as
+    several keys are usually read from the same file.
+    """
+
+    def __init__(self, repo_root: Path) -> None:
+        self._repo = git.Repo(repo_root)
+        self.read = functools.lru_cache(maxsize=16)(self._read)
+
+    def __enter__(self) -> GitBlobReader:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _read(self, commit: str, file_path: str) -> SourceIndex:
+        blob = self._repo.commit(commit).tree / file_path
+        return SourceIndex(decode_blob(blob.data_stream.read()))
+
+    def read_source_segment(
+        self, commit: str, file_path: str, source_span: SourceSpan
+    ) -> str | None:
+        return self.read(commit, file_path).get_segment(source_span)
+
+    def close(self) -> None:
+        self.read.cache_clear()
+        self._repo.close()
@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import copy
+import os
+import threading
+import time
+from itertools import chain
+from pathlib import Path
+from typing import Dict, Tuple
+
+from pytraceability.cache import (
+    DependencyHashes,
+    get_changed_dependencies,
+    hash_dependencies,
+)
+from pytraceability.collector import PyTraceabilityCollector
+from pytraceability.config import PyTraceabilityConfig
+from pytraceability.data_definition import ReportRecord
+from pytraceability.exceptions import InvalidTraceabilityError
+from pytraceability.logging import get_display_logger
+
+_log = get_display_logger(__name__)
+
+FileStates = Dict[Path, Tuple[int, int]]
+
+
+class ReportWatcher(PyTraceabilityCollector):
+    """
+    Keeps the reports for every file in memory and rewrites the output file whenever
+    a change to the source files changes the result.
+
+    Changes are found by polling the mtime and size of the python files, so that
+    no platform specific file system notification library is needed.
+    """
+
+    def __init__(
+        self,
+        config: PyTraceabilityConfig,
+        output_file: Path,
+        debounce_seconds: float = 0.5,
+        poll_interval_seconds: float = 1.0,
+    ) -> None:
+        super().__init__(config)
+        self.output_file = output_file
+        self.debounce_seconds = debounce_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self._file_states: FileStates = {}
+        self._reports_by_file: dict[Path, list[ReportRecord]] = {}
+        self._dependency_hashes: DependencyHashes = {}
+        self._last_output: str | None = None
+
+    def _use_import_pool(self) -> bool:
+        # Importing in this process would reuse the modules left in sys.modules by
+        # earlier updates, so changes to the modules they import wouldn't be seen
+        return True
+
+    def _get_file_states(self) -> FileStates:
+        file_states = {}
+        for file_path in self._get_file_paths():
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                # Deleted between being listed and being looked at
+                continue
+            file_states[file_path] = (stat.st_mtime_ns, stat.st_size)
+        return file_states
+
+    def _extract_changed_files(
+        self, file_paths: list[Path]
+    ) -> list[tuple[Path, list[ReportRecord]]]:
+        """
+        The reports from each file, keeping the previous reports for any invalid
+        files. All the files are extracted before any of the reports are used.
+        """
+        extracted: list[tuple[Path, list[ReportRecord]]] = []
+        while len(extracted) < len(file_paths):
+            remaining_file_paths = file_paths[len(extracted) :]
+            try:
+                for file_path, reports in zip(
+                    remaining_file_paths,
+                    self._extract_reports_from_files(remaining_file_paths),
+                ):
+                    extracted.append((file_path, reports))
+            except InvalidTraceabilityError as e:
+                # The reports come back in order and stop at the first invalid file,
+                # so carry on from the file after it
+                file_path = file_paths[len(extracted)]
+                _log.error("Keeping previous reports for %s: %s", file_path, e)
+                extracted.append((file_path, self._reports_by_file.get(file_path, [])))
+        return extracted
+
+    def _wait_for_changes_to_settle(self, file_states: FileStates) -> FileStates:
+        while True:
+            time.sleep(self.debounce_seconds)
+            settled_file_states = self._get_file_states()
+            if settled_file_states == file_states:
+                return file_states
+            file_states = settled_file_states
+
+    def build(self) -> bool:
+        """
+        Extract the reports from every file and write the output file. Returns whether
+        the output file was written.
+        """
+        self._file_states = self._get_file_states()
+        self._reports_by_file = dict(
+            self._extract_changed_files(list(self._file_states))
+        )
+        self._update_dependency_hashes()
+        return self._write_output()
+
+    def _update_dependency_hashes(self) -> None:
+        self._dependency_hashes = hash_dependencies(
+            chain.from_iterable(self._reports_by_file.values())
+        )
+
+    def _files_with_changed_dependencies(self) -> set[Path]:
+        # Dependencies may be outside base_directory, so aren't in the file states
+        changed_dependencies = get_changed_dependencies(self._dependency_hashes)
+        return {
+            file_path
+            for file_path, reports in self._reports_by_file.items()
+            if any(changed_dependencies.intersection(r.dependencies) for r in reports)
+        }
+
+    def update(self) -> bool:
+        """
+        Re-extract the files which have changed since the last update, once they stop
+        changing. Returns whether the output file was rewritten.
+        """
+        file_states = self._get_file_states()
+        if (
+            file_states == self._file_states
+            and not self._files_with_changed_dependencies()
+        ):
+            return False
+        file_states = self._wait_for_changes_to_settle(file_states)
+
+        files_with_changed_dependencies = self._files_with_changed_dependencies()
+        changed_file_paths = [
+            file_path
+            for file_path, state in file_states.items()
+            if self._file_states.get(file_path) != state
+            or file_path in files_with_changed_dependencies
+        ]
+        _log.info("Re-extracting %s changed files", len(changed_file_paths))
+        reports_by_file = {
+            **self._reports_by_file,
+            **dict(self._extract_changed_files(changed_file_paths)),
+        }
+        # Keep the files in the order they are listed, so that the output is the
+        # same as a fresh run would give
+        self._reports_by_file = {
+            file_path: reports_by_file[file_path] for file_path in file_states
+        }
+        self._file_states = file_states
+        self._update_dependency_hashes()
+        return self._write_output()
+
+    def _write_output(self) -> bool:
+        try:
+            # Module import fills in the reports it's given, so give it copies for
+            # the kept reports to be imported again on the next update
+            reports = self.complete_reports(
+                [copy.copy(report) for report in reports_for_file]
+                for reports_for_file in self._reports_by_file.values()
+            )
+        except InvalidTraceabilityError as e:
+            _log.error("Not updating %s: %s", self.output_file, e)
+            return False
+        output = "".join(f"{line}\n" for line in self.format_output(reports))
+        if output == self._last_output:
+            return False
+
+        # Write to a temporary file first, so that anything watching the output
+        # never sees it half written
+        temporary_file = self.output_file.with_name(f".{self.output_file.name}.tmp")
+        temporary_file.write_text(output)
+        os.replace(temporary_file, self.output_file)
+        self._last_output = output
+        _log.display(f"Wrote {len(reports)} reports to {self.output_file}")
+        return True
+
+    def run(self, stop_event: threading.Event | None = None) -> None:
+        stop_event = stop_event or threading.Event()
+        self.build()
+        _log.display(f"Watching {self.config.base_directory} for changes")
+        while not stop_event.wait(self.poll_interval_seconds):
+            self.update()
@@ -1,13 +1,78 @@
+from __future__ import annotations
+
 from pathlib import Path
 from textwrap import dedent
+from typing import Callable, Iterator, Mapping, Optional
 
 import pytest
 from git import Repo
 
+from pytraceability.ast_processing import TraceabilityVisitor
+
+
+@pytest.fixture(autouse=True)
+def working_directory(
+    tmp_path_factory: pytest.TempPathFactory, monkeypatch: pytest.MonkeyPatch
+) -> Path:
+    """
+    Run each test from its own directory, so that the default cache directory, which
+    is relative, isn't written into the checkout or shared between tests.
+    """
+    working_directory = tmp_path_factory.mktemp("cwd")
+    monkeypatch.chdir(working_directory)
+    return working_directory
+
+
+@pytest.fixture
+def git_repo(tmp_path: Path) -> Iterator[Repo]:
+    repo = Repo.init(tmp_path, initial_branch="main")
+    yield repo
+    repo.close()
+
+
+CommitFiles = Callable[[str, Mapping[str, Optional[str]]], None]
+
 
 @pytest.fixture
-def git_repo(tmp_path: Path) -> Repo:
-    return Repo.init(tmp_path, initial_branch="main")
+def commit_files(git_repo: Repo, tmp_path: Path) -> CommitFiles:
+    """
+    Commit files to git_repo, given by their path relative to tmp_path, with None
+    for a file to delete.
+    """
+
+    def commit(message: str, files: Mapping[str, str | None]) -> None:
+        for file_name, contents in files.items():
+            if contents is None:
+                git_repo.index.remove([file_name], working_tree=True)
+            else:
+                (tmp_path / file_name).parent.mkdir(parents=True, exist_ok=True)
+                (tmp_path / file_name).write_text(contents)
+                git_repo.index.add([file_name])
+        git_repo.index.commit(message)
+
+    return commit
+
+
+def decorated_function(
+    body: str = "pass", key: str = "KEY-1", name: str = "foo"
+) -> str:
+    return f"@traceability('{key}')\ndef {name}():\n    {body}\n"
+
+
+@pytest.fixture
+def parsed_files(monkeypatch: pytest.MonkeyPatch) -> list[Path]:
+    """
+    The files parsed by the history walk, in the order it parses them.
+    """
+    parsed_files = []
+
+    class CountingVisitor(TraceabilityVisitor):
+        def extract_records(self, node):
+            parsed_files.append(self.file_path)
+            return super().extract_records(node)
+
+    monkeypatch.setattr("pytraceability.history.TraceabilityVisitor", CountingVisitor)
+    return parsed_files
 
 
 @pytest.fixture()
@@ -0,0 +1,7 @@
+from pytraceability.common import traceability
+
+
+def bar(key):
+    @traceability(key)
+    def foo():
+        pass
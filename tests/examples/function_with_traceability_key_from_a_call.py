@@ -0,0 +1,10 @@
+from pytraceability.common import traceability
+
+
+def _make_key():
+    return "A key"
+
+
+@traceability(_make_key())
+def foo():
+    pass
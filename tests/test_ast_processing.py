@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import ast
+from collections import Counter
 from datetime import date
 from decimal import Decimal
 from pathlib import Path
@@ -8,7 +9,13 @@ from textwrap import dedent
 
 import pytest
 
-from pytraceability.ast_processing import TraceabilityVisitor, RawCode
+from pytraceability.ast_processing import (
+    RawCode,
+    SourceScanResult,
+    TraceabilityVisitor,
+    extract_traceability_from_file_using_ast,
+    scan_source_for_decorator,
+)
 from pytraceability.common import STANDARD_DECORATOR_NAME
 from pytraceability.data_definition import (
     TraceabilityReport,
@@ -98,6 +105,26 @@ def test_statically_extract_traceability_decorators(
     assert decorators[0].contains_raw_source_code == contains_raw_source_code
 
 
+def test_records_convert_to_the_same_reports_as_validation():
+    source_code = dedent("""\
+    @traceability("A key", info="some info", raw=some_function(), when=date(2025, 1, 1))
+    def foo():
+        pass
+    """)
+    tree = ast.parse(source_code)
+    (record,) = TraceabilityVisitor(
+        STANDARD_DECORATOR_NAME, _FILE_PATH, source_code
+    ).extract_records(tree)
+    report = record.to_report()
+    validated_report = TraceabilityReport(
+        **{field: getattr(report, field) for field in TraceabilityReport.model_fields}
+    )
+
+    assert record.contains_raw_source_code
+    assert report == validated_report
+    assert report.model_dump_json() == validated_report.model_dump_json()
+
+
 def test_can_statically_extract_stacked_traceability_decorators():
     source_code = dedent("""\
     @traceability("KEY 1")
@@ -146,6 +173,43 @@ def test_key_can_be_a_kwarg():
     ]
 
 
+def test_decorators_nested_in_compound_statements_are_found():
+    source_code = dedent("""\
+    try:
+        @traceability("KEY 1")
+        def foo():
+            pass
+    except ImportError:
+        @traceability("KEY 2")
+        def foo():
+            pass
+    else:
+        pass
+    finally:
+        class Bar:
+            if True:
+                @traceability("KEY 3")
+                def foo(self):
+                    return [lambda: x for x in range(3)]
+    match value:
+        case 1:
+            with context():
+                @traceability("KEY 4")
+                def baz():
+                    pass
+    """)
+    tree = ast.parse(source_code)
+    decorators = TraceabilityVisitor(
+        STANDARD_DECORATOR_NAME, _FILE_PATH, source_code, keep_source_code=False
+    ).visit(tree)
+    assert [(d.key, d.function_name) for d in decorators] == [
+        ("KEY 1", "foo"),
+        ("KEY 2", "foo"),
+        ("KEY 3", "Bar.foo"),
+        ("KEY 4", "baz"),
+    ]
+
+
 @pytest.mark.parametrize(
     "decorator_definition",
     [
@@ -188,3 +252,55 @@ def test_other_decorators_are_ignored(decorator):
         )
         == []
     )
+
+
+@pytest.mark.parametrize(
+    "source,expected",
+    [
+        (b"def foo():\n    pass\n", SourceScanResult.NO_DECORATOR_NAME),
+        (
+            b"@traceability('KEY')\ndef foo():\n    pass\n",
+            SourceScanResult.DECORATOR_FOUND,
+        ),
+        (
+            b"@ (traceability)('KEY')\ndef foo(): pass\n",
+            SourceScanResult.DECORATOR_FOUND,
+        ),
+        (
+            b"from x import traceability as t\n@t('KEY')\ndef foo(): pass\n",
+            SourceScanResult.INDIRECT_REFERENCE,
+        ),
+    ],
+)
+def test_scan_source_for_decorator(source: bytes, expected: SourceScanResult):
+    assert scan_source_for_decorator(source, STANDARD_DECORATOR_NAME) == expected
+
+
+def test_files_without_the_decorator_name_are_not_parsed(tmp_path: Path, monkeypatch):
+    file_path = tmp_path / "file.py"
+    file_path.write_text("def foo(:\n")
+    monkeypatch.setattr(ast, "parse", None)
+    scan_statistics: Counter[str] = Counter()
+    assert (
+        extract_traceability_from_file_using_ast(
+            file_path, STANDARD_DECORATOR_NAME, scan_statistics
+        )
+        == []
+    )
+    assert scan_statistics == {SourceScanResult.NO_DECORATOR_NAME.value: 1}
+
+
+def test_source_encoding_declaration_is_honoured(tmp_path: Path):
+    file_path = tmp_path / "file.py"
+    file_path.write_bytes(
+        dedent("""\
+        # -*- coding: latin-1 -*-
+        @traceability("KEY", info="caf\xe9")
+        def foo():
+            pass
+        """).encode("latin-1")
+    )
+    [report] = extract_traceability_from_file_using_ast(
+        file_path, STANDARD_DECORATOR_NAME
+    )
+    assert report.metadata == {"info": "caf\xe9"}
@@ -0,0 +1,267 @@
+from __future__ import annotations
+
+import os
+import pickle
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from pytraceability.cache import (
+    ExtractionCache,
+    FileState,
+    HistoryBlobCache,
+    ModuleImportCache,
+    _extraction_payload,
+    read_file_with_state,
+)
+from pytraceability.data_definition import RawCode, ReportRecord, Traceability
+from pytraceability.import_processing import LocalImportFinder
+
+
+def _report(
+    file_path: Path, key: str = "KEY-1", metadata: dict | None = None
+) -> ReportRecord:
+    return ReportRecord(
+        key=key,
+        metadata=metadata or {},
+        file_path=file_path,
+        function_name="foo",
+        line_number=2,
+        end_line_number=3,
+        source_code="def foo():\n    pass",
+    )
+
+
+def _file_state(file_path: Path) -> FileState:
+    return read_file_with_state(file_path)[1]
+
+
+@pytest.fixture
+def source_file(tmp_path: Path) -> Path:
+    source_file = tmp_path / "file1.py"
+    source_file.write_text("# contents")
+    return source_file
+
+
+def test_cache_round_trip(tmp_path: Path, source_file: Path):
+    reports = [_report(source_file)]
+    with ExtractionCache(tmp_path / "cache", "traceability", 1024**2) as cache:
+        assert cache.get(source_file) is None
+        cache.put(source_file, reports, _file_state(source_file))
+    with ExtractionCache(tmp_path / "cache", "traceability", 1024**2) as cache:
+        assert cache.get(source_file) == reports
+
+
+def test_touched_file_with_the_same_content_is_a_hit(tmp_path: Path, source_file: Path):
+    with ExtractionCache(tmp_path / "cache", "traceability", 1024**2) as cache:
+        cache.put(source_file, [_report(source_file)], _file_state(source_file))
+        os.utime(source_file, ns=(0, 0))
+        assert cache.get(source_file) == [_report(source_file)]
+
+
+def test_changed_file_is_a_miss(tmp_path: Path, source_file: Path):
+    with ExtractionCache(tmp_path / "cache", "traceability", 1024**2) as cache:
+        cache.put(source_file, [_report(source_file)], _file_state(source_file))
+        source_file.write_text("# different contents")
+        assert cache.get(source_file) is None
+
+
+def test_file_changed_after_it_was_read_is_a_miss(tmp_path: Path, source_file: Path):
+    with ExtractionCache(tmp_path / "cache", "traceability", 1024**2) as cache:
+        file_state = _file_state(source_file)
+        source_file.write_text("# edited while it was being extracted")
+        cache.put(source_file, [_report(source_file)], file_state)
+        assert cache.get(source_file) is None
+
+
+def test_deleted_file_is_a_miss(tmp_path: Path, source_file: Path):
+    with ExtractionCache(tmp_path / "cache", "traceability", 1024**2) as cache:
+        cache.put(source_file, [_report(source_file)], _file_state(source_file))
+        source_file.unlink()
+        assert cache.get(source_file) is None
+
+
+def test_cache_round_trips_every_type_of_metadata(tmp_path: Path, source_file: Path):
+    metadata = {
+        "a": ("b", 1, 2.5, None, True),
+        "c": [{"d": {3, 4}}, frozenset({b"e"}), 1j],
+        5: RawCode(code="VALUE"),
+    }
+    with ExtractionCache(tmp_path / "cache", "traceability", 1024**2) as cache:
+        cache.put(
+            source_file,
+            [_report(source_file, metadata=metadata)],
+            _file_state(source_file),
+        )
+        (report,) = cache.get(source_file) or []
+    assert report == _report(source_file, metadata=metadata)
+    assert report.contains_raw_source_code
+    assert type(report.metadata["a"]) is tuple
+
+
+def test_metadata_that_cant_be_stored_isnt_cached(tmp_path: Path, source_file: Path):
+    reports = [_report(source_file, metadata={"a": object()})]
+    with ExtractionCache(tmp_path / "cache", "traceability", 1024**2) as cache:
+        cache.put(source_file, reports, _file_state(source_file))
+        assert cache.get(source_file) is None
+
+
+class _Planted:
+    def __init__(self, marker: Path) -> None:
+        self.marker = marker
+
+    def __reduce__(self):
+        return os.mkdir, (str(self.marker),)
+
+
+def test_cache_payloads_are_never_unpickled(tmp_path: Path, source_file: Path):
+    marker = tmp_path / "unpickled"
+    with ExtractionCache(tmp_path / "cache", "traceability", 1024**2) as cache:
+        cache.put(source_file, [_report(source_file)], _file_state(source_file))
+        cache._connection.execute(
+            "UPDATE extraction_results SET payload = ?",
+            (pickle.dumps(_Planted(marker)),),
+        )
+        with pytest.raises(ValueError):
+            cache.get(source_file)
+    assert not marker.exists()
+
+
+def test_cache_is_keyed_on_decorator_name(tmp_path: Path, source_file: Path):
+    with ExtractionCache(tmp_path / "cache", "traceability", 1024**2) as cache:
+        cache.put(source_file, [_report(source_file)], _file_state(source_file))
+    with ExtractionCache(tmp_path / "cache", "other_decorator", 1024**2) as cache:
+        assert cache.get(source_file) is None
+
+
+def test_cache_is_keyed_on_keeping_source_code(tmp_path: Path, source_file: Path):
+    with ExtractionCache(tmp_path / "cache", "traceability", 1024**2) as cache:
+        cache.put(source_file, [_report(source_file)], _file_state(source_file))
+    with ExtractionCache(
+        tmp_path / "cache", "traceability", 1024**2, keep_source_code=False
+    ) as cache:
+        assert cache.get(source_file) is None
+
+
+def test_cache_with_an_old_schema_is_rebuilt(tmp_path: Path, source_file: Path):
+    cache_directory = tmp_path / "cache"
+    cache_directory.mkdir()
+    connection = sqlite3.connect(str(cache_directory / "cache.sqlite"))
+    connection.execute("CREATE TABLE extraction_results (file_path TEXT)")
+    connection.commit()
+    connection.close()
+
+    with ExtractionCache(cache_directory, "traceability", 1024**2) as cache:
+        assert cache.get(source_file) is None
+        cache.put(source_file, [_report(source_file)], _file_state(source_file))
+        assert cache.get(source_file) == [_report(source_file)]
+
+
+def test_cache_is_invalidated_by_a_new_package_version(
+    tmp_path: Path, source_file: Path, monkeypatch
+):
+    with ExtractionCache(tmp_path / "cache", "traceability", 1024**2) as cache:
+        cache.put(source_file, [_report(source_file)], _file_state(source_file))
+    monkeypatch.setattr("pytraceability.cache.get_package_version", lambda: "new")
+    with ExtractionCache(tmp_path / "cache", "traceability", 1024**2) as cache:
+        assert cache.get(source_file) is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path: Path):
+    source_files = []
+    for idx in range(3):
+        source_file = tmp_path / f"file{idx}.py"
+        source_file.write_text(f"# file {idx}")
+        source_files.append(source_file)
+    entry_size = len(_extraction_payload([_report(source_files[0])]))
+
+    with ExtractionCache(tmp_path / "cache", "traceability", 2 * entry_size) as cache:
+        for source_file in source_files:
+            cache.put(source_file, [_report(source_file)], _file_state(source_file))
+        cache.get(source_files[0])
+
+    with ExtractionCache(tmp_path / "cache", "traceability", 1024**2) as cache:
+        assert [cache.get(f) is not None for f in source_files] == [True, False, True]
+
+
+@pytest.fixture
+def package_with_imports(tmp_path: Path) -> Path:
+    python_root = tmp_path / "src"
+    package = python_root / "package"
+    package.mkdir(parents=True)
+    (package / "__init__.py").write_text("")
+    (package / "main.py").write_text(
+        "import os\nfrom . import helpers\nfrom package.constants import VALUE\n"
+    )
+    (package / "helpers.py").write_text("from .nested import deeper\n")
+    (package / "nested").mkdir()
+    (package / "nested" / "__init__.py").write_text("")
+    (package / "nested" / "deeper.py").write_text("")
+    (package / "constants.py").write_text("VALUE = 1\n")
+    (package / "unused.py").write_text("")
+    return python_root
+
+
+def test_import_closure_includes_local_imports_only(package_with_imports: Path):
+    package = package_with_imports / "package"
+    closure = LocalImportFinder(package_with_imports).find_import_closure(
+        package / "main.py"
+    )
+    assert closure == sorted(
+        path.resolve()
+        for path in [
+            package / "__init__.py",
+            package / "main.py",
+            package / "helpers.py",
+            package / "constants.py",
+            package / "nested" / "__init__.py",
+            package / "nested" / "deeper.py",
+        ]
+    )
+
+
+def test_module_import_cache_key_changes_with_a_local_import(
+    tmp_path: Path, package_with_imports: Path
+):
+    package = package_with_imports / "package"
+    main = package / "main.py"
+
+    def cache_key() -> str:
+        with ModuleImportCache(
+            tmp_path / "cache", package_with_imports, 1024**2
+        ) as cache:
+            return cache.get_cache_key(main, ["foo"])
+
+    original_key = cache_key()
+    (package / "unused.py").write_text("CHANGED = True\n")
+    assert cache_key() == original_key
+    (package / "nested" / "deeper.py").write_text("CHANGED = True\n")
+    assert cache_key() != original_key
+
+
+def test_module_import_cache_round_trip(tmp_path: Path, package_with_imports: Path):
+    traceabilities = [
+        Traceability(key="KEY-1", metadata={"a": ("b", RawCode(code="c"))})
+    ]
+    with ModuleImportCache(tmp_path / "cache", package_with_imports, 1024**2) as cache:
+        assert cache.get("key") is None
+        cache.put("key", traceabilities)
+    with ModuleImportCache(tmp_path / "cache", package_with_imports, 1024**2) as cache:
+        assert cache.get("key") == traceabilities
+        assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_history_blob_cache_is_keyed_on_the_extraction_options(
+    tmp_path: Path, source_file: Path
+):
+    reports = [_report(source_file)]
+    with HistoryBlobCache(tmp_path / "cache", "traceability", 1024**2) as cache:
+        assert cache.get("abc123") is None
+        cache.put("abc123", reports, ["code-hash"])
+    with HistoryBlobCache(tmp_path / "cache", "traceability", 1024**2) as cache:
+        assert cache.get("abc123") == (reports, ["code-hash"])
+    with HistoryBlobCache(
+        tmp_path / "cache", "traceability", 1024**2, keep_source_code=False
+    ) as cache:
+        assert cache.get("abc123") is None
@@ -1,10 +1,12 @@
+import json
 import os
+from pathlib import Path
 
 import pytest
 from click.testing import CliRunner
-
 from pytraceability.cli import main, OutputFormats
 from pytraceability.config import PyTraceabilityConfig, HistoryModeConfig
+from tests.conftest import CommitFiles, decorated_function
 
 common_output = [
     "Extracting traceability from {base_dir}",
@@ -78,3 +80,31 @@ def test_all_config_options_can_be_set_with_cli():
         HistoryModeConfig.model_fields
     )
     assert config_fields <= cli_args
+
+
+def test_key_history(tmp_path: Path, commit_files: CommitFiles, pyproject_file: Path):
+    for body in ["pass", "return 1"]:
+        commit_files(f"foo {body}", {"file1.py": decorated_function(body)})
+    runner = CliRunner()
+
+    result = runner.invoke(
+        main,
+        [
+            f"--base-directory={tmp_path}",
+            "--output-format=json",
+            "key-history",
+            "KEY-1",
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    summary = json.loads(result.output[result.output.index("{") :])
+    (report,) = summary["reports"]
+    assert [h["message"] for h in report["history"]] == ["foo return 1", "foo pass"]
+
+    result = runner.invoke(
+        main, [f"--base-directory={tmp_path}", "key-history", "KEY-1", "KEY-2"]
+    )
+
+    assert result.exit_code == 2
+    assert "Keys not found: KEY-2" in result.output
@@ -1,13 +1,21 @@
 from __future__ import annotations
 
+import json
 import logging
 from operator import attrgetter
 from pathlib import Path
+from textwrap import dedent
 
 import pytest
 from git import Repo
 
+from pytraceability.ast_processing import (
+    extract_records_from_file,
+    extract_traceability_from_file_using_ast,
+)
 from pytraceability.config import (
+    FileSource,
+    OutputFormats,
     PyTraceabilityMode,
     PyTraceabilityConfig,
 )
@@ -16,9 +24,12 @@ from pytraceability.data_definition import (
     RawCode,
     MetaDataType,
     TraceabilityGitHistory,
+    TraceabilityStreamSummary,
 )
 from pytraceability.collector import PyTraceabilityCollector
 from pytraceability.exceptions import InvalidTraceabilityError
+from pytraceability.import_processing import extract_traceabilities_using_module_import
+from pytraceability.incremental import IncrementalScan
 from tests.conftest import write_traceability_file
 from tests.examples import (
     function_with_traceability,
@@ -80,15 +91,29 @@ def test_successful_extraction(
 
 
 @pytest.mark.parametrize(
-    "file_name",
+    "file_name,function_name,line_num_offset",
     [
-        "function_with_traceability_key_in_a_variable.py",
-        "method_on_a_class_with_key_in_a_variable.py",
+        ("function_with_traceability_key_in_a_variable.py", "foo", 2),
+        ("method_on_a_class_with_key_in_a_variable.py", "Foo.bar", 3),
+        ("closure_with_key_in_a_variable.py", "bar.foo", 3),
     ],
 )
-def test_key_must_be_static(file_name: str, tmp_path: Path):
+def test_key_in_a_constant_is_resolved_statically(
+    file_name: str, function_name: str, line_num_offset: int, tmp_path: Path
+) -> None:
+    _test_from_file(
+        EXAMPLES_DIR / file_name,
+        tmp_path,
+        function_name=function_name,
+        line_num_offset=line_num_offset,
+    )
+
+
+def test_key_must_be_static(tmp_path: Path):
     with pytest.raises(InvalidTraceabilityError):
-        _test_from_file(EXAMPLES_DIR / file_name, tmp_path)
+        _test_from_file(
+            EXAMPLES_DIR / "function_with_traceability_key_from_a_call.py", tmp_path
+        )
 
 
 def test_static_mode_errors_if_unable_to_get_traceability_data_statically(
@@ -96,13 +121,13 @@ def test_static_mode_errors_if_unable_to_get_traceability_data_statically(
 ) -> None:
     with pytest.raises(InvalidTraceabilityError):
         _test_from_file(
-            EXAMPLES_DIR / "function_with_traceability_key_in_a_variable.py", tmp_path
+            EXAMPLES_DIR / "function_with_traceability_key_from_a_call.py", tmp_path
         )
 
 
 def test_closure_with_dynamic_key(tmp_path):
     with pytest.raises(InvalidTraceabilityError):
-        _test_from_file(EXAMPLES_DIR / "closure_with_key_in_a_variable.py", tmp_path)
+        _test_from_file(EXAMPLES_DIR / "closure_with_key_from_an_argument.py", tmp_path)
 
 
 def test_with_metadata(tmp_path):
@@ -123,9 +148,8 @@ def test_closure_with_dynamic_metadata(tmp_path):
         EXAMPLES_DIR / "closure_with_metadata_in_a_variable.py",
         tmp_path,
         function_name="foo.bar",
-        metadata={"a": RawCode(code="METADATA")},
+        metadata={"a": "METADATA-STRING"},
         line_num_offset=6,
-        contains_raw_source_code=True,
     )
 
 
@@ -182,9 +206,403 @@ def test_filename_exclusion():
 def test_invalid_python_file(tmp_path: Path, caplog: pytest.LogCaptureFixture) -> None:
     caplog.set_level(logging.WARNING)
     invalid_file = tmp_path / "invalid_file.py"
-    invalid_file.write_text("def foo():\n    print('Hello World'")
+    invalid_file.write_text("@traceability('KEY')\ndef foo():\n    print('Hello World'")
 
     config = PyTraceabilityConfig(base_directory=tmp_path)
 
     assert list(PyTraceabilityCollector(config).collect()) == []
     assert "Ignoring file due to syntax error" in caplog.text
+
+
+def test_parallel_extraction_matches_serial_extraction(tmp_path: Path):
+    for idx in range(1, 41):
+        write_traceability_file(tmp_path / f"file{idx}.py", idx)
+    serial = PyTraceabilityCollector(PyTraceabilityConfig(base_directory=tmp_path))
+    parallel = PyTraceabilityCollector(
+        PyTraceabilityConfig(base_directory=tmp_path, jobs=2)
+    )
+    assert parallel.collect() == serial.collect()
+
+
+def test_parallel_extraction_raises_on_duplicate_keys(directory_with_duplicate_keys):
+    config = PyTraceabilityConfig(base_directory=directory_with_duplicate_keys, jobs=2)
+    with pytest.raises(InvalidTraceabilityError):
+        PyTraceabilityCollector(config).collect()
+
+
+def _write_dynamic_metadata_file(file_path: Path, idx: int, statement: str = ""):
+    file_path.write_text(
+        dedent(f"""\
+        from pytraceability.common import traceability
+        {statement}
+
+        def _value():
+            return "Value {idx}"
+
+        VALUE = _value()
+
+        @traceability("KEY-{idx}", a=VALUE)
+        def foo():
+            pass
+        """)
+    )
+
+
+def test_import_pool_matches_in_process_imports(tmp_path: Path):
+    for idx in range(1, 11):
+        _write_dynamic_metadata_file(tmp_path / f"file{idx}.py", idx)
+    config = PyTraceabilityConfig(
+        base_directory=tmp_path, mode=PyTraceabilityMode.MODULE_IMPORT, no_cache=True
+    )
+    in_process = PyTraceabilityCollector(config).collect()
+    pooled = PyTraceabilityCollector(
+        config.model_copy(update={"jobs": 2, "imports_per_worker": 3})
+    ).collect()
+    assert pooled == in_process
+    assert {report.key: report.metadata for report in pooled} == {
+        f"KEY-{idx}": {"a": f"Value {idx}"} for idx in range(1, 11)
+    }
+
+
+def test_import_pool_keeps_static_metadata_for_a_module_that_times_out(
+    tmp_path: Path, caplog: pytest.LogCaptureFixture
+):
+    _write_dynamic_metadata_file(tmp_path / "file1.py", 1)
+    _write_dynamic_metadata_file(
+        tmp_path / "file2.py", 2, statement="import time; time.sleep(60)"
+    )
+    config = PyTraceabilityConfig(
+        base_directory=tmp_path,
+        mode=PyTraceabilityMode.MODULE_IMPORT,
+        no_cache=True,
+        import_timeout=1,
+    )
+    reports = {r.key: r for r in PyTraceabilityCollector(config).collect()}
+    assert reports["KEY-1"].metadata == {"a": "Value 1"}
+    assert reports["KEY-2"].metadata == {"a": RawCode(code="VALUE")}
+    assert "Timed out after 1.0s importing" in caplog.text
+
+
+@pytest.mark.parametrize(
+    "extract", [extract_traceability_from_file_using_ast, extract_records_from_file]
+)
+def test_module_import_can_still_be_given_the_reports(tmp_path: Path, extract):
+    _write_dynamic_metadata_file(tmp_path / "file1.py", 1)
+    reports = extract(tmp_path / "file1.py", "traceability")
+    from_reports = extract_traceabilities_using_module_import(
+        tmp_path / "file1.py", tmp_path, iter(reports)
+    )
+    assert [(t.key, t.metadata) for t in from_reports] == [("KEY-1", {"a": "Value 1"})]
+
+
+def test_warm_run_does_not_import_unchanged_modules(tmp_path: Path, monkeypatch):
+    base_directory = tmp_path / "src"
+    base_directory.mkdir()
+    for idx in range(1, 3):
+        _write_dynamic_metadata_file(base_directory / f"file{idx}.py", idx)
+    config = PyTraceabilityConfig(
+        base_directory=base_directory,
+        mode=PyTraceabilityMode.MODULE_IMPORT,
+        cache_directory=tmp_path / "cache",
+    )
+    cold = PyTraceabilityCollector(config).collect()
+
+    imported_files = []
+
+    def import_module(file_path, python_root, function_names):
+        imported_files.append(file_path)
+        return extract_traceabilities_using_module_import(
+            file_path, python_root, function_names
+        )
+
+    monkeypatch.setattr(
+        "pytraceability.collector.extract_traceabilities_using_module_import",
+        import_module,
+    )
+    assert PyTraceabilityCollector(config).collect() == cold
+    assert imported_files == []
+
+    _write_dynamic_metadata_file(base_directory / "file2.py", 3)
+    warm = {r.key: r.metadata for r in PyTraceabilityCollector(config).collect()}
+    assert warm == {"KEY-1": {"a": "Value 1"}, "KEY-3": {"a": "Value 3"}}
+    assert imported_files == [base_directory / "file2.py"]
+
+
+def test_warm_run_only_extracts_changed_files(tmp_path: Path, monkeypatch):
+    base_directory = tmp_path / "src"
+    base_directory.mkdir()
+    for idx in range(1, 4):
+        write_traceability_file(base_directory / f"file{idx}.py", idx)
+    config = PyTraceabilityConfig(
+        base_directory=base_directory, cache_directory=tmp_path / "cache"
+    )
+    cold = PyTraceabilityCollector(config).collect()
+
+    extracted_files = []
+
+    def extract(file_path, decorator_name, **kwargs):
+        extracted_files.append(file_path)
+        return extract_records_from_file(file_path, decorator_name, **kwargs)
+
+    monkeypatch.setattr("pytraceability.collector.extract_records_from_file", extract)
+    assert PyTraceabilityCollector(config).collect() == cold
+    assert extracted_files == []
+
+    write_traceability_file(base_directory / "file2.py", 4)
+    warm = PyTraceabilityCollector(config).collect()
+    assert extracted_files == [base_directory / "file2.py"]
+    assert sorted(r.key for r in warm) == ["KEY-1", "KEY-3", "KEY-4"]
+
+    no_cache_config = config.model_copy(update={"no_cache": True})
+    PyTraceabilityCollector(no_cache_config).collect()
+    assert len(extracted_files) == 4
+
+
+def test_git_file_source_honours_gitignore(
+    directory_with_two_files: Path, git_repo: Repo
+):
+    (directory_with_two_files / ".gitignore").write_text("ignored.py\n")
+    write_traceability_file(directory_with_two_files / "ignored.py", 3)
+    write_traceability_file(directory_with_two_files / "untracked.py", 4)
+    write_traceability_file(directory_with_two_files / "excluded.py", 5)
+    git_repo.index.add([str(directory_with_two_files / "excluded.py")])
+
+    def collected_keys(**kwargs) -> list[str]:
+        config = PyTraceabilityConfig(
+            base_directory=directory_with_two_files,
+            file_source=FileSource.GIT,
+            exclude_patterns=["*excluded*"],
+            **kwargs,
+        )
+        return sorted(r.key for r in PyTraceabilityCollector(config).collect())
+
+    assert collected_keys() == ["KEY-1", "KEY-2"]
+    assert collected_keys(include_untracked=True) == ["KEY-1", "KEY-2", "KEY-4"]
+
+
+def test_git_file_source_from_a_subdirectory(tmp_path: Path, git_repo: Repo):
+    (tmp_path / "sub").mkdir()
+    write_traceability_file(tmp_path / "file1.py", 1)
+    write_traceability_file(tmp_path / "sub" / "file2.py", 2)
+    git_repo.index.add(["file1.py", "sub/file2.py"])
+    config = PyTraceabilityConfig(
+        base_directory=tmp_path / "sub", file_source=FileSource.GIT
+    )
+    [report] = PyTraceabilityCollector(config).collect()
+    assert report.file_path == tmp_path / "sub" / "file2.py"
+
+
+@pytest.fixture
+def incremental_config(directory_with_two_files: Path, tmp_path_factory):
+    return PyTraceabilityConfig(
+        base_directory=directory_with_two_files,
+        cache_directory=tmp_path_factory.mktemp("cache"),
+        incremental=True,
+        no_cache=True,
+    )
+
+
+def _record_extracted_files(monkeypatch) -> list[Path]:
+    extracted_files = []
+
+    def extract(file_path, decorator_name, **kwargs):
+        extracted_files.append(file_path)
+        return extract_records_from_file(file_path, decorator_name, **kwargs)
+
+    monkeypatch.setattr("pytraceability.collector.extract_records_from_file", extract)
+    return extracted_files
+
+
+def _collected_keys(config: PyTraceabilityConfig) -> list[str]:
+    return sorted(r.key for r in PyTraceabilityCollector(config).collect())
+
+
+def test_incremental_scan_only_extracts_changed_files(
+    incremental_config: PyTraceabilityConfig, git_repo: Repo, monkeypatch
+):
+    base_directory = incremental_config.base_directory
+    assert _collected_keys(incremental_config) == ["KEY-1", "KEY-2"]
+
+    extracted_files = _record_extracted_files(monkeypatch)
+    write_traceability_file(base_directory / "file3.py", 3)
+    git_repo.index.add([str(base_directory / "file3.py")])
+    git_repo.index.commit("add file3")
+    git_repo.index.move(["file2.py", "file4.py"])
+    write_traceability_file(base_directory / "file5.py", 5)
+
+    assert _collected_keys(incremental_config) == ["KEY-1", "KEY-2", "KEY-3", "KEY-5"]
+    assert sorted(extracted_files) == [
+        base_directory / f for f in ("file3.py", "file4.py", "file5.py")
+    ]
+
+
+def test_incremental_scan_rescans_files_that_were_dirty_in_the_baseline(
+    incremental_config: PyTraceabilityConfig, monkeypatch
+):
+    base_directory = incremental_config.base_directory
+    write_traceability_file(base_directory / "file1.py", 3)
+    assert _collected_keys(incremental_config) == ["KEY-2", "KEY-3"]
+
+    write_traceability_file(base_directory / "file1.py", 1)
+    assert _collected_keys(incremental_config) == ["KEY-1", "KEY-2"]
+
+
+def test_incremental_scan_sees_changes_to_ignored_files(
+    incremental_config: PyTraceabilityConfig,
+):
+    base_directory = incremental_config.base_directory
+    (base_directory / ".gitignore").write_text("file3.py\n")
+    write_traceability_file(base_directory / "file3.py", 3)
+    assert _collected_keys(incremental_config) == ["KEY-1", "KEY-2", "KEY-3"]
+
+    write_traceability_file(base_directory / "file3.py", 4)
+    assert _collected_keys(incremental_config) == ["KEY-1", "KEY-2", "KEY-4"]
+
+
+def test_incremental_scan_baseline_is_not_changed_by_module_import(
+    incremental_config: PyTraceabilityConfig,
+):
+    _write_dynamic_metadata_file(incremental_config.base_directory / "file3.py", 3)
+    import_config = incremental_config.model_copy(
+        update={"mode": PyTraceabilityMode.MODULE_IMPORT}
+    )
+
+    def collect_metadata(config: PyTraceabilityConfig) -> MetaDataType:
+        reports = PyTraceabilityCollector(config).collect()
+        return {report.key: report.metadata for report in reports}["KEY-3"]
+
+    assert collect_metadata(import_config) == {"a": "Value 3"}
+    baseline = IncrementalScan(import_config).load_baseline()
+    assert baseline is not None
+    (baseline_report,) = [r for r in baseline.reports if r.key == "KEY-3"]
+    assert baseline_report.metadata == {"a": RawCode(code="VALUE")}
+    assert collect_metadata(incremental_config) == {"a": RawCode(code="VALUE")}
+    assert collect_metadata(import_config) == {"a": "Value 3"}
+
+
+def test_incremental_scan_baseline_is_stored_as_json(
+    incremental_config: PyTraceabilityConfig,
+):
+    _collected_keys(incremental_config)
+    baseline_file = IncrementalScan(incremental_config).baseline_file
+    baseline_reports = json.loads(baseline_file.read_text())["reports"]
+    assert sorted(report["key"] for report in baseline_reports) == ["KEY-1", "KEY-2"]
+
+
+def test_incremental_scan_checks_key_uniqueness_across_the_merged_result(
+    incremental_config: PyTraceabilityConfig,
+):
+    _collected_keys(incremental_config)
+    write_traceability_file(incremental_config.base_directory / "file3.py", 1)
+    with pytest.raises(InvalidTraceabilityError):
+        _collected_keys(incremental_config)
+
+
+def test_incremental_scan_falls_back_to_a_full_scan_for_an_unknown_commit(
+    incremental_config: PyTraceabilityConfig,
+    git_repo: Repo,
+    monkeypatch,
+    caplog: pytest.LogCaptureFixture,
+):
+    _collected_keys(incremental_config)
+    git_repo.index.commit("amended", parent_commits=[], head=True)
+    git_repo.git.gc("--prune=now", "--quiet")
+    git_repo.git.reflog("expire", "--expire=now", "--all")
+    git_repo.git.gc("--prune=now", "--quiet")
+    extracted_files = _record_extracted_files(monkeypatch)
+    assert _collected_keys(incremental_config) == ["KEY-1", "KEY-2"]
+    assert len(extracted_files) == 2
+    assert "running a full scan" in caplog.text
+
+
+def test_jsonl_output_writes_each_report_once_its_file_is_processed(
+    directory_with_two_files: Path, monkeypatch
+):
+    extracted_files = _record_extracted_files(monkeypatch)
+    config = PyTraceabilityConfig(
+        base_directory=directory_with_two_files,
+        output_format=OutputFormats.JSONL,
+        no_sort=True,
+        no_cache=True,
+    )
+    output = PyTraceabilityCollector(config).get_printable_output()
+
+    first_line = next(output)
+    assert extracted_files == [directory_with_two_files / "file1.py"]
+    lines = [first_line, *output]
+
+    reports = [TraceabilityReport.model_validate_json(line) for line in lines[:-1]]
+    assert [r.key for r in reports] == ["KEY-1", "KEY-2"]
+    assert TraceabilityStreamSummary.model_validate_json(
+        lines[-1]
+    ) == TraceabilityStreamSummary(report_count=2)
+
+
+def test_jsonl_output_ends_with_an_error_record(directory_with_duplicate_keys: Path):
+    config = PyTraceabilityConfig(
+        base_directory=directory_with_duplicate_keys,
+        output_format=OutputFormats.JSONL,
+        no_sort=True,
+        no_cache=True,
+    )
+    lines = []
+    with pytest.raises(InvalidTraceabilityError):
+        for line in PyTraceabilityCollector(config).get_printable_output():
+            lines.append(line)
+
+    assert len(lines) == 2
+    summary = TraceabilityStreamSummary.model_validate_json(lines[-1])
+    assert summary.report_count == 1
+    assert "KEY-1 is duplicated" in (summary.error or "")
+
+
+def test_jsonl_output_ends_with_an_error_record_for_any_error(
+    directory_with_two_files: Path, monkeypatch
+):
+    def extract(file_path, decorator_name, **kwargs):
+        if file_path.name == "file2.py":
+            raise PermissionError(f"Can't read {file_path.name}")
+        return extract_records_from_file(file_path, decorator_name, **kwargs)
+
+    monkeypatch.setattr("pytraceability.collector.extract_records_from_file", extract)
+    config = PyTraceabilityConfig(
+        base_directory=directory_with_two_files,
+        output_format=OutputFormats.JSONL,
+        no_sort=True,
+        no_cache=True,
+    )
+    lines = []
+    with pytest.raises(PermissionError):
+        for line in PyTraceabilityCollector(config).get_printable_output():
+            lines.append(line)
+
+    summary = TraceabilityStreamSummary.model_validate_json(lines[-1])
+    assert summary == TraceabilityStreamSummary(
+        report_count=1, error="PermissionError: Can't read file2.py"
+    )
+
+
+@pytest.mark.parametrize("output_format", [OutputFormats.JSON, OutputFormats.HTML])
+def test_lazy_source_code_gives_the_same_output(
+    tmp_path: Path, output_format: OutputFormats
+):
+    (tmp_path / "file1.py").write_text(
+        dedent("""\
+        # -*- coding: utf-8 -*-
+        class Foo:
+            @traceability("KEY-1")
+            def föö(self):
+                return "ünïcode"  # trailing comment
+        """)
+    )
+    config = PyTraceabilityConfig(
+        base_directory=tmp_path, output_format=output_format, no_cache=True
+    )
+    lazy_config = config.model_copy(update={"lazy_source_code": True})
+
+    assert [r.source_code for r in PyTraceabilityCollector(lazy_config).collect()] == [
+        None
+    ]
+    assert list(PyTraceabilityCollector(lazy_config).get_printable_output()) == list(
+        PyTraceabilityCollector(config).get_printable_output()
+    )
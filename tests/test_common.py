@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import fnmatch
+import os
+from pathlib import Path
+
+import pytest
+
+from pytraceability.common import ExcludePatternMatcher, iter_python_files
+
+EXCLUDE_PATTERNS = ["*/.venv/*", "*test*", "*/build/*.py", "*/generated/"]
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "/repo/.venv/lib/site.py",
+        "/repo/tests/test_foo.py",
+        "/repo/build/foo.py",
+        "/repo/build/foo.txt",
+        "/repo/generated/foo.py",
+        "/repo/src/foo.py",
+    ],
+)
+def test_matcher_agrees_with_fnmatch(path: str):
+    assert ExcludePatternMatcher(EXCLUDE_PATTERNS).file_is_excluded(path) == any(
+        fnmatch.fnmatch(path, pattern) for pattern in EXCLUDE_PATTERNS
+    )
+
+
+@pytest.mark.parametrize(
+    "directory,excluded",
+    [
+        ("/repo/.venv", True),
+        ("/repo/tests", True),
+        ("/repo/build", False),
+        ("/repo/generated", False),
+        ("/repo/src", False),
+    ],
+)
+def test_only_directories_where_every_file_is_excluded_are_pruned(
+    directory: str, excluded: bool
+):
+    assert (
+        ExcludePatternMatcher(EXCLUDE_PATTERNS).directory_is_excluded(directory)
+        == excluded
+    )
+
+
+def test_no_patterns_excludes_nothing():
+    matcher = ExcludePatternMatcher([])
+    assert not matcher.file_is_excluded("/repo/foo.py")
+    assert not matcher.directory_is_excluded("/repo")
+
+
+def test_iter_python_files_does_not_descend_into_excluded_directories(
+    tmp_path: Path, monkeypatch
+):
+    for relative_path in [
+        "a.py",
+        "b.txt",
+        "pkg/c.py",
+        ".venv/lib/d.py",
+        "pkg/build/e.py",
+    ]:
+        file_path = tmp_path / relative_path
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.touch()
+
+    scanned_directories = []
+    scandir = os.scandir
+
+    def recording_scandir(path):
+        scanned_directories.append(Path(path))
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", recording_scandir)
+    assert list(iter_python_files(tmp_path, ["*/.venv/*", "*/build/*"])) == [
+        tmp_path / "a.py",
+        tmp_path / "pkg" / "c.py",
+    ]
+    assert tmp_path / ".venv" not in scanned_directories
+    assert tmp_path / "pkg" / "build" not in scanned_directories
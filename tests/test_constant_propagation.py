@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+from decimal import Decimal
+from pathlib import Path
+from textwrap import dedent
+
+import pytest
+
+from pytraceability.ast_processing import extract_records_from_file
+from pytraceability.cache import ExtractionCache, read_file_with_state
+from pytraceability.data_definition import RawCode
+
+
+def _extract(file_path: Path, source: str, python_root: Path | None = None):
+    file_path.write_text(dedent(source))
+    return {
+        record.key: record
+        for record in extract_records_from_file(
+            file_path, "traceability", python_root=python_root
+        )
+    }
+
+
+@pytest.mark.parametrize(
+    "source,expected_metadata",
+    [
+        (
+            """\
+            PREFIX = "Value"
+            VALUE = f"{PREFIX} 1"
+
+            @traceability("KEY-1", a=VALUE)
+            def foo():
+                pass
+            """,
+            {"a": "Value 1"},
+        ),
+        (
+            """\
+            class Foo:
+                VALUE = ("a", 1)
+
+                @traceability("KEY-1", a=VALUE)
+                def foo(self):
+                    pass
+            """,
+            {"a": ("a", 1)},
+        ),
+        (
+            """\
+            VALUE = "module"
+
+            def bar():
+                VALUE = "closure"
+
+                @traceability("KEY-1", a=VALUE)
+                def foo():
+                    pass
+            """,
+            {"a": "closure"},
+        ),
+        (
+            """\
+            from decimal import Decimal
+
+            VALUE = Decimal("1.5")
+
+            @traceability("KEY-1", a=VALUE)
+            def foo():
+                pass
+            """,
+            {"a": Decimal("1.5")},
+        ),
+    ],
+)
+def test_constants_are_resolved(
+    tmp_path: Path, source: str, expected_metadata: dict
+) -> None:
+    records = _extract(tmp_path / "module.py", source)
+    assert records["KEY-1"].metadata == expected_metadata
+
+
+@pytest.mark.parametrize(
+    "definition",
+    [
+        'VALUE = "first"\nVALUE = "second"',
+        'VALUE = "first"\nif True:\n    VALUE = "second"',
+        "VALUE = ['a']",
+        "VALUE = len('a')",
+        "from elsewhere import *\nVALUE = 'a'",
+    ],
+)
+def test_names_that_might_not_be_constant_are_left_as_raw_code(
+    tmp_path: Path, definition: str
+) -> None:
+    source = definition + '\n\n@traceability("KEY-1", a=VALUE)\ndef foo():\n    pass\n'
+    records = _extract(tmp_path / "module.py", source)
+    assert records["KEY-1"].metadata == {"a": RawCode(code="VALUE")}
+
+
+def test_class_constants_are_not_visible_in_methods(tmp_path: Path) -> None:
+    source = """\
+        class Foo:
+            VALUE = "class"
+
+            def bar(self):
+                @traceability("KEY-1", a=VALUE)
+                def foo():
+                    pass
+        """
+    records = _extract(tmp_path / "module.py", source)
+    assert records["KEY-1"].metadata == {"a": RawCode(code="VALUE")}
+
+
+@pytest.fixture
+def package(tmp_path: Path) -> Path:
+    package = tmp_path / "src" / "package"
+    package.mkdir(parents=True)
+    (package / "__init__.py").write_text("")
+    (package / "constants.py").write_text('KEY = "KEY-1"\nVALUE = "Value"\n')
+    return package
+
+
+_MAIN_MODULE = """\
+    from .constants import KEY
+    from package.constants import VALUE as OTHER_NAME
+
+    @traceability(KEY, a=OTHER_NAME)
+    def foo():
+        pass
+    """
+
+
+def test_constants_are_resolved_from_other_project_modules(package: Path) -> None:
+    records = _extract(package / "main.py", _MAIN_MODULE, python_root=package.parent)
+    assert records["KEY-1"].metadata == {"a": "Value"}
+    assert records["KEY-1"].dependencies == ((package / "constants.py").resolve(),)
+
+
+def test_cached_extraction_is_invalidated_by_a_changed_dependency(
+    tmp_path: Path, package: Path
+) -> None:
+    main = package / "main.py"
+    records = list(_extract(main, _MAIN_MODULE, python_root=package.parent).values())
+    with ExtractionCache(
+        tmp_path / "cache", "traceability", 1024**2, python_root=package.parent
+    ) as cache:
+        cache.put(main, records, read_file_with_state(main)[1])
+        assert cache.get(main) == records
+        (package / "constants.py").write_text('KEY = "KEY-2"\nVALUE = "Value"\n')
+        assert cache.get(main) is None
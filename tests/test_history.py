@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from concurrent.futures import Future
 from pathlib import Path
 from textwrap import dedent
 
@@ -7,9 +8,23 @@ import pytest
 from git import Repo
 from pydantic import BaseModel
 
-from pytraceability.config import PyTraceabilityConfig, HistoryModeConfig
-from pytraceability.data_definition import TraceabilityGitHistory
+from pytraceability.config import (
+    HistoryBackend,
+    HistoryMode,
+    HistoryModeConfig,
+    OutputFormats,
+    PyTraceabilityConfig,
+)
+from pytraceability.data_definition import (
+    TraceabilityGitHistory,
+    load_traceability_summary,
+)
 from pytraceability.collector import PyTraceabilityCollector
+from pytraceability import history
+from pytraceability.history import KeyFileIndex, get_line_based_history
+from pytraceability.incremental import IncrementalHistory
+from pytraceability.source import GitBlobReader, SourceSpan
+from tests.conftest import CommitFiles, decorated_function
 from tests.utils import M
 
 GIT_HISTORY_TESTS_DIR = Path(__file__).parent / "git_history_tests"
@@ -20,11 +35,11 @@ DECORATOR_FUNCTION_RENAMED = "decorator function renamed"
 DECORATOR_MOVED_TO_ANOTHER_FILE = "decorator moved to another file"
 
 
-@pytest.fixture()
-def config(tmp_path: Path) -> PyTraceabilityConfig:
+@pytest.fixture(params=list(HistoryBackend))
+def config(tmp_path: Path, request: pytest.FixtureRequest) -> PyTraceabilityConfig:
     return PyTraceabilityConfig(
         base_directory=tmp_path,
-        history_config=HistoryModeConfig(),
+        history_config=HistoryModeConfig(backend=request.param),
     )
 
 
@@ -236,6 +251,21 @@ def test_run_all_history_tests(
     run_history_test(git_repo, tmp_path, config, list(COMMIT_DETAILS.values()))
 
 
+def test_lazy_source_code_is_read_back_from_git(
+    git_repo: Repo, tmp_path: Path, config: PyTraceabilityConfig
+):
+    run_history_test(git_repo, tmp_path, config, list(COMMIT_DETAILS.values()))
+    json_config = config.model_copy(update={"output_format": OutputFormats.JSON})
+    lazy_config = json_config.model_copy(update={"lazy_source_code": True})
+
+    lazy_reports = PyTraceabilityCollector(lazy_config).collect()
+    assert {r.source_code for r in lazy_reports} == {None}
+    assert {h.source_code for r in lazy_reports for h in r.history or []} == {None}
+    assert list(PyTraceabilityCollector(lazy_config).get_printable_output()) == list(
+        PyTraceabilityCollector(json_config).get_printable_output()
+    )
+
+
 def test_independent_file_paths():
     """
     Test to ensure that file paths in COMMIT_DETAILS are unique across all test cases.
@@ -268,3 +298,564 @@ def test_independent_file_paths():
                 f"File path conflict detected: {file_path}\n"
                 f"Clashing test cases: {conflicting_test_cases}"
             )
+
+
+def test_key_file_index_tracks_where_keys_were_last_found():
+    class File(BaseModel):
+        new_path: str | None
+
+    index = KeyFileIndex()
+    index.set_file("KEY-1", "a.py")
+    index.set_file("KEY-2", "a.py")
+    index.set_file("KEY-3", "b.py")
+    assert index.all_keys_located()
+    assert index.is_current_file("a.py")
+    assert not index.is_current_file(None)
+
+    index.reset_keys_for_relevant_files([File(new_path="a.py"), File(new_path=None)])
+    assert not index.all_keys_located()
+    assert not index.is_current_file("a.py")
+    assert index.is_current_file(None)
+
+    index.set_file("KEY-1", "c.py")
+    assert not index.all_keys_located()
+    index.set_file("KEY-2", "b.py")
+    assert index.all_keys_located()
+    index.set_file("KEY-3", "c.py")
+    assert index.is_current_file("b.py")
+    index.set_file("KEY-2", "c.py")
+    assert not index.is_current_file("b.py")
+
+
+def test_git_backend_matches_pydriller(
+    git_repo: Repo, tmp_path: Path, commit_files: CommitFiles
+):
+    with git_repo.config_writer() as writer:
+        writer.set_value("user", "name", "Author")
+        writer.set_value("user", "email", "author@example.com")
+    commit_files(
+        "first\n\nwith a body",
+        {
+            "a.py": decorated_function(key="KEY-1"),
+            "b.py": decorated_function(key="KEY-2"),
+        },
+    )
+    commit_files("empty file", {"empty.py": ""})
+    git_repo.git.checkout("-b", "feature")
+    commit_files("on a branch", {"a.py": decorated_function("return 1", "KEY-1")})
+    git_repo.git.checkout("main")
+    commit_files("on main", {"b.py": decorated_function("return 2", "KEY-2")})
+    git_repo.git.merge("feature", "--no-ff", "-m", "merge")
+    git_repo.git.mv("b.py", "renamed.py")
+    git_repo.index.commit("rename")
+    commit_files("delete", {"empty.py": None})
+    commit_files("add", {"c.py": decorated_function(key="KEY-3")})
+
+    config = PyTraceabilityConfig(
+        base_directory=tmp_path, history_config=HistoryModeConfig()
+    )
+    reports = PyTraceabilityCollector(
+        config.model_copy(update={"history_config": None})
+    ).collect()
+    histories = {
+        backend: get_line_based_history(
+            reports,
+            config.model_copy(
+                update={"history_config": HistoryModeConfig(backend=backend)}
+            ),
+        )
+        for backend in HistoryBackend
+    }
+    assert histories[HistoryBackend.GIT] == histories[HistoryBackend.PYDRILLER]
+    assert [h.message for h in histories[HistoryBackend.GIT]["KEY-2"]] == [
+        "on main",
+        "first\n\nwith a body",
+    ]
+
+
+def test_each_blob_is_only_parsed_once(
+    tmp_path: Path, commit_files: CommitFiles, parsed_files: list[Path]
+):
+    for body in ["pass", "return 1", "pass"]:
+        commit_files(body, {"file1.py": decorated_function(body)})
+
+    config = PyTraceabilityConfig(
+        base_directory=tmp_path,
+        history_config=HistoryModeConfig(),
+        cache_directory=tmp_path / "cache",
+    )
+    reports = PyTraceabilityCollector(
+        config.model_copy(update={"history_config": None})
+    ).collect()
+
+    history = get_line_based_history(reports, config)
+    assert [h.message for h in history["KEY-1"]] == ["pass", "return 1", "pass"]
+    assert history["KEY-1"][0].source_code == history["KEY-1"][2].source_code
+    assert len(parsed_files) == 2
+
+    assert get_line_based_history(reports, config) == history
+    assert len(parsed_files) == 2
+
+
+@pytest.mark.parametrize("lazy_source_code", [False, True])
+def test_versions_before_unrelated_changes_are_not_parsed(
+    tmp_path: Path,
+    commit_files: CommitFiles,
+    parsed_files: list[Path],
+    lazy_source_code: bool,
+):
+    decorated = "@traceability(\n    'KEY-1',\n)\ndef foo():\n    {}\n"
+    header = "import os\n\nX = 1\n"
+    footer = "def bar():\n    return 1\n"
+    versions = [
+        ("first", header, "pass", footer),
+        ("lines added above", "import os\nimport sys\n\nX = 1\n", "pass", footer),
+        ("lines changed below", header, "pass", "def bar():\n    return 2\n"),
+        ("decorated code changed", header, "return 1", footer),
+        ("lines removed above", "X = 1\n", "return 1", footer),
+        ("lines added at the end", "X = 1\n", "return 1", footer + "# end\n"),
+    ]
+    for message, header, body, footer in versions:
+        commit_files(
+            message, {"file1.py": f"{header}\n{decorated.format(body)}\n{footer}"}
+        )
+
+    config = PyTraceabilityConfig(
+        base_directory=tmp_path,
+        history_config=HistoryModeConfig(),
+        lazy_source_code=lazy_source_code,
+        no_cache=True,
+    )
+    reports = PyTraceabilityCollector(
+        config.model_copy(update={"history_config": None})
+    ).collect()
+
+    def get_history(backend: HistoryBackend) -> list[tuple[str, str | None]]:
+        backend_config = config.model_copy(
+            update={"history_config": HistoryModeConfig(backend=backend)}
+        )
+        with GitBlobReader(tmp_path) as git_blob_reader:
+            return [
+                (h.message, h.with_source_code(git_blob_reader).source_code)
+                for h in get_line_based_history(reports, backend_config)["KEY-1"]
+            ]
+
+    git_history = get_history(HistoryBackend.GIT)
+    assert len(parsed_files) == 2
+    assert git_history == get_history(HistoryBackend.PYDRILLER)
+    assert [source_code for _, source_code in git_history] == [
+        "def foo():\n    return 1",
+        "def foo():\n    return 1",
+        "def foo():\n    return 1",
+        "def foo():\n    pass",
+        "def foo():\n    pass",
+        "def foo():\n    pass",
+    ]
+
+
+def test_changed_mode_only_records_commits_that_change_the_code(
+    tmp_path: Path, commit_files: CommitFiles
+):
+    bar = "\ndef bar():\n    pass\n"
+    commit_files("first", {"file1.py": decorated_function("pass")})
+    commit_files("other code changed", {"file1.py": decorated_function("pass") + bar})
+    commit_files(
+        "reformatted", {"file1.py": decorated_function("pass  # comment") + bar}
+    )
+    commit_files("code changed", {"file1.py": decorated_function("return 1") + bar})
+    config = PyTraceabilityConfig(
+        base_directory=tmp_path,
+        history_config=HistoryModeConfig(history_mode=HistoryMode.CHANGED),
+        cache_directory=tmp_path / "cache",
+        incremental=True,
+    )
+
+    def collect_history(config: PyTraceabilityConfig) -> list[str]:
+        (report,) = PyTraceabilityCollector(config).collect()
+        return [h.message for h in report.history or []]
+
+    assert collect_history(config) == ["code changed", "first"]
+    commit_files(
+        "other code changed again", {"file1.py": decorated_function("return 1")}
+    )
+    assert collect_history(config) == ["code changed", "first"]
+    commit_files("code changed again", {"file1.py": decorated_function("return 2")})
+    assert collect_history(config) == ["code changed again", "code changed", "first"]
+    all_commits_config = config.model_copy(
+        update={"history_config": HistoryModeConfig(), "incremental": False}
+    )
+    assert len(collect_history(all_commits_config)) == 6
+
+
+def test_blame_mode_reports_the_newest_commit_for_each_key(
+    git_repo: Repo, tmp_path: Path, commit_files: CommitFiles
+):
+    def source(foo_body: str, bar_body: str) -> str:
+        return (
+            decorated_function(foo_body, "KEY-1")
+            + "\n\n"
+            + decorated_function(bar_body, "KEY-2", "bar")
+        )
+
+    commit_files("first", {"file1.py": source("pass", "pass")})
+    commit_files("foo changed", {"file1.py": source("return 1", "pass")})
+    commit_files("bar changed", {"file1.py": source("return 1", "return 2")})
+    commit_files("foo changed again", {"file1.py": source("return 3", "return 2")})
+    # Uncommitted, and moves bar down a line, so it doesn't match the branch
+    (tmp_path / "file1.py").write_text(source("return 3\n    return 4", "return 2"))
+    config = PyTraceabilityConfig(
+        base_directory=tmp_path,
+        history_config=HistoryModeConfig(history_mode=HistoryMode.BLAME),
+    )
+
+    reports = {r.key: r for r in PyTraceabilityCollector(config).collect()}
+    assert {
+        key: [h.message for h in r.history or []] for key, r in reports.items()
+    } == {
+        "KEY-1": ["foo changed again"],
+        "KEY-2": ["bar changed"],
+    }
+    (blame_entry,) = reports["KEY-2"].history or []
+    assert blame_entry.commit == git_repo.head.commit.parents[0].hexsha
+    assert blame_entry.author_name == git_repo.head.commit.author.name
+    assert blame_entry.source_code is None
+
+
+def test_blame_mode_includes_the_decorator_lines(
+    tmp_path: Path, commit_files: CommitFiles
+):
+    commit_files("first", {"file1.py": decorated_function()})
+    commit_files(
+        "metadata added",
+        {"file1.py": "@traceability('KEY-1', a='b')\ndef foo():\n    pass\n"},
+    )
+    config = PyTraceabilityConfig(
+        base_directory=tmp_path,
+        history_config=HistoryModeConfig(history_mode=HistoryMode.BLAME),
+    )
+
+    (report,) = PyTraceabilityCollector(config).collect()
+    assert [h.message for h in report.history or []] == ["metadata added"]
+
+
+def test_blame_mode_uses_the_branch_with_another_branch_checked_out(
+    git_repo: Repo, tmp_path: Path, commit_files: CommitFiles
+):
+    commit_files("first", {"file1.py": decorated_function()})
+    commit_files("foo changed", {"file1.py": decorated_function("return 1")})
+    git_repo.git.checkout("-b", "feature")
+    # Moves foo down, so the checked out line numbers don't match the main branch
+    commit_files(
+        "on a branch",
+        {"file1.py": "\n\n\n\n" + decorated_function("return 1")},
+    )
+    config = PyTraceabilityConfig(
+        base_directory=tmp_path,
+        history_config=HistoryModeConfig(
+            history_mode=HistoryMode.BLAME, git_branch="main"
+        ),
+    )
+
+    (report,) = PyTraceabilityCollector(config).collect()
+    assert [h.message for h in report.history or []] == ["foo changed"]
+
+
+@pytest.mark.parametrize("history_mode", [HistoryMode.ALL, HistoryMode.CHANGED])
+def test_key_history_follows_the_key_when_it_moves(
+    tmp_path: Path, commit_files: CommitFiles, history_mode: HistoryMode
+):
+    long_bar = "def bar():\n" + "".join(f"    x{idx} = {idx}\n" for idx in range(10))
+    bar = "def bar():\n    pass\n"
+    commit_files("first", {"file1.py": decorated_function() + "\n\n" + long_bar})
+    commit_files(
+        "foo changed",
+        {"file1.py": decorated_function("return 1") + "\n\n" + long_bar},
+    )
+    commit_files(
+        "other code changed",
+        {"file1.py": decorated_function("return 1") + "\n\n" + bar},
+    )
+    commit_files(
+        "moved within file",
+        {"file1.py": bar + "\n\n" + decorated_function("return 1")},
+    )
+    commit_files(
+        "moved to another file",
+        {"file1.py": bar, "file2.py": decorated_function("return 1")},
+    )
+    commit_files("foo changed again", {"file2.py": decorated_function("return 2")})
+    config = PyTraceabilityConfig(
+        base_directory=tmp_path,
+        history_config=HistoryModeConfig(history_mode=history_mode),
+    )
+
+    (report,) = PyTraceabilityCollector(config).collect_key_history({"KEY-1"})
+    key_history = report.history or []
+    (walked_report,) = PyTraceabilityCollector(config).collect()
+    walked_history = walked_report.history or []
+    messages = [h.message for h in key_history]
+    if history_mode == HistoryMode.CHANGED:
+        assert key_history == walked_history
+        assert messages == ["foo changed again", "foo changed", "first"]
+    else:
+        assert messages[:2] == ["foo changed again", "moved to another file"]
+        assert messages[-2:] == ["foo changed", "first"]
+        assert "other code changed" not in messages
+        walked_entries = {h.commit: h for h in walked_history}
+        assert all(h == walked_entries[h.commit] for h in key_history)
+
+
+def test_key_history_follows_a_key_read_from_a_constant(
+    tmp_path: Path, commit_files: CommitFiles
+):
+    def source(body: str) -> str:
+        return f"from constants import KEY\n\n\n@traceability(KEY)\ndef foo():\n    {body}\n"
+
+    commit_files(
+        "first", {"constants.py": "KEY = 'KEY-1'\n", "file1.py": source("pass")}
+    )
+    commit_files("foo changed", {"file1.py": source("return 1")})
+    # Only constants.py has the key written out in it
+    commit_files(
+        "moved to another file", {"file1.py": None, "file2.py": source("return 1")}
+    )
+    commit_files("foo changed again", {"file2.py": source("return 2")})
+    config = PyTraceabilityConfig(
+        base_directory=tmp_path,
+        history_config=HistoryModeConfig(history_mode=HistoryMode.CHANGED),
+    )
+
+    (report,) = PyTraceabilityCollector(config).collect_key_history({"KEY-1"})
+    assert [h.message for h in report.history or []] == [
+        "foo changed again",
+        "foo changed",
+        "first",
+    ]
+
+
+@pytest.mark.parametrize("lazy_source_code", [False, True])
+def test_history_source_diffs_rebuild_the_snapshots(
+    tmp_path: Path, commit_files: CommitFiles, lazy_source_code: bool
+):
+    body = "".join(f"x{idx} = {idx}\n    " for idx in range(20))
+    for idx in range(3):
+        commit_files(
+            f"commit {idx}", {"file1.py": decorated_function(f"{body}return {idx}")}
+        )
+    config = PyTraceabilityConfig(
+        base_directory=tmp_path,
+        history_config=HistoryModeConfig(),
+        output_format=OutputFormats.JSON,
+        lazy_source_code=lazy_source_code,
+    )
+    diffs_config = config.model_copy(
+        update={"history_config": HistoryModeConfig(source_diffs=True)}
+    )
+
+    def load_report(config: PyTraceabilityConfig):
+        (output,) = PyTraceabilityCollector(config).get_printable_output()
+        (report,) = load_traceability_summary(output).reports
+        return report
+
+    report = load_report(config)
+    diffs_report = load_report(diffs_config)
+    assert [h.source_code is None for h in diffs_report.history or []] == [
+        False,
+        True,
+        True,
+    ]
+    assert diffs_report.history is not None
+    assert (
+        diffs_report.history[1].source_diff
+        == "@@ -22 +22 @@\n-    return 2\n+    return 1"
+    )
+    assert diffs_report.with_history_snapshots() == report
+
+
+def test_incremental_history_only_walks_new_commits(
+    git_repo: Repo, tmp_path: Path, commit_files: CommitFiles, monkeypatch
+):
+    def commit(body: str) -> None:
+        commit_files(body, {"file1.py": decorated_function(body)})
+
+    commit("pass")
+    commit("return 1")
+    config = PyTraceabilityConfig(
+        base_directory=tmp_path,
+        history_config=HistoryModeConfig(),
+        cache_directory=tmp_path / "cache",
+        incremental=True,
+    )
+    full_config = config.model_copy(update={"incremental": False})
+
+    def collect_history(config: PyTraceabilityConfig) -> dict:
+        return {
+            r.key: [(h.commit, h.source_code) for h in r.history or []]
+            for r in PyTraceabilityCollector(config).collect()
+        }
+
+    assert collect_history(config) == collect_history(full_config)
+
+    walked_revisions = []
+    iter_history_commits = history.iter_history_commits
+
+    def spy(repo, revision):
+        walked_revisions.append(revision)
+        return iter_history_commits(repo, revision)
+
+    monkeypatch.setattr(history, "iter_history_commits", spy)
+    previous_head = git_repo.head.commit.hexsha
+    commit("return 2")
+    assert collect_history(config) == collect_history(full_config)
+    assert walked_revisions[0] == f"{previous_head}..{git_repo.head.commit.hexsha}"
+    assert len(collect_history(config)["KEY-1"]) == 3
+
+    # Rewriting the branch means the whole history has to be walked again
+    git_repo.git.reset("--hard", "HEAD~2")
+    commit("return 3")
+    walked_revisions.clear()
+    assert collect_history(config) == collect_history(full_config)
+    assert walked_revisions[0] == git_repo.head.commit.hexsha
+    assert len(collect_history(config)["KEY-1"]) == 2
+
+
+def test_history_baseline_keeps_what_the_next_run_needs(
+    git_repo: Repo, tmp_path: Path, commit_files: CommitFiles
+):
+    commit_files("first", {"file1.py": decorated_function()})
+    config = PyTraceabilityConfig(
+        base_directory=tmp_path,
+        history_config=HistoryModeConfig(),
+        cache_directory=tmp_path / "cache",
+    )
+    entry = TraceabilityGitHistory(
+        commit=git_repo.head.commit.hexsha,
+        author_name="Author",
+        author_date=git_repo.head.commit.authored_datetime,
+        message="first",
+        source_code="def foo():\n    pass",
+    )
+    entry._code_hash = "code-hash"
+    entry.defer_source_code("file1.py", SourceSpan(2, 0, 3, 8))
+    incremental_history = IncrementalHistory(config)
+    incremental_history.save_baseline(entry.commit, {"KEY-1": [entry]})
+
+    baseline = incremental_history.load_baseline(entry.commit)
+    assert baseline is not None
+    (loaded_entry,) = baseline.history["KEY-1"]
+    assert loaded_entry == entry
+    assert loaded_entry._code_hash == "code-hash"
+    with GitBlobReader(tmp_path) as git_blob_reader:
+        loaded_entry = loaded_entry.with_source_code(git_blob_reader)
+    assert loaded_entry.source_code == "def foo():\n    pass"
+
+
+def test_history_ignores_keys_that_have_been_removed(
+    commit_files: CommitFiles, config: PyTraceabilityConfig
+):
+    for keys in [["KEY-1", "KEY-2"], ["KEY-1"]]:
+        commit_files(
+            " ".join(keys),
+            {
+                "file1.py": "".join(
+                    decorated_function(key=key, name=f"foo{key[-1]}") for key in keys
+                )
+            },
+        )
+
+    reports = PyTraceabilityCollector(config).collect()
+    assert [(r.key, len(r.history or [])) for r in reports] == [("KEY-1", 2)]
+
+
+def test_parallel_history_matches_serial_history(
+    tmp_path: Path, commit_files: CommitFiles, monkeypatch
+):
+    monkeypatch.setattr(history, "_COMMITS_PER_CHUNK", 2)
+    for idx in range(10):
+        commit_files(
+            f"commit {idx}",
+            {
+                f"file{file_idx}.py": decorated_function(
+                    f"return {idx}", f"KEY-{file_idx}"
+                )
+                for file_idx in range(idx % 3 + 1)
+            },
+        )
+
+    config = PyTraceabilityConfig(
+        base_directory=tmp_path, history_config=HistoryModeConfig(), no_cache=True
+    )
+    reports = PyTraceabilityCollector(
+        config.model_copy(update={"history_config": None})
+    ).collect()
+    serial = get_line_based_history(reports, config)
+    parallel = get_line_based_history(reports, config.model_copy(update={"jobs": 2}))
+    assert parallel == serial
+    assert [h.message for h in parallel["KEY-2"]] == [
+        "commit 8",
+        "commit 5",
+        "commit 2",
+    ]
+
+
+class _InlineExecutor:
+    """
+    Runs each chunk as it's submitted, in this process, so the files it parses are
+    seen by parsed_files.
+    """
+
+    def __init__(self, max_workers: int) -> None:
+        pass
+
+    def __enter__(self) -> _InlineExecutor:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def submit(self, fn, *args) -> Future:
+        future: Future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+@pytest.mark.parametrize("commits_per_chunk", [1, 2, 64])
+def test_parallel_history_doesnt_parse_versions_before_unrelated_changes(
+    tmp_path: Path,
+    commit_files: CommitFiles,
+    parsed_files: list[Path],
+    monkeypatch,
+    commits_per_chunk: int,
+):
+    monkeypatch.setattr(history, "_COMMITS_PER_CHUNK", commits_per_chunk)
+    monkeypatch.setattr(history, "ProcessPoolExecutor", _InlineExecutor)
+    footer = "def bar():\n    return 1\n"
+    for message, header, body, footer in [
+        ("first", "import os\n\nX = 1\n", "pass", footer),
+        ("lines added above", "import os\nimport sys\n\nX = 1\n", "pass", footer),
+        ("decorated code changed", "import sys\n\nX = 1\n", "return 1", footer),
+        ("lines removed above", "X = 1\n", "return 1", footer),
+        ("lines changed below", "X = 1\n", "return 1", "def bar():\n    pass\n"),
+    ]:
+        commit_files(
+            message,
+            {"file1.py": f"{header}\n{decorated_function(body)}\n{footer}"},
+        )
+
+    config = PyTraceabilityConfig(
+        base_directory=tmp_path,
+        history_config=HistoryModeConfig(),
+        no_cache=True,
+        jobs=2,
+    )
+    reports = PyTraceabilityCollector(
+        config.model_copy(update={"history_config": None})
+    ).collect()
+    parsed_files.clear()
+
+    parallel = get_line_based_history(reports, config)
+    assert len(parsed_files) == 2
+    assert parallel == get_line_based_history(
+        reports, config.model_copy(update={"jobs": 1})
+    )
+    assert len(parsed_files) == 4
@@ -4,6 +4,7 @@ from git import Repo
 
 from pytraceability.collector import PyTraceabilityCollector
 from pytraceability.config import PyTraceabilityConfig, OutputFormats, HistoryModeConfig
+from tests.conftest import CommitFiles, decorated_function
 
 
 def test_html(directory_with_two_files: Path, git_repo: Repo):
@@ -78,3 +79,18 @@ def test_html(directory_with_two_files: Path, git_repo: Repo):
    </tbody>
    </table>""".splitlines()
     ]
+
+
+def test_html_shows_what_each_commit_changed(tmp_path: Path, commit_files: CommitFiles):
+    for body in ["pass", "return 1"]:
+        commit_files(body, {"file1.py": decorated_function(body)})
+    config = PyTraceabilityConfig(
+        base_directory=tmp_path,
+        output_format=OutputFormats.HTML,
+        history_config=HistoryModeConfig(source_diffs=True),
+        lazy_source_code=True,
+    )
+
+    html_report = "\n".join(PyTraceabilityCollector(config).get_printable_output())
+    assert "<pre>@@ -2 +2 @@\n-    pass\n+    return 1</pre>" in html_report
+    assert "<pre>def foo():\n    pass</pre>" in html_report
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+import ast
+from textwrap import dedent
+
+import pytest
+
+from pytraceability.source import (
+    SourceIndex,
+    SourceSpan,
+    apply_source_diff,
+    make_source_diff,
+)
+
+
+@pytest.mark.parametrize(
+    "source_code",
+    [
+        dedent("""\
+        x = 1
+        def foo():
+            return {"a": [1, 2]}
+
+        class Bar:
+            y = "é" + "ü"; z = ("ß",
+                "ø")
+        """),
+        "def foo():\r\n    return 1\r\nx = 'é'\r\n",
+        "x = 1\rdef foo():\r    return 'ü'\r",
+        "x = 'no trailing newline'",
+    ],
+)
+def test_segments_match_ast_get_source_segment(source_code: str):
+    source_index = SourceIndex(source_code)
+    for node in ast.walk(ast.parse(source_code)):
+        if isinstance(node, (ast.stmt, ast.expr)):
+            assert source_index.get_segment(
+                SourceSpan.from_node(node)
+            ) == ast.get_source_segment(source_code, node)
+
+
+def test_segment_without_an_end_position_is_none():
+    assert SourceIndex("x = 1\n").get_segment(SourceSpan(1, 0, None, None)) is None
+
+
+@pytest.mark.parametrize(
+    "from_source,to_source",
+    [
+        ("def foo():\n    pass", "def foo():\n    return 1"),
+        ("def foo():\n    pass", "def foo():\n    pass"),
+        ("def foo():\n    pass", "@x\ndef foo():\n\n    pass\n"),
+        ("a\nb\nc\nd", "b\nd\ne"),
+        ("-- a\n++ b", "+++ b\n--- a\r"),
+        ("", "def foo():\n    pass"),
+    ],
+)
+def test_source_diffs_rebuild_the_source_exactly(from_source: str, to_source: str):
+    source_diff = make_source_diff(from_source, to_source)
+    assert apply_source_diff(from_source, source_diff) == to_source
@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from textwrap import dedent
+
+import pytest
+from click.testing import CliRunner
+
+from pytraceability.cli import main
+from pytraceability.config import (
+    OutputFormats,
+    PyTraceabilityConfig,
+    PyTraceabilityMode,
+)
+from pytraceability.watch import ReportWatcher
+from tests.conftest import write_traceability_file
+
+
+def _write_text_and_bump_mtime(file_path: Path, text: str) -> None:
+    # Rewrites within the file system's timestamp granularity can leave the mtime
+    # unchanged, so move it on explicitly to look like a later save
+    mtime_ns = file_path.stat().st_mtime_ns if file_path.exists() else 0
+    file_path.write_text(text)
+    os.utime(file_path, ns=(mtime_ns + 10**9, mtime_ns + 10**9))
+
+
+def _write_and_bump_mtime(file_path: Path, idx: int) -> None:
+    write_traceability_file(file_path, idx)
+    _write_text_and_bump_mtime(file_path, file_path.read_text())
+
+
+@pytest.fixture
+def watcher(directory_with_two_files: Path, tmp_path_factory) -> ReportWatcher:
+    config = PyTraceabilityConfig(
+        base_directory=directory_with_two_files,
+        output_format=OutputFormats.KEY_ONLY,
+        no_cache=True,
+    )
+    output_file = tmp_path_factory.mktemp("output") / "report.txt"
+    return ReportWatcher(config, output_file, debounce_seconds=0)
+
+
+def test_build_writes_the_report(watcher: ReportWatcher):
+    assert watcher.build()
+    assert watcher.output_file.read_text() == "KEY-1\nKEY-2\n"
+    assert not watcher.update()
+
+
+def test_update_only_re_extracts_changed_files(
+    watcher: ReportWatcher, directory_with_two_files: Path, monkeypatch
+):
+    watcher.build()
+    extracted_files = []
+    extract_reports_from_files = watcher._extract_reports_from_files
+
+    def _record_extracted_files(file_paths):
+        file_paths = list(file_paths)
+        extracted_files.extend(file_paths)
+        return extract_reports_from_files(file_paths)
+
+    monkeypatch.setattr(watcher, "_extract_reports_from_files", _record_extracted_files)
+    _write_and_bump_mtime(directory_with_two_files / "file2.py", 3)
+
+    assert watcher.update()
+    assert extracted_files == [directory_with_two_files / "file2.py"]
+    assert watcher.output_file.read_text() == "KEY-1\nKEY-3\n"
+
+
+def test_update_handles_added_and_removed_files(
+    watcher: ReportWatcher, directory_with_two_files: Path
+):
+    watcher.build()
+    (directory_with_two_files / "file1.py").unlink()
+    _write_and_bump_mtime(directory_with_two_files / "file3.py", 3)
+
+    assert watcher.update()
+    assert watcher.output_file.read_text() == "KEY-2\nKEY-3\n"
+
+
+def test_output_is_not_rewritten_when_the_result_is_unchanged(
+    watcher: ReportWatcher, directory_with_two_files: Path
+):
+    watcher.build()
+    file_path = directory_with_two_files / "file1.py"
+    file_path.write_text("# A comment\n" + file_path.read_text())
+
+    assert not watcher.update()
+    assert watcher.output_file.read_text() == "KEY-1\nKEY-2\n"
+
+
+def test_invalid_change_keeps_the_previous_report(
+    watcher: ReportWatcher, directory_with_two_files: Path, caplog
+):
+    watcher.build()
+    _write_and_bump_mtime(directory_with_two_files / "file2.py", 1)
+
+    assert not watcher.update()
+    assert "KEY-1 is duplicated" in caplog.text
+    assert watcher.output_file.read_text() == "KEY-1\nKEY-2\n"
+
+    _write_and_bump_mtime(directory_with_two_files / "file2.py", 3)
+    assert watcher.update()
+    assert watcher.output_file.read_text() == "KEY-1\nKEY-3\n"
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_invalid_file_doesnt_extract_the_other_files_one_at_a_time(
+    tmp_path: Path, jobs: int, monkeypatch
+):
+    for idx in range(1, 11):
+        write_traceability_file(tmp_path / f"file{idx}.py", idx)
+    (tmp_path / "file3.py").write_text(
+        "@traceability('KEY-3', 'KEY-4')\ndef foo():\n    pass\n"
+    )
+    config = PyTraceabilityConfig(base_directory=tmp_path, no_cache=True, jobs=jobs)
+    watcher = ReportWatcher(config, tmp_path / "report.txt", debounce_seconds=0)
+    extraction_passes = []
+    extract_reports_from_files = watcher._extract_reports_from_files
+
+    def _record_extraction_passes(file_paths):
+        extraction_passes.append(len(file_paths))
+        return extract_reports_from_files(file_paths)
+
+    monkeypatch.setattr(
+        watcher, "_extract_reports_from_files", _record_extraction_passes
+    )
+
+    assert watcher.build()
+    # Carries on after file3.py, which is listed after file1.py, file10.py and file2.py
+    assert extraction_passes == [10, 6]
+    assert watcher.output_file.read_text().split() == sorted(
+        f"KEY-{idx}" for idx in range(1, 11) if idx != 3
+    )
+
+
+def test_update_waits_for_a_burst_of_saves_to_finish(
+    watcher: ReportWatcher, directory_with_two_files: Path, monkeypatch
+):
+    watcher.build()
+    file_path = directory_with_two_files / "file2.py"
+    saves = iter([4, 5])
+
+    def _save_during_sleep(seconds):
+        for idx in saves:
+            _write_and_bump_mtime(file_path, idx)
+            return
+
+    monkeypatch.setattr("pytraceability.watch.time.sleep", _save_during_sleep)
+    _write_and_bump_mtime(file_path, 3)
+
+    assert watcher.update()
+    assert watcher.output_file.read_text() == "KEY-1\nKEY-5\n"
+    assert not watcher.update()
+
+
+@pytest.mark.parametrize("no_cache", [True, False])
+def test_update_imports_modules_again_when_their_imports_change(
+    tmp_path: Path, no_cache: bool, monkeypatch
+):
+    base_directory = tmp_path / "src"
+    base_directory.mkdir()
+    monkeypatch.syspath_prepend(str(base_directory))
+    (base_directory / "a.py").write_text(
+        dedent("""\
+        from pytraceability.common import traceability
+        from b import compute
+
+        @traceability("KEY-1", info=compute())
+        def foo():
+            pass
+        """)
+    )
+    (base_directory / "b.py").write_text("def compute():\n    return 'one'\n")
+    config = PyTraceabilityConfig(
+        base_directory=base_directory,
+        mode=PyTraceabilityMode.MODULE_IMPORT,
+        output_format=OutputFormats.JSON,
+        no_cache=no_cache,
+        cache_directory=tmp_path / "cache",
+    )
+    watcher = ReportWatcher(config, tmp_path / "report.json", debounce_seconds=0)
+
+    def written_metadata() -> dict:
+        (report,) = json.loads(watcher.output_file.read_text())["reports"]
+        return report["metadata"]
+
+    assert watcher.build()
+    assert written_metadata() == {"info": "one"}
+    _write_text_and_bump_mtime(
+        base_directory / "b.py", "def compute():\n    return 'two'\n"
+    )
+    assert watcher.update()
+    assert written_metadata() == {"info": "two"}
+
+
+def test_watch_cli(directory_with_two_files: Path, tmp_path_factory, monkeypatch):
+    output_file = tmp_path_factory.mktemp("output") / "report.txt"
+    monkeypatch.setattr(ReportWatcher, "run", ReportWatcher.build)
+
+    result = CliRunner().invoke(
+        main,
+        [
+            f"--base-directory={directory_with_two_files}",
+            f"--output-format={OutputFormats.KEY_ONLY.value}",
+            "--no-cache",
+            "watch",
+            f"--output-file={output_file}",
+        ],
+    )
+
+    assert result.exit_code == 0, result.output
+    assert output_file.read_text() == "KEY-1\nKEY-2\n"